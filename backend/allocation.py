@@ -0,0 +1,229 @@
+"""
+Reduction Allocation Solver
+
+Finds the cheapest mix of regressor reductions that meets an emissions
+target. The optimization model is linear, so cutting regressor j by r_j
+percent of its mean over a horizon of H steps saves
+
+    effect_j * r_j,   effect_j = H * coef_j * mean_j / 100
+
+Each lever has a piecewise-linear cost curve: a marginal cost per
+percentage point that may rise from one segment to the next (convex
+costs). With one variable per curve segment the problem is the LP
+
+    minimize    sum_k cost_k s_k
+    subject to  sum_k effect_{j(k)} s_k >= target
+                sum_{k in j} s_k >= min_pct_j
+                0 <= s_k <= width_k
+
+which is solved with scipy's HiGHS. The LP has a single coupling
+constraint, so its whole cost/reduction frontier is the cumulative sum
+of the segments sorted by cost per unit of emissions saved; the frontier
+is evaluated for every requested target at once from those breakpoints.
+"""
+
+import numpy as np
+from scipy.optimize import linprog
+
+# Targets sampled along the frontier unless the request asks for another number
+FRONTIER_POINTS = 21
+
+# Upper bound on the frontier points a request may ask for
+MAX_FRONTIER_POINTS = 1000
+
+
+class AllocationError(ValueError):
+    """Raised when levers or targets cannot be allocated"""
+
+
+class Levers:
+    """
+    Cost-curve segments of the reduction levers
+
+    Attributes:
+        names: Regressor of every lever
+        min_pct, max_pct: Reduction bounds of every lever, in percent
+        lever: Lever index of every segment
+        start, width: Segment start and width, in percent
+        cost: Marginal cost per percentage point of every segment
+    """
+    def __init__(self, names, min_pct, max_pct, lever, start, width, cost):
+        self.names = list(names)
+        self.min_pct = np.asarray(min_pct, dtype=np.float64)
+        self.max_pct = np.asarray(max_pct, dtype=np.float64)
+        self.lever = np.asarray(lever, dtype=np.intp)
+        self.start = np.asarray(start, dtype=np.float64)
+        self.width = np.asarray(width, dtype=np.float64)
+        self.cost = np.asarray(cost, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.names)
+
+    def mandatory(self):
+        """Per-segment fill that the min_pct bounds force, cheapest segments first"""
+        return np.clip(self.min_pct[self.lever] - self.start, 0, self.width)
+
+    def totals(self, fill):
+        """Reduction percent per lever of a (... x segments) fill"""
+        return np.asarray(fill, dtype=np.float64) @ (self.lever[:, None] == np.arange(len(self)))
+
+
+def _number(value, name):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise AllocationError(f"{name} must be a number")
+    if not np.isfinite(value):
+        raise AllocationError(f"{name} must be finite")
+    return value
+
+
+def parse_levers(specs, regressors):
+    """
+    Validate lever specifications
+
+    Every spec names a `regressor` and its cost as either a flat
+    `cost_per_pct` or a `cost_curve` of {"up_to_pct", "cost_per_pct"}
+    segments with nondecreasing marginal costs. Optional `min_pct` and
+    `max_pct` bound the reduction (default 0 and 100, or the end of the
+    cost curve).
+
+    Args:
+        specs: List of lever dicts
+        regressors: Regressors the model can reduce
+
+    Returns:
+        Levers
+
+    Raises:
+        AllocationError: for unknown or duplicate regressors, bounds outside
+            [0, 100] and cost curves that are not convex
+    """
+    if not specs or not isinstance(specs, list):
+        raise AllocationError("At least one lever with a cost curve is required")
+
+    names, min_pcts, max_pcts = [], [], []
+    lever, start, width, cost = [], [], [], []
+    for spec in specs:
+        if not isinstance(spec, dict):
+            raise AllocationError("Levers must be objects")
+        name = spec.get('regressor')
+        if name not in regressors:
+            raise AllocationError(f"Unknown regressor: {name}. Available: {', '.join(regressors)}")
+        if name in names:
+            raise AllocationError(f"Duplicate lever for {name}")
+
+        if 'cost_curve' in spec:
+            curve = spec['cost_curve']
+            if not curve or not isinstance(curve, list):
+                raise AllocationError(f"cost_curve of {name} must be a non-empty list")
+            ends = [_number(point.get('up_to_pct') if isinstance(point, dict) else None, f"up_to_pct of {name}")
+                    for point in curve]
+            costs = [_number(point.get('cost_per_pct'), f"cost_per_pct of {name}") for point in curve]
+        elif 'cost_per_pct' in spec:
+            ends = [100.0]
+            costs = [_number(spec['cost_per_pct'], f"cost_per_pct of {name}")]
+        else:
+            raise AllocationError(f"Lever {name} needs cost_per_pct or cost_curve")
+
+        ends = np.asarray(ends)
+        costs = np.asarray(costs)
+        if np.any(np.diff(ends) <= 0) or ends[0] <= 0 or ends[-1] > 100:
+            raise AllocationError(f"up_to_pct of {name} must increase within (0, 100]")
+        if np.any(costs < 0):
+            raise AllocationError(f"Costs of {name} must not be negative")
+        if np.any(np.diff(costs) < 0):
+            raise AllocationError(f"Marginal costs of {name} must not decrease")
+
+        max_pct = min(_number(spec.get('max_pct', ends[-1]), f"max_pct of {name}"), ends[-1])
+        min_pct = _number(spec.get('min_pct', 0), f"min_pct of {name}")
+        if not 0 <= min_pct <= max_pct:
+            raise AllocationError(f"Bounds of {name} must satisfy 0 <= min_pct <= max_pct <= {ends[-1]:g}")
+
+        starts = np.concatenate([[0.0], ends[:-1]])
+        widths = np.clip(np.minimum(ends, max_pct) - starts, 0, None)
+        keep = widths > 0
+        index = len(names)
+        names.append(name)
+        min_pcts.append(min_pct)
+        max_pcts.append(max_pct)
+        lever.extend([index] * int(keep.sum()))
+        start.extend(starts[keep])
+        width.extend(widths[keep])
+        cost.extend(costs[keep])
+
+    if not width:
+        raise AllocationError("The levers allow no reduction")
+    return Levers(names, min_pcts, max_pcts, lever, start, width, cost)
+
+
+def solve(levers, effects, target):
+    """
+    Cheapest allocation that saves at least `target`
+
+    Args:
+        levers: Levers
+        effects: Emissions saved per percentage point of every lever
+        target: Emissions reduction to reach
+
+    Returns:
+        (reduction percent per lever, cost, reduction) or None when the
+        target is out of reach
+    """
+    effects = np.asarray(effects, dtype=np.float64)
+    n_segments = len(levers.width)
+    bounded = np.flatnonzero(levers.min_pct > 0)
+    A_ub = np.zeros((1 + len(bounded), n_segments))
+    A_ub[0] = -effects[levers.lever]
+    A_ub[1:] = -(levers.lever[None, :] == bounded[:, None]).astype(np.float64)
+    b_ub = np.concatenate([[-target], -levers.min_pct[bounded]])
+
+    result = linprog(levers.cost, A_ub=A_ub, b_ub=b_ub,
+                     bounds=np.column_stack([np.zeros(n_segments), levers.width]), method='highs')
+    if result.status == 2:
+        return None
+    if result.status != 0:
+        raise AllocationError(f"Allocation solver failed: {result.message}")
+    fill = result.x
+    return levers.totals(fill), float(levers.cost @ fill), float(effects[levers.lever] @ fill)
+
+
+def frontier(levers, effects, points=FRONTIER_POINTS):
+    """
+    Minimum cost of evenly spaced reductions, from the forced minimum to the maximum
+
+    Segments beyond the min_pct bounds are filled in order of cost per
+    unit of emissions saved; levers that do not lower emissions are left
+    at their minimum. Cost and allocation are linear between the
+    breakpoints, so every point is interpolated at once.
+
+    Returns:
+        (reductions, costs, allocations) arrays of shape (points,),
+        (points,) and (points x levers)
+    """
+    effects = np.asarray(effects, dtype=np.float64)
+    segment_effect = effects[levers.lever]
+    forced = levers.mandatory()
+    free = levers.width - forced
+
+    candidates = np.flatnonzero((free > 0) & (segment_effect > 0))
+    # Stable sort keeps a lever's segments in curve order on ties
+    candidates = candidates[np.argsort(levers.cost[candidates] / segment_effect[candidates], kind='stable')]
+
+    steps = np.zeros((len(candidates) + 1, len(levers)))
+    steps[np.arange(1, len(candidates) + 1), levers.lever[candidates]] = free[candidates]
+    allocation = np.cumsum(steps, axis=0) + levers.totals(forced)
+    reduction = np.concatenate([[0.0], np.cumsum(free[candidates] * segment_effect[candidates])]) \
+        + forced @ segment_effect
+    cost = np.concatenate([[0.0], np.cumsum(free[candidates] * levers.cost[candidates])]) \
+        + forced @ levers.cost
+
+    targets = np.linspace(reduction[0], reduction[-1], points)
+    if len(candidates) == 0:
+        return targets, np.full(points, cost[0]), np.repeat(allocation[:1], points, axis=0)
+    index = np.clip(np.searchsorted(reduction, targets, side='right') - 1, 0, len(candidates) - 1)
+    span = reduction[index + 1] - reduction[index]
+    weight = np.divide(targets - reduction[index], span, out=np.zeros(points), where=span > 0)
+    costs = cost[index] + weight * (cost[index + 1] - cost[index])
+    allocations = allocation[index] + weight[:, None] * (allocation[index + 1] - allocation[index])
+    return targets, costs, allocations
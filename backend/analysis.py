@@ -0,0 +1,173 @@
+"""
+Per-dataset Analysis Context
+
+predict(), optimize() and export used to clean the same payload, recompute
+the same regressor means and refit the same linear models independently.
+This module computes that work once per dataset and memoizes it by the
+CarbonDataset fingerprint, so back-to-back requests on an identical
+payload reuse the metric matrix, the means and the fitted coefficients.
+
+Contexts live in a per-worker LRU; the dataset and the endpoint results
+are also written to the shared cache, so an analysis_id returned by one
+worker can be resolved (and its results exported) by any other.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from dataset import CarbonDataset, widen
+from regression import SufficientStatsRegressor
+from shared_cache import shared_cache
+
+# Regressor columns shared by the forecasting and optimization endpoints
+REGRESSOR_COLUMNS = ['energy_kwh', 'transport_km', 'waste_kg', 'water_m3',
+                     'fuel_l', 'production_units', 'grid_intensity']
+
+# Number of dataset contexts kept in memory per worker
+MAX_CONTEXTS = int(os.environ.get('CARBONSYNC_ANALYSIS_CACHE_SIZE', 32))
+
+
+class AnalysisContext:
+    """
+    Metric matrix and fitted linear models for one dataset.
+
+    Attributes:
+        fingerprint: Dataset fingerprint used as the memo key
+        data: Date-sorted CarbonDataset
+        present_columns: Regressor columns that were present in the payload
+        means: Mean of each regressor column (missing values count as 0)
+        stats: SufficientStatsRegressor over time_idx and every regressor
+        results: Endpoint results cached for later export calls (see save_results)
+        engine: Forecast engine chosen for engine='auto' (see model_selection.py)
+    """
+    def __init__(self, fingerprint, data):
+        self.fingerprint = fingerprint
+        self.data = data
+        self.present_columns = [col for col in REGRESSOR_COLUMNS if data.has(col)]
+
+        # One float64 copy of the regressors (missing -> 0) feeds both the
+        # means and the regression statistics
+        regressors = data.filled(REGRESSOR_COLUMNS)
+        means = regressors.mean(axis=0) if len(data) else np.zeros(len(REGRESSOR_COLUMNS))
+        self.means = pd.Series(means, index=REGRESSOR_COLUMNS)
+
+        y = widen(data.column('y'))
+        observed = ~np.isnan(y)
+        X = np.column_stack([np.arange(len(data), dtype=np.float64), regressors])
+        self.stats = SufficientStatsRegressor(['time_idx'] + REGRESSOR_COLUMNS).partial_fit(X[observed], y[observed])
+
+        self.results = shared_cache.get(f"results:{fingerprint}") or {}
+        self.engine = None
+        self._frame = None
+        self._fits = {}
+        self._lock = threading.Lock()
+
+    @property
+    def frame(self):
+        """
+        DataFrame for Prophet: ds, float regressors (missing -> 0), y and time_idx
+
+        Built on first use only; the linear paths work on the matrix.
+        """
+        if self._frame is None:
+            df = self.data.to_frame(REGRESSOR_COLUMNS + ['y'])
+            df[REGRESSOR_COLUMNS] = df[REGRESSOR_COLUMNS].fillna(0)
+            df['time_idx'] = np.arange(len(df))
+            self._frame = df
+        return self._frame
+
+    def save_results(self, **results):
+        """Record endpoint results on the context and in the shared cache"""
+        self.results.update(results)
+        shared_cache.set(f"results:{self.fingerprint}", self.results)
+
+    def fit(self, features):
+        """Return the (memoized) OLS fit of y on the given features"""
+        key = tuple(features)
+        with self._lock:
+            fit = self._fits.get(key)
+        if fit is None:
+            fit = self.stats.solve(features)
+            with self._lock:
+                self._fits[key] = fit
+        return fit
+
+    def residual_std(self, features):
+        """Residual standard deviation of the fit on the given features"""
+        return self.fit(features).residual_std
+
+
+_contexts = OrderedDict()
+_contexts_lock = threading.Lock()
+
+
+def _remember(ctx):
+    """Add a context to the LRU unless another request already added one"""
+    with _contexts_lock:
+        existing = _contexts.get(ctx.fingerprint)
+        if existing is not None:
+            return existing
+        _contexts[ctx.fingerprint] = ctx
+        while len(_contexts) > MAX_CONTEXTS:
+            _contexts.popitem(last=False)
+    return ctx
+
+
+def lookup_context(fingerprint):
+    """
+    Return a context by fingerprint, or None if it is not cached
+
+    A context analysed by another worker is rebuilt from the dataset in
+    the shared cache.
+    """
+    with _contexts_lock:
+        ctx = _contexts.get(fingerprint)
+        if ctx is not None:
+            _contexts.move_to_end(fingerprint)
+            return ctx
+
+    if not isinstance(fingerprint, str) or not fingerprint:
+        return None
+    data = shared_cache.get(f"dataset:{fingerprint}")
+    if data is None:
+        return None
+    return _remember(AnalysisContext(fingerprint, data))
+
+
+def get_context(data):
+    """
+    Return the analysis context for a dataset
+
+    The context is built once per fingerprint and kept in a bounded LRU,
+    so repeated predict/optimize calls on the same data skip the cleaning
+    and regression work.
+
+    Args:
+        data: CarbonDataset, or a DataFrame from a request payload (needs 'ds')
+
+    Returns:
+        AnalysisContext
+    """
+    if not isinstance(data, CarbonDataset):
+        data = CarbonDataset.from_frame(data)
+    fingerprint = data.fingerprint()
+    ctx = lookup_context(fingerprint)
+    if ctx is not None:
+        return ctx
+
+    ctx = AnalysisContext(fingerprint, data)
+    # Publish the dataset so other workers can resolve this analysis_id
+    if not shared_cache.contains(f"dataset:{fingerprint}"):
+        shared_cache.set(f"dataset:{fingerprint}", data)
+    # Another request may have built the same context concurrently
+    return _remember(ctx)
+
+
+def clear_contexts():
+    """Drop every memoized context"""
+    with _contexts_lock:
+        _contexts.clear()
@@ -1,36 +1,56 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, Response, stream_with_context, send_file
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager, create_access_token, create_refresh_token, get_jwt_identity, jwt_required
 from flask_bcrypt import Bcrypt
+import logging
 import pandas as pd
 import numpy as np
 import os
 import json
-import re
+import hashlib
 from datetime import datetime, timedelta
-import io
-from sklearn.linear_model import LinearRegression
+import analysis
+from dataset import CarbonDataset, InvalidDatasetError, widen
+from dataset_store import dataset_store, DatasetNotFoundError
+from export_engine import records_to_sheet, frame_to_sheet, stream_export, XLSX_MIMETYPE
+from reports import build_report, iter_report, ReportNotAvailableError
+from sample_data import generate_sample_frame, sample_summary
+import metrics
+from metrics import stage, StageClock
+import profiling
+import ingest
+import preprocess
+import incremental
+import bulk
+import resample
+from http_cache import cached_response, conditional
+from shared_cache import shared_cache
 from users import verify_user, create_user, get_user_by_id, update_user_profile, change_password
+from app_logging import configure_logging
+
+# Route logging through the queue listener before the voice modules load
+configure_logging()
+logger = logging.getLogger("app")
 
 # Use our pre-trained voice authentication system
 try:
     from pretrained_voice_auth import pretrained_voice_authenticator as voice_authenticator
-    print("Using pre-trained voice authentication system")
+    logger.info("Using pre-trained voice authentication system")
 except ImportError:
     try:
         from real_voice_auth import real_voice_authenticator as voice_authenticator
-        print("Using real deep learning voice authentication system")
+        logger.info("Using real deep learning voice authentication system")
     except ImportError:
         from voice_auth import voice_authenticator
-        print("Using simulated voice authentication system")
+        logger.info("Using simulated voice authentication system")
 
-# Try to import Prophet, but provide fallback if not available
-try:
-    from prophet import Prophet
-    PROPHET_AVAILABLE = True
-except ImportError:
-    print("WARNING: Prophet not available. Using fallback forecasting method.")
-    PROPHET_AVAILABLE = False
+# Forecast engines (Prophet when installed, linear fallback otherwise)
+import forecasting
+from forecasting import PROPHET_AVAILABLE
+import hierarchy
+import backtest
+import simulation
+import allocation
 
 app = Flask(__name__)
 CORS(app)
@@ -42,6 +62,127 @@ app.config['JWT_REFRESH_TOKEN_EXPIRES'] = timedelta(days=30)
 jwt = JWTManager(app)
 bcrypt = Bcrypt(app)
 
+# Request latency histograms and optional Server-Timing header
+metrics.init_app(app)
+
+# Upper bound on rows produced by /api/sample
+MAX_SAMPLE_ROWS = int(os.environ.get('CARBONSYNC_SAMPLE_MAX_ROWS', 5000000))
+
+def get_request_dataset(payload, label_columns=None):
+    """
+    Build the request CarbonDataset from inline 'data' or a stored 'dataset_id'
+
+    Data finer than the modelling frequency (the request's 'frequency',
+    default CARBONSYNC_MODEL_FREQUENCY, 'raw') is aggregated to it.
+
+    Args:
+        payload: Request JSON
+        label_columns: Grouping columns inline data must have (stored datasets keep their own)
+
+    Raises:
+        DatasetNotFoundError: if the dataset_id is unknown or expired
+        InvalidDatasetError: if inline data has no 'ds' column or lacks a grouping column,
+            or the frequency is unknown
+    """
+    dataset_id = payload.get('dataset_id')
+    if dataset_id:
+        data = dataset_store.load(dataset_id)
+    else:
+        data = CarbonDataset.from_frame(pd.DataFrame(payload.get('data', [])), label_columns=label_columns)
+    with stage('resample'):
+        return resample.to_model_frequency(data, payload.get('frequency'))
+
+def upload_cache_key(file=None):
+    """Shared cache key of an upload: a hash of the file type and content (or the JSON body)"""
+    digest = hashlib.sha256()
+    if file is None:
+        digest.update(b'json\0')
+        digest.update(request.get_data(cache=True))
+    else:
+        digest.update(os.path.splitext(file.filename)[1].lower().encode('utf-8') + b'\0')
+        stream = file.stream
+        position = stream.tell()
+        for chunk in iter(lambda: stream.read(1 << 20), b''):
+            digest.update(chunk)
+        stream.seek(position)
+    return f"upload:{digest.hexdigest()}"
+
+def dataset_version():
+    """Cache variant of a request that references a stored dataset: its id and current version"""
+    payload = request.get_json(silent=True)
+    dataset_id = payload.get('dataset_id') if isinstance(payload, dict) else None
+    if not dataset_id:
+        return None
+    try:
+        return f"{dataset_id}:{dataset_store.version(dataset_id)}"
+    except DatasetNotFoundError:
+        return None
+
+def replay_forecast(body):
+    """Record the results of a cached /api/predict response on its analysis context"""
+    ctx = analysis.lookup_context(body.get('analysis_id'))
+    if ctx is None:
+        return False
+    if ctx.results.get('forecast') != body['forecast'] or ctx.results.get('impacts') != body['impacts']:
+        ctx.save_results(forecast=body['forecast'], impacts=body['impacts'])
+    return True
+
+def replay_optimization(body):
+    """Record the results of a cached /api/optimize response on its analysis context"""
+    ctx = analysis.lookup_context(body.get('analysis_id'))
+    if ctx is None:
+        return False
+    # The view records the dates as timestamps; the body has them as HTTP dates
+    optimized = [dict(row, date=pd.Timestamp(row['date']).tz_convert(None)) for row in body['optimized_forecast']]
+    if ctx.results.get('optimized_forecast') != optimized or ctx.results.get('savings') != body['savings']:
+        ctx.save_results(optimized_forecast=optimized, savings=body['savings'])
+    return True
+
+def upload_state_key(dataset_id):
+    """Shared cache key of the processed rows of a dataset's latest upload"""
+    return f"upload:rows:{dataset_id}"
+
+def finish_upload(state, df, summary, filename, clock, dataset_id=None, previous=None, processed_rows=0):
+    """
+    Store a processed upload and build the upload response
+
+    With a dataset_id the upload replaces that dataset as a new version,
+    unless its rows are the same as the previous version's.
+    """
+    # Keep the processed data server-side so later steps can reference it by id
+    if previous is None or not np.array_equal(previous.hashes, state.hashes):
+        dataset_id = dataset_store.save(df, {
+            "summary": summary,
+            "filename": filename
+        }, dataset_id=dataset_id)
+        shared_cache.set(upload_state_key(dataset_id), state, ttl=dataset_store.ttl_seconds)
+    clock.lap('store')
+    
+    response = {
+        "dataset_id": dataset_id,
+        "version": dataset_store.version(dataset_id),
+        "rows": {"total": len(df), "processed": processed_rows},
+        "summary": summary,
+        "message": "Data processed successfully"
+    }
+    
+    # Clients that work with dataset_id can skip the full data round trip
+    if request.args.get('include_data', 'true').lower() != 'false':
+        response["data"] = df.to_dict(orient='records')
+    
+    result = jsonify(response)
+    clock.lap('serialize')
+    return result, 200
+
+def optimization_regressors(ctx):
+    """Features of the optimization model: the core regressors, time_idx and the optional ones present"""
+    available_regressors = ['energy_kwh', 'production_units', 'transport_km', 'time_idx']
+    optional_regressors = ['waste_kg', 'water_m3', 'fuel_l', 'grid_intensity']
+    for col in optional_regressors:
+        if col in ctx.present_columns:
+            available_regressors.append(col)
+    return available_regressors
+
 # Authentication endpoints
 @app.route('/api/auth/login', methods=['POST'])
 def login():
@@ -74,31 +215,28 @@ def login():
 @app.route('/api/auth/register', methods=['POST'])
 def register():
     try:
-        print("Registration endpoint called")
         data = request.json
-        print(f"Registration data received: {data}")
         
         username = data.get('username')
         email = data.get('email')
         password = data.get('password')
         profile = data.get('profile', {})
         
-        print(f"Processing registration for: {username}, {email}")
+        logger.debug("Processing registration for: %s", username)
         
         if not username or not email or not password:
             error_msg = "Username, email, and password are required"
-            print(f"Registration error: {error_msg}")
+            logger.info("Registration rejected: %s", error_msg)
             return jsonify({"error": error_msg}), 400
         
         # Create the user
         success, result = create_user(username, email, password, profile=profile)
         
         if not success:
-            print(f"User creation failed: {result}")
+            logger.info("User creation failed for %s: %s", username, result)
             return jsonify({"error": result}), 400
         
-        print(f"User created successfully: {username}")
-        
+
         # Create tokens
         access_token = create_access_token(identity=result["id"])
         refresh_token = create_refresh_token(identity=result["id"])
@@ -110,13 +248,11 @@ def register():
             "refresh_token": refresh_token
         }
         
-        print(f"Registration successful for: {username}")
+        logger.info("Registration successful for: %s", username)
         return jsonify(response_data), 201
     except Exception as e:
         error_msg = f"Registration error: {str(e)}"
-        print(error_msg)
-        import traceback
-        traceback.print_exc()
+        logger.exception("Registration error")
         return jsonify({"error": error_msg}), 500
 
 @app.route('/api/auth/refresh', methods=['POST'])
@@ -200,12 +336,18 @@ def update_password():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Request and stage latency histograms in the Prometheus text format"""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({"status": "healthy", "message": "Carbon Predictor AI backend is running"}), 200
 
 # Voice authentication endpoints
 @app.route('/api/auth/voice/phrase', methods=['GET'])
+@conditional
 def get_voice_phrase():
     """Get the verification phrase for voice authentication"""
     try:
@@ -291,7 +433,8 @@ def compare_voices():
         if not reference_audio or not verification_audio:
             return jsonify({'error': 'Missing audio data'}), 400
             
-        success, message, confidence, model_info = voice_authenticator.compare_voices(reference_audio, verification_audio)
+        with stage('voice_compare'):
+            success, message, confidence, model_info = voice_authenticator.compare_voices(reference_audio, verification_audio)
         
         # Mock user data for demonstration purposes
         if success:
@@ -338,588 +481,167 @@ def compare_voices():
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
     try:
+        clock = StageClock()
         if 'file' not in request.files:
             # Check if JSON data was sent instead
-            if request.json:
-                data = request.json
-                df = pd.DataFrame(data)
-            else:
+            if not request.json:
                 return jsonify({"error": "No file or data provided"}), 400
+            file = None
         else:
             file = request.files['file']
             if file.filename == '':
                 return jsonify({"error": "No file selected"}), 400
-            
-            # Determine file type and read accordingly
-            if file.filename.endswith('.csv'):
-                df = pd.read_csv(file)
-            elif file.filename.endswith(('.xls', '.xlsx')):
-                # Print debug information
-                print(f"Processing Excel file: {file.filename}")
-                # Try to read with explicit engine
-                try:
-                    df = pd.read_excel(file, engine='openpyxl')
-                    print(f"Excel file read successfully with openpyxl. Columns: {df.columns.tolist()}")
-                except Exception as excel_err:
-                    print(f"Error reading Excel with openpyxl: {str(excel_err)}")
-                    # Fallback to default engine
-                    df = pd.read_excel(file)
-                    print(f"Excel file read with default engine. Columns: {df.columns.tolist()}")
-            else:
+            if not file.filename.endswith(('.csv', '.xls', '.xlsx')):
                 return jsonify({"error": "Unsupported file format. Please upload CSV or Excel file."}), 400
+        filename = file.filename if file is not None else None
+        
+        # A re-upload with a dataset_id is diffed against the version it replaces
+        dataset_id = request.args.get('dataset_id') or request.form.get('dataset_id')
+        previous = None
+        if dataset_id:
+            dataset_store.version(dataset_id)
+            previous = shared_cache.get(upload_state_key(dataset_id))
+        
+        # An identical upload processed by any worker skips parsing and mapping
+        upload_key = upload_cache_key(file)
+        processed = shared_cache.get(upload_key)
+        # Entries cached before row states were kept are processed again
+        if processed is not None and 'state' in processed:
+            clock.lap('cache')
+            return finish_upload(processed['state'], processed['frame'], processed['summary'], filename, clock,
+                                 dataset_id=dataset_id, previous=previous)
+        
+        # Determine file type and read accordingly
+        if file is None:
+            df = pd.DataFrame(request.json)
+        elif file.filename.endswith('.csv'):
+            df = ingest.read_csv(file)
+        else:
+            logger.debug("Processing Excel file: %s", file.filename)
+            # Streaming reader picks the data sheet and header row
+            df = ingest.read_excel(file, file.filename)
+        clock.lap('parse')
+        
+        # Map columns, parse dates and convert units of the new and changed rows only
+        state, processed_rows = incremental.process(df, previous, clock)
+        df, summary = incremental.finish(state)
+        clock.lap('summarize')
+        shared_cache.set(upload_key, {'frame': df, 'summary': summary, 'state': state})
+        
+        return finish_upload(state, df, summary, filename, clock,
+                             dataset_id=dataset_id, previous=previous, processed_rows=processed_rows)
+    
+    except DatasetNotFoundError:
+        return jsonify({"error": "Dataset not found or expired. Please upload the data without a dataset_id."}), 404
+    except preprocess.ColumnMappingError as e:
+        error = {"error": str(e)}
+        if e.columns_found is not None:
+            error["columns_found"] = e.columns_found
+        return jsonify(error), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/upload/bulk', methods=['POST'])
+def upload_bulk():
+    try:
+        # Any number of files and zip archives, sent as 'files' (or 'file')
+        files = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+        if not files:
+            return jsonify({"error": "No files provided"}), 400
+        
+        with stage('parse'):
+            entries = bulk.expand([(f.filename, f.stream) for f in files])
+        if not entries:
+            return jsonify({"error": "No files found in the upload"}), 400
+        
+        # Parse the files in the upload pool and label them with their site
+        site_pattern = request.form.get('site_pattern') or request.args.get('site_pattern')
+        df, summary, reports = bulk.ingest_files(entries, site_pattern=site_pattern)
+        
+        with stage('store'):
+            dataset_id = dataset_store.save(df, {
+                "summary": summary,
+                "filename": ", ".join(f.filename for f in files),
+                "files": reports
+            })
         
-        # Validate and standardize column names
-        expected_columns = [
-            'date', 'energy_use (kWh)', 'transport (km)', 'waste (tons)', 
-            'water (liters)', 'fuel (liters)', 'emissions (tons CO2e)', 
-            'production (units)', 'grid_intensity (kg CO2e/kWh)'
-        ]
-        
-        # Print column names and first few rows for debugging
-        print(f"Columns in uploaded file: {df.columns.tolist()}")
-        print(f"First 3 rows of data:\n{df.head(3)}")
-        
-        # Check if we have at least some of the expected columns
-        found_columns = [col for col in expected_columns if col in df.columns]
-        
-        # If exact column names aren't found, try to match using more flexible mapping
-        if not found_columns:
-            # Extended mapping with various possible column name formats
-            flexible_mapping = {
-                # Date columns
-                'ds': 'date',
-                'date': 'date',
-                'datetime': 'date',
-                'time': 'date',
-                'period': 'date',
-                'month': 'date',
-                'year': 'date',
-                
-                # Energy columns
-                'energy_kwh': 'energy_use (kWh)',
-                'energy_use': 'energy_use (kWh)',
-                'energy': 'energy_use (kWh)',
-                'electricity': 'energy_use (kWh)',
-                'power': 'energy_use (kWh)',
-                'kwh': 'energy_use (kWh)',
-                'energy (kwh)': 'energy_use (kWh)',
-                'energy_use_kwh': 'energy_use (kWh)',
-                'energy_use(kwh)': 'energy_use (kWh)',
-                
-                # Transport columns
-                'transport_km': 'transport (km)',
-                'transport': 'transport (km)',
-                'travel': 'transport (km)',
-                'distance': 'transport (km)',
-                'km': 'transport (km)',
-                'miles': 'transport (km)',
-                'transportation': 'transport (km)',
-                'transport (km)': 'transport (km)',
-                'transport(km)': 'transport (km)',
-                
-                # Waste columns
-                'waste_kg': 'waste (tons)',
-                'waste': 'waste (tons)',
-                'garbage': 'waste (tons)',
-                'trash': 'waste (tons)',
-                'waste (kg)': 'waste (tons)',
-                'waste (tons)': 'waste (tons)',
-                'waste(tons)': 'waste (tons)',
-                
-                # Water columns
-                'water_m3': 'water (liters)',
-                'water': 'water (liters)',
-                'h2o': 'water (liters)',
-                'water_usage': 'water (liters)',
-                'water_consumption': 'water (liters)',
-                'water (liters)': 'water (liters)',
-                'water (m3)': 'water (liters)',
-                'water(liters)': 'water (liters)',
-                
-                # Fuel columns
-                'fuel_l': 'fuel (liters)',
-                'fuel': 'fuel (liters)',
-                'gas': 'fuel (liters)',
-                'gasoline': 'fuel (liters)',
-                'diesel': 'fuel (liters)',
-                'petrol': 'fuel (liters)',
-                'fuel (liters)': 'fuel (liters)',
-                'fuel (l)': 'fuel (liters)',
-                'fuel(liters)': 'fuel (liters)',
-                
-                # Emissions columns
-                'y': 'emissions (tons CO2e)',
-                'emissions': 'emissions (tons CO2e)',
-                'co2': 'emissions (tons CO2e)',
-                'co2e': 'emissions (tons CO2e)',
-                'carbon': 'emissions (tons CO2e)',
-                'ghg': 'emissions (tons CO2e)',
-                'greenhouse_gas': 'emissions (tons CO2e)',
-                'emissions (tons)': 'emissions (tons CO2e)',
-                'emissions (tons co2e)': 'emissions (tons CO2e)',
-                'emissions(tons co2e)': 'emissions (tons CO2e)',
-                'carbon_emissions': 'emissions (tons CO2e)',
-                
-                # Production columns
-                'production_units': 'production (units)',
-                'production': 'production (units)',
-                'units': 'production (units)',
-                'output': 'production (units)',
-                'products': 'production (units)',
-                'production (units)': 'production (units)',
-                'production(units)': 'production (units)',
-                
-                # Grid intensity columns
-                'grid_intensity': 'grid_intensity (kg CO2e/kWh)',
-                'grid': 'grid_intensity (kg CO2e/kWh)',
-                'intensity': 'grid_intensity (kg CO2e/kWh)',
-                'carbon_intensity': 'grid_intensity (kg CO2e/kWh)',
-                'grid_carbon': 'grid_intensity (kg CO2e/kWh)',
-                'grid_intensity (kg co2e/kwh)': 'grid_intensity (kg CO2e/kWh)',
-                'grid_intensity(kg co2e/kwh)': 'grid_intensity (kg CO2e/kWh)'
-            }
-            
-            # Case-insensitive column matching with improved flexibility
-            rename_dict = {}
-            for col in df.columns:
-                if pd.isna(col):  # Skip NaN column names
-                    continue
-                    
-                col_str = str(col).lower().strip()
-                
-                # Try exact match first
-                for old_col, new_col in flexible_mapping.items():
-                    if old_col.lower() == col_str:
-                        rename_dict[col] = new_col
-                        break
-                
-                # If no exact match, try partial match
-                if col not in rename_dict:
-                    for old_col, new_col in flexible_mapping.items():
-                        if old_col.lower() in col_str or col_str in old_col.lower():
-                            rename_dict[col] = new_col
-                            break
-            
-            print(f"Column mapping: {rename_dict}")
-            
-            if rename_dict:
-                df = df.rename(columns=rename_dict)
-                
-                # Convert units if needed
-                if 'waste (tons)' in df.columns and 'waste_kg' in df.columns:
-                    df['waste (tons)'] = df['waste_kg'] / 1000  # Convert kg to tons
-                
-                if 'water (liters)' in df.columns and 'water_m3' in df.columns:
-                    df['water (liters)'] = df['water_m3'] * 1000  # Convert m3 to liters
-            else:
-                # If no columns were mapped, try more aggressive matching based on column content and position
-                print("No columns mapped with standard mapping. Trying aggressive mapping...")
-                
-                # Check for date column - look for columns with date-like values
-                date_cols = []
-                for col in df.columns:
-                    if pd.isna(col):
-                        continue
-                    try:
-                        # Try to convert first non-null value to date
-                        first_val = df[col].dropna().iloc[0] if not df[col].dropna().empty else None
-                        if first_val and pd.to_datetime(first_val, errors='coerce') is not pd.NaT:
-                            date_cols.append(col)
-                    except (ValueError, TypeError, IndexError):
-                        pass
-                
-                # If we found date columns, map the first one
-                if date_cols:
-                    rename_dict[date_cols[0]] = 'date'
-                    print(f"Mapped column '{date_cols[0]}' to 'date' based on content")
-                
-                # Try to map numeric columns to the expected metrics based on position
-                numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
-                expected_numeric = [
-                    'energy_use (kWh)', 'transport (km)', 'waste (tons)', 'water (liters)', 
-                    'fuel (liters)', 'emissions (tons CO2e)', 'production (units)', 'grid_intensity (kg CO2e/kWh)'
-                ]
-                
-                # Map remaining numeric columns based on position
-                remaining_numeric = [col for col in numeric_cols if col not in rename_dict.keys()]
-                for i, col in enumerate(remaining_numeric):
-                    if i < len(expected_numeric):
-                        rename_dict[col] = expected_numeric[i]
-                        print(f"Mapped column '{col}' to '{expected_numeric[i]}' based on position")
-                
-                # If still no date column, try to use the first column as date
-                if 'date' not in rename_dict.values() and len(df.columns) > 0:
-                    first_col = df.columns[0]
-                    rename_dict[first_col] = 'date'
-                    print(f"Using first column '{first_col}' as date column")
-                    # Try to convert to datetime
-                    try:
-                        df[first_col] = pd.to_datetime(df[first_col], errors='coerce')
-                    except:
-                        pass
-                
-                if not rename_dict:
-                    return jsonify({
-                        "error": "Could not identify columns in your file. Please ensure your file contains at least: date, energy_use (kWh), transport (km), emissions (tons CO2e)",
-                        "columns_found": df.columns.tolist()
-                    }), 400
-        
-        # Ensure date column is present and in datetime format
-        if 'date' not in df.columns:
-            return jsonify({"error": "Missing required 'date' column"}), 400
-        
-        # Try to convert date column to datetime format, with improved handling
-        try:
-            # First, make a copy of the original date column to preserve it
-            df['original_date'] = df['date'].copy()
-            
-            # Try to parse dates with a more flexible approach
-            df['date'] = pd.to_datetime(df['date'], errors='coerce', infer_datetime_format=True)
-            
-            # Check if we have valid dates
-            if df['date'].isna().any():
-                print("Some dates failed to parse. Trying specific formats...")
-                # Try common date formats one by one
-                date_formats = [
-                    '%d/%m/%Y', '%m/%d/%Y', '%Y-%m-%d', '%d-%m-%Y', '%m-%d-%Y',
-                    '%d.%m.%Y', '%m.%d.%Y', '%Y.%m.%d',
-                    '%d-%b-%Y', '%b-%d-%Y', '%Y-%b-%d',
-                    '%d %B %Y', '%B %d %Y', '%Y %B %d'
-                ]
-                
-                for fmt in date_formats:
-                    try:
-                        temp_dates = pd.to_datetime(df['original_date'], format=fmt, errors='coerce')
-                        # Update only the NaN values in the date column
-                        mask = df['date'].isna()
-                        df.loc[mask, 'date'] = temp_dates.loc[mask]
-                        
-                        if not df['date'].isna().any():
-                            print(f"Successfully parsed all dates with format: {fmt}")
-                            break
-                    except Exception as fmt_err:
-                        print(f"Error with format {fmt}: {str(fmt_err)}")
-                        continue
-            
-            # If we still have NaN dates, try to extract date components
-            if df['date'].isna().any():
-                print("Still have NaN dates. Trying to extract date components...")
-                mask = df['date'].isna()
-                try:
-                    # Try to extract year, month, day from string representations
-                    date_strings = df.loc[mask, 'original_date'].astype(str)
-                    
-                    # Look for patterns like YYYY-MM-DD or DD-MM-YYYY in the strings
-                    for i, date_str in enumerate(date_strings):
-                        parts = [p for p in re.split(r'[-/., ]', date_str) if p.isdigit()]
-                        if len(parts) >= 3:
-                            # If first part is 4 digits, assume YYYY-MM-DD
-                            if len(parts[0]) == 4:
-                                year, month, day = int(parts[0]), int(parts[1]), int(parts[2])
-                            # Otherwise assume DD-MM-YYYY
-                            elif len(parts[2]) == 4:
-                                day, month, year = int(parts[0]), int(parts[1]), int(parts[2])
-                            else:
-                                continue
-                                
-                            try:
-                                df.loc[mask.iloc[i], 'date'] = pd.Timestamp(year=year, month=month, day=day)
-                            except:
-                                pass
-                except Exception as e:
-                    print(f"Error extracting date components: {str(e)}")
-        except Exception as e:
-            print(f"Error converting dates: {str(e)}")
-        
-        # If all else fails, create a date sequence for any remaining NaN dates
-        if df['date'].isna().any():
-            print("Creating date sequence as fallback for remaining NaN dates")
-            start_date = pd.Timestamp('2023-01-01')
-            nan_indices = df['date'].isna()
-            df.loc[nan_indices, 'date'] = [start_date + pd.Timedelta(days=i) for i in range(sum(nan_indices))]
-        
-        # Drop the temporary column
-        df = df.drop('original_date', axis=1, errors='ignore')
-        
-        # Add ds column for Prophet compatibility
-        df['ds'] = df['date']
-        
-        # Convert units and standardize column names for backend processing
-        column_mapping = {
-            'energy_use (kWh)': 'energy_kwh',
-            'transport (km)': 'transport_km',
-            'waste (tons)': 'waste_kg',
-            'water (liters)': 'water_m3',
-            'fuel (liters)': 'fuel_l',
-            'emissions (tons CO2e)': 'y',
-            'production (units)': 'production_units',
-            'grid_intensity (kg CO2e/kWh)': 'grid_intensity'
-        }
-        
-        # Print the dataframe after column mapping for debugging
-        print("DataFrame after column mapping:")
-        print(df.head())
-        
-        # Create backend columns with appropriate unit conversions
-        for display_col, backend_col in column_mapping.items():
-            # First try exact column name
-            if display_col in df.columns:
-                if display_col == 'waste (tons)':
-                    df[backend_col] = df[display_col] * 1000  # Convert tons to kg
-                elif display_col == 'water (liters)':
-                    df[backend_col] = df[display_col] / 1000  # Convert liters to m3
-                else:
-                    df[backend_col] = df[display_col]
-            else:
-                # Try to find columns with similar names (without spaces or with different casing)
-                found = False
-                for col in df.columns:
-                    # Skip if column is NaN
-                    if pd.isna(col):
-                        continue
-                        
-                    # Normalize column names for comparison (remove spaces, parentheses, and lowercase)
-                    col_clean = str(col).lower().replace(' ', '').replace('(', '').replace(')', '')
-                    display_col_clean = display_col.lower().replace(' ', '').replace('(', '').replace(')', '')
-                    
-                    # Check if the cleaned column names match or are very similar
-                    if col_clean == display_col_clean or col_clean in display_col_clean or display_col_clean in col_clean:
-                        print(f"Matched column '{col}' to '{display_col}' -> '{backend_col}'")
-                        found = True
-                        
-                        # Apply appropriate conversions
-                        if display_col == 'waste (tons)':
-                            df[backend_col] = pd.to_numeric(df[col], errors='coerce') * 1000  # Convert tons to kg
-                        elif display_col == 'water (liters)':
-                            df[backend_col] = pd.to_numeric(df[col], errors='coerce') / 1000  # Convert liters to m3
-                        else:
-                            df[backend_col] = pd.to_numeric(df[col], errors='coerce')
-                        break
-                
-                # If we didn't find a match, try to infer from column position for numeric columns
-                if not found and backend_col not in df.columns:
-                    # Map common patterns like 'energy_use(kwh)' to 'energy_kwh'
-                    for col in df.columns:
-                        if pd.isna(col):
-                            continue
-                            
-                        col_str = str(col).lower()
-                        if 'energy' in col_str and backend_col == 'energy_kwh':
-                            df[backend_col] = pd.to_numeric(df[col], errors='coerce')
-                            print(f"Mapped '{col}' to '{backend_col}' based on keyword match")
-                            break
-                        elif 'transport' in col_str and backend_col == 'transport_km':
-                            df[backend_col] = pd.to_numeric(df[col], errors='coerce')
-                            print(f"Mapped '{col}' to '{backend_col}' based on keyword match")
-                            break
-                        elif 'waste' in col_str and backend_col == 'waste_kg':
-                            df[backend_col] = pd.to_numeric(df[col], errors='coerce') * 1000  # Convert tons to kg
-                            print(f"Mapped '{col}' to '{backend_col}' based on keyword match")
-                            break
-                        elif 'water' in col_str and backend_col == 'water_m3':
-                            df[backend_col] = pd.to_numeric(df[col], errors='coerce') / 1000  # Convert liters to m3
-                            print(f"Mapped '{col}' to '{backend_col}' based on keyword match")
-                            break
-                        elif 'fuel' in col_str and backend_col == 'fuel_l':
-                            df[backend_col] = pd.to_numeric(df[col], errors='coerce')
-                            print(f"Mapped '{col}' to '{backend_col}' based on keyword match")
-                            break
-                        elif ('emission' in col_str or 'co2' in col_str) and backend_col == 'y':
-                            df[backend_col] = pd.to_numeric(df[col], errors='coerce')
-                            print(f"Mapped '{col}' to '{backend_col}' based on keyword match")
-                            break
-                        elif 'production' in col_str and backend_col == 'production_units':
-                            df[backend_col] = pd.to_numeric(df[col], errors='coerce')
-                            print(f"Mapped '{col}' to '{backend_col}' based on keyword match")
-                            break
-                        elif ('grid' in col_str or 'intensity' in col_str) and backend_col == 'grid_intensity':
-                            df[backend_col] = pd.to_numeric(df[col], errors='coerce')
-                            print(f"Mapped '{col}' to '{backend_col}' based on keyword match")
-                            break
-        
-        # Handle missing values (fill with means)
-        numeric_cols = ['energy_kwh', 'production_units', 'transport_km', 'y', 
-                        'waste_kg', 'water_m3', 'fuel_l', 'grid_intensity']
-        
-        for col in numeric_cols:
-            if col in df.columns and df[col].isnull().any():
-                df[col] = df[col].fillna(df[col].mean())
-        
-        # Calculate summary statistics
-        summary = {
-            'mean': {},
-            'min': {},
-            'max': {},
-            'std': {},
-            'total_rows': len(df)
+        failed = sum(1 for report in reports if 'error' in report)
+        response = {
+            "dataset_id": dataset_id,
+            "version": dataset_store.version(dataset_id),
+            "rows": {"total": len(df)},
+            "sites": sorted(df['site'].unique().tolist()),
+            "files": reports,
+            "summary": summary,
+            "message": f"Processed {len(reports) - failed} of {len(reports)} files"
         }
         
-        # Calculate statistics for display columns
-        for display_col, backend_col in column_mapping.items():
-            if backend_col in df.columns:
-                summary['mean'][display_col.split(' ')[0]] = float(df[backend_col].mean())
-                summary['min'][display_col.split(' ')[0]] = float(df[backend_col].min())
-                summary['max'][display_col.split(' ')[0]] = float(df[backend_col].max())
-                summary['std'][display_col.split(' ')[0]] = float(df[backend_col].std())
+        if request.args.get('include_data', 'true').lower() != 'false':
+            response["data"] = df.to_dict(orient='records')
         
-        # Ensure date is properly formatted for JSON serialization
-        df['date'] = df['date'].dt.strftime('%Y-%m-%d')
-        
-        # Convert to JSON-serializable format
-        df_json = df.to_dict(orient='records')
-        
-        return jsonify({
-            "data": df_json,
-            "summary": summary,
-            "message": "Data processed successfully"
-        }), 200
+        with stage('serialize'):
+            return jsonify(response), 200
     
+    except bulk.BulkUploadError as e:
+        error = {"error": str(e)}
+        if e.reports is not None:
+            error["files"] = e.reports
+        return jsonify(error), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/predict', methods=['POST'])
+@cached_response(vary=dataset_version, replay=replay_forecast)
 def predict():
     try:
-        # Get data from request
-        data = request.json.get('data', [])
+        # Get data from request (inline or a stored dataset)
         forecast_periods = request.json.get('forecast_periods', 12)
+        engine = str(request.json.get('engine', 'auto')).lower()
+        if engine not in forecasting.ENGINES:
+            return jsonify({"error": f"Unknown forecast engine: {engine}"}), 400
+        with stage('prepare'):
+            data = get_request_dataset(request.json)
         
-        if not data:
+        if len(data) == 0:
             return jsonify({"error": "No data provided"}), 400
         
-        # Convert to DataFrame
-        df = pd.DataFrame(data)
-        
-        # Ensure date column is in datetime format
-        df['ds'] = pd.to_datetime(df['ds'])
-        
         # Ensure all required columns exist
         required_columns = ['ds', 'y']
         for col in required_columns:
-            if col not in df.columns:
+            if not data.has(col):
                 return jsonify({"error": f"Missing required column: {col}"}), 400
         
-        # Fill missing values with 0 for numeric columns
-        numeric_columns = ['energy_kwh', 'transport_km', 'waste_kg', 'water_m3', 
-                          'fuel_l', 'production_units', 'grid_intensity']
-        
-        for col in numeric_columns:
-            if col in df.columns:
-                df[col] = df[col].fillna(0).astype(float)
-            else:
-                df[col] = 0
-        
-        # Ensure y column is numeric
-        df['y'] = df['y'].astype(float)
-        
-        # Sort by date to ensure chronological order
-        df = df.sort_values('ds')
+        # Reuse the date-sorted metric matrix and regression statistics for
+        # this dataset (missing regressor values are filled with 0)
+        with stage('prepare'):
+            ctx = analysis.get_context(data)
+        numeric_columns = analysis.REGRESSOR_COLUMNS
         
         # Check for duplicate dates
-        if df['ds'].duplicated().any():
+        if data.has_duplicate_dates():
             return jsonify({"error": "Duplicate dates found. Each date must be unique."}), 400
         
         # Check if we have enough data points
-        if len(df) < 3:
+        if len(data) < 3:
             return jsonify({"error": "Need at least 3 data points for forecasting"}), 400
         
-        # Check if Prophet is available, otherwise use fallback forecasting
-        if PROPHET_AVAILABLE:
-            try:
-                # Create Prophet model
-                model = Prophet(
-                    yearly_seasonality=True,
-                    weekly_seasonality=False,
-                    daily_seasonality=False,
-                    seasonality_mode='multiplicative'
-                )
-                
-                # Add regressors if available
-                for regressor in numeric_columns:
-                    if regressor in df.columns and regressor != 'y':
-                        model.add_regressor(regressor)
-                
-                # Fit model
-                model.fit(df)
-                
-                # Create future dataframe
-                future = model.make_future_dataframe(periods=forecast_periods, freq='MS')
-                
-                # Add regressor values for historical data
-                for regressor in numeric_columns:
-                    if regressor in df.columns:
-                        future[regressor] = future['ds'].map(df.set_index('ds')[regressor])
-                
-                # Fill NaN values in future regressors with the mean of historical data
-                for regressor in numeric_columns:
-                    if regressor in future.columns:
-                        mean_value = df[regressor].mean()
-                        future[regressor] = future[regressor].fillna(mean_value)
-                
-                # Make prediction
-                forecast = model.predict(future)
-                
-                # Prophet is working correctly
-                using_fallback = False
-            except Exception as prophet_error:
-                print(f"Prophet error: {str(prophet_error)}. Using fallback method.")
-                using_fallback = True
-        else:
-            print("Prophet not available. Using fallback forecasting method.")
-            using_fallback = True
-            
-        # Fallback forecasting method using linear regression if Prophet fails
-        if using_fallback:
-            # Create a simple time-based feature
-            df['time_idx'] = range(len(df))
-            
-            # Train a linear regression model on the time index
-            X_train = df[['time_idx']]
-            y_train = df['y']
-            lr_model = LinearRegression().fit(X_train, y_train)
-            
-            # Create future dates
-            last_date = df['ds'].max()
-            future_dates = [last_date + pd.DateOffset(months=i+1) for i in range(forecast_periods)]
-            
-            # Create future dataframe with time index continuing from training data
-            future = pd.DataFrame({
-                'ds': pd.Series(future_dates),
-                'time_idx': range(len(df), len(df) + forecast_periods)
-            })
-            
-            # Combine historical and future data
-            combined = pd.concat([df[['ds', 'time_idx']], future], ignore_index=True)
-            
-            # Make predictions
-            combined['yhat'] = lr_model.predict(combined[['time_idx']])
-            
-            # Add prediction intervals (simple approach)
-            y_pred = lr_model.predict(X_train)
-            mse = np.mean((y_train - y_pred) ** 2)
-            std_dev = np.sqrt(mse)
-            
-            combined['yhat_lower'] = combined['yhat'] - 1.96 * std_dev
-            combined['yhat_upper'] = combined['yhat'] + 1.96 * std_dev
-            
-            # Extract just the forecast part
-            forecast = combined.iloc[len(df):]
+        # ETS for short series, Prophet for long ones (when installed), or
+        # the requested engine; the linear trend if the engine fails
+        forecast, engine = forecasting.forecast(ctx, forecast_periods, engine)
         
         # Calculate feature importance using a simple linear regression
-        X = df[numeric_columns].fillna(0)
-        y = df['y']
-        
         # Only calculate impacts if we have enough data points
         impacts = {}
-        if len(df) >= 5 and len(numeric_columns) > 0:
+        if len(data) >= 5 and len(numeric_columns) > 0:
             try:
-                reg = LinearRegression().fit(X, y)
+                with stage('impacts'):
+                    reg = ctx.fit(numeric_columns)
                 
                 # Calculate impact scores
                 for i, col in enumerate(numeric_columns):
-                    if col in df.columns:
+                    if col in ctx.means:
                         coefficient = reg.coef_[i]
-                        mean_value = df[col].mean()
+                        mean_value = ctx.means[col]
                         impact_score = coefficient * mean_value
                         impacts[col] = {
                             "coefficient": float(coefficient),
@@ -927,7 +649,7 @@ def predict():
                             "impact_score": float(impact_score)
                         }
             except Exception as e:
-                print(f"Error calculating impacts: {e}")
+                logger.warning("Error calculating impacts: %s", e)
                 # Continue without impacts if there's an error
                 pass
         
@@ -952,62 +674,163 @@ def predict():
                     elif col == 'fuel_l':
                         suggestions.append("Optimize fuel consumption or switch to more efficient vehicles")
         
-        # Format forecast results
-        forecast_result = []
-        for i, row in forecast.iterrows():
-            forecast_result.append({
-                "ds": row['ds'].strftime('%Y-%m-%d'),
-                "predicted_emissions": float(row['yhat']),
-                "lower_bound": float(row['yhat_lower']),
-                "upper_bound": float(row['yhat_upper'])
+        with stage('serialize'):
+            # Format forecast results
+            forecast_result = []
+            for i, row in forecast.iterrows():
+                forecast_result.append({
+                    "ds": row['ds'].strftime('%Y-%m-%d'),
+                    "predicted_emissions": float(row['yhat']),
+                    "lower_bound": float(row['yhat_lower']),
+                    "upper_bound": float(row['yhat_upper'])
+                })
+            
+            # Keep the results on the context so export can reuse them
+            ctx.save_results(forecast=forecast_result, impacts=impacts)
+            
+            response = jsonify({
+                "forecast": forecast_result,
+                "impacts": impacts,
+                "suggestions": suggestions,
+                "engine": engine,
+                "analysis_id": ctx.fingerprint
             })
+        return response, 200
         
-        return jsonify({
-            "forecast": forecast_result,
-            "impacts": impacts,
-            "suggestions": suggestions
-        }), 200
+    except DatasetNotFoundError:
+        return jsonify({"error": "Dataset not found or expired. Please upload the data again."}), 404
+    except InvalidDatasetError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.exception("Error in prediction")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/predict/hierarchical', methods=['POST'])
+@cached_response(vary=dataset_version)
+def predict_hierarchical():
+    """
+    Forecast every node of a grouping hierarchy with totals that add up
+
+    JSON body: data or dataset_id, hierarchy (grouping columns from the top
+    level down, e.g. ["country", "plant", "line"]), forecast_periods,
+    method (bottom_up, ols, wls or mint) and engine.
+    """
+    try:
+        payload = request.json
+        levels = payload.get('hierarchy') or []
+        if isinstance(levels, str):
+            levels = [levels]
+        forecast_periods = int(payload.get('forecast_periods', 12))
+        method = str(payload.get('method', 'bottom_up')).lower()
+        engine = str(payload.get('engine', 'auto')).lower()
+        if engine not in forecasting.ENGINES:
+            return jsonify({"error": f"Unknown forecast engine: {engine}"}), 400
+        
+        with stage('prepare'):
+            data = get_request_dataset(payload, label_columns=levels)
+        if len(data) == 0:
+            return jsonify({"error": "No data provided"}), 400
+        if not data.has('y'):
+            return jsonify({"error": "Missing required column: y"}), 400
         
+        result = hierarchy.forecast_hierarchy(data, levels, forecast_periods, method, engine)
+        with stage('serialize'):
+            response = jsonify(result)
+        return response, 200
+    
+    except DatasetNotFoundError:
+        return jsonify({"error": "Dataset not found or expired. Please upload the data again."}), 404
+    except (InvalidDatasetError, hierarchy.HierarchyError) as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        print(f"Error in prediction: {e}")
+        logger.exception("Error in hierarchical prediction")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/backtest', methods=['POST'])
+@cached_response(vary=dataset_version)
+def run_backtest():
+    """
+    Rolling-origin backtest of the forecast engines
+
+    JSON body: data or dataset_id, engines (default: prophet when installed,
+    ets and linear), horizon, initial, step, max_folds and group_by (grouping
+    columns backtested as separate series). Returns MAE, MAPE and interval
+    coverage per horizon step for every engine.
+    """
+    try:
+        payload = request.json
+        group_by = payload.get('group_by') or []
+        if isinstance(group_by, str):
+            group_by = [group_by]
+        engines = payload.get('engines')
+        if isinstance(engines, str):
+            engines = [engines]
+        initial = payload.get('initial')
+        
+        with stage('prepare'):
+            data = get_request_dataset(payload, label_columns=group_by)
+        if len(data) == 0:
+            return jsonify({"error": "No data provided"}), 400
+        if not data.has('y'):
+            return jsonify({"error": "Missing required column: y"}), 400
+        
+        result = backtest.run_backtest(
+            data,
+            engines=[str(engine).lower() for engine in engines] if engines else None,
+            horizon=int(payload.get('horizon', 3)),
+            initial=int(initial) if initial is not None else None,
+            step=int(payload.get('step', 1)),
+            max_folds=int(payload.get('max_folds', backtest.DEFAULT_MAX_FOLDS)),
+            group_by=group_by
+        )
+        with stage('serialize'):
+            response = jsonify(result)
+        return response, 200
+    
+    except DatasetNotFoundError:
+        return jsonify({"error": "Dataset not found or expired. Please upload the data again."}), 404
+    except (InvalidDatasetError, hierarchy.HierarchyError, backtest.BacktestError) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.exception("Error in backtest")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/optimize', methods=['POST'])
+@cached_response(vary=dataset_version, replay=replay_optimization)
 def optimize():
     try:
+        clock = StageClock()
         data = request.json
-        df = pd.DataFrame(data['data'])
         suggestions = data.get('suggestions', [])
         forecast_periods = int(data.get('forecast_periods', 12))
+        # Monte Carlo bands instead of the constant residual band
+        simulate = bool(data.get('simulate', False))
+        samples = int(data.get('samples', simulation.SIMULATION_SAMPLES))
+        if simulate and not 0 < samples <= simulation.MAX_SIMULATION_SAMPLES:
+            return jsonify({"error": f"samples must be between 1 and {simulation.MAX_SIMULATION_SAMPLES}"}), 400
+        
+        # Reuse the analysis context from a previous predict call when possible
+        analysis_id = data.get('analysis_id')
+        if analysis_id:
+            ctx = analysis.lookup_context(analysis_id)
+            if ctx is None:
+                return jsonify({"error": "Analysis not found or expired. Please send the data again."}), 404
+        else:
+            ctx = analysis.get_context(get_request_dataset(data))
         
-        # Convert date to datetime
-        df['ds'] = pd.to_datetime(df['ds'])
-        df['date'] = df['ds']  # Add date column for compatibility
-        
-        # Sort by date
-        df = df.sort_values('ds')
-        
-        # Create features for linear regression
-        df['time_idx'] = range(len(df))
+        # Date-sorted dataset; rows are indexed by time_idx
+        history = ctx.data
+        clock.lap('prepare')
         
         # Determine available regressors
-        available_regressors = ['energy_kwh', 'production_units', 'transport_km', 'time_idx']
-        optional_regressors = ['waste_kg', 'water_m3', 'fuel_l', 'grid_intensity']
-        for col in optional_regressors:
-            if col in df.columns:
-                available_regressors.append(col)
-        
-        # Prepare data for linear regression
-        X = df[available_regressors].values
-        y = df['y'].values
+        available_regressors = optimization_regressors(ctx)
         
-        # Initialize and fit linear regression model
-        model = LinearRegression()
-        model.fit(X, y)
+        # Solve the model from the shared regression statistics
+        model = ctx.fit(available_regressors)
+        clock.lap('fit')
         
-        # Create future dataframe
-        last_date = df['ds'].max()
-        future_dates = [last_date + timedelta(days=30*i) for i in range(1, forecast_periods+1)]
+        # Future dates continue at the frequency of the data
+        future_dates = resample.future_dates(history, forecast_periods)
         
         # Create future features with optimizations applied
         future_data = []
@@ -1015,13 +838,13 @@ def optimize():
             row = {
                 'ds': date,
                 'date': date,
-                'time_idx': len(df) + i
+                'time_idx': len(history) + i
             }
             
             # Use mean values for other features
             for col in available_regressors:
                 if col != 'time_idx':
-                    mean_value = df[col].mean()
+                    mean_value = ctx.means[col]
                     
                     # Apply optimization if this regressor is in suggestions
                     for suggestion in suggestions:
@@ -1043,7 +866,7 @@ def optimize():
         future_df['predicted_emissions'] = future_y
         
         # Add confidence intervals (simple approach)
-        std_dev = np.std(y - model.predict(X))
+        std_dev = model.residual_std
         future_df['lower_bound'] = future_df['predicted_emissions'] - 1.96 * std_dev
         future_df['upper_bound'] = future_df['predicted_emissions'] + 1.96 * std_dev
         
@@ -1054,210 +877,339 @@ def optimize():
             row = {
                 'ds': date,
                 'date': date,
-                'time_idx': len(df) + i
+                'time_idx': len(history) + i
             }
             
             # Use mean values without optimization
             for col in available_regressors:
                 if col != 'time_idx':
-                    row[col] = df[col].mean()
+                    row[col] = ctx.means[col]
             
             baseline_future.append(row)
         
         baseline_df = pd.DataFrame(baseline_future)
         baseline_X = baseline_df[available_regressors].values
         baseline_y = model.predict(baseline_X)
+        clock.lap('predict')
         
         # Calculate total emissions reduction
         total_baseline = sum(baseline_y)
         total_optimized = sum(future_y)
         total_reduction = total_baseline - total_optimized
         avg_reduction_pct = (total_reduction / total_baseline) * 100 if total_baseline > 0 else 0
+        savings = {
+            'total': float(total_reduction),
+            'percentage': float(avg_reduction_pct)
+        }
+        
+        baseline_result = None
+        if simulate:
+            # Coefficient, regressor and residual draws for both scenarios at once
+            history_X = np.column_stack([
+                np.arange(len(history), dtype=np.float64) if col == 'time_idx' else history.filled([col])[:, 0]
+                for col in available_regressors
+            ])
+            y = widen(history.column('y'))
+            observed = ~np.isnan(y)
+            residuals = y[observed] - model.predict(history_X[observed])
+            simulated = simulation.simulate(
+                model, np.stack([baseline_X, future_X]), history_X, residuals,
+                perturb=[col != 'time_idx' for col in available_regressors],
+                samples=samples, seed=int(data.get('seed', 0))
+            )
+            lower, _, upper = simulation.bands(simulated)
+            future_df['lower_bound'] = lower[:, 1]
+            future_df['upper_bound'] = upper[:, 1]
+            baseline_df['predicted_emissions'] = baseline_y
+            baseline_df['lower_bound'] = lower[:, 0]
+            baseline_df['upper_bound'] = upper[:, 0]
+            baseline_result = baseline_df[['date', 'predicted_emissions', 'lower_bound', 'upper_bound']].to_dict(orient='records')
+            
+            totals = simulated.sum(axis=1)
+            reduction = totals[:, 0] - totals[:, 1]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                reduction_pct = np.where(totals[:, 0] > 0, reduction / totals[:, 0] * 100, 0.0)
+            savings['interval'] = {
+                'total': [float(v) for v in np.percentile(reduction, [2.5, 97.5])],
+                'percentage': [float(v) for v in np.percentile(reduction_pct, [2.5, 97.5])]
+            }
+            clock.lap('simulate')
         
         # Prepare response
         response = {
             'optimized_forecast': future_df[['date', 'predicted_emissions', 'lower_bound', 'upper_bound']].to_dict(orient='records'),
-            'savings': {
-                'total': float(total_reduction),
-                'percentage': float(avg_reduction_pct)
-            }
+            'savings': savings,
+            'analysis_id': ctx.fingerprint
         }
-        
-        return jsonify(response), 200
+        if baseline_result is not None:
+            response['baseline_forecast'] = baseline_result
+            response['samples'] = samples
+        ctx.save_results(optimized_forecast=response['optimized_forecast'], savings=response['savings'])
+        
+        result = jsonify(response)
+        clock.lap('serialize')
+        return result, 200
     
+    except DatasetNotFoundError:
+        return jsonify({"error": "Dataset not found or expired. Please upload the data again."}), 404
+    except InvalidDatasetError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/optimize/solve', methods=['POST'])
+@cached_response(vary=dataset_version)
+def solve_allocation():
+    """
+    Cheapest reduction mix that meets an emissions target
+
+    JSON body: data, dataset_id or analysis_id, forecast_periods, levers
+    (regressor, cost_per_pct or cost_curve, min_pct, max_pct), target_pct
+    (percent of the baseline forecast) or target (absolute reduction) and
+    frontier_points. Returns the optimal allocation as /api/optimize
+    suggestions plus the cost/reduction Pareto frontier.
+    """
+    try:
+        data = request.json
+        forecast_periods = int(data.get('forecast_periods', 12))
+        if forecast_periods < 1:
+            return jsonify({"error": "forecast_periods must be positive"}), 400
+        frontier_points = int(data.get('frontier_points', allocation.FRONTIER_POINTS))
+        if not 2 <= frontier_points <= allocation.MAX_FRONTIER_POINTS:
+            return jsonify({"error": f"frontier_points must be between 2 and {allocation.MAX_FRONTIER_POINTS}"}), 400
+        if data.get('target_pct') is None and data.get('target') is None:
+            return jsonify({"error": "target_pct or target is required"}), 400
+
+        analysis_id = data.get('analysis_id')
+        if analysis_id:
+            ctx = analysis.lookup_context(analysis_id)
+            if ctx is None:
+                return jsonify({"error": "Analysis not found or expired. Please send the data again."}), 404
+        else:
+            with stage('prepare'):
+                ctx = analysis.get_context(get_request_dataset(data))
+
+        with stage('fit'):
+            available_regressors = optimization_regressors(ctx)
+            model = ctx.fit(available_regressors)
+            levers = allocation.parse_levers(
+                data.get('levers'), [col for col in available_regressors if col != 'time_idx'])
+
+        # Baseline forecast at the regressor means, as in /api/optimize
+        means = np.array([ctx.means[col] if col != 'time_idx' else 0.0 for col in available_regressors])
+        baseline_X = np.tile(means, (forecast_periods, 1))
+        baseline_X[:, available_regressors.index('time_idx')] = len(ctx.data) + np.arange(forecast_periods)
+        total_baseline = float(model.predict(baseline_X).sum())
+        coef = dict(zip(available_regressors, model.coef_))
+        effects = np.array([forecast_periods * coef[name] * ctx.means[name] / 100 for name in levers.names])
+
+        try:
+            if data.get('target') is not None:
+                target = float(data['target'])
+            else:
+                target = float(data['target_pct']) / 100 * total_baseline
+        except (TypeError, ValueError):
+            return jsonify({"error": "target_pct and target must be numbers"}), 400
+
+        def percentage(reduction):
+            return float(reduction / total_baseline * 100) if total_baseline > 0 else 0.0
+
+        with stage('solve'):
+            solution = allocation.solve(levers, effects, target)
+            reductions, costs, allocations = allocation.frontier(levers, effects, frontier_points)
+
+        response = {
+            'baseline_total': total_baseline,
+            'target': {'total': target, 'percentage': percentage(target)},
+            'feasible': solution is not None,
+            'solution': None,
+            'max_reduction': {'total': float(reductions[-1]), 'percentage': percentage(reductions[-1])},
+            'frontier': [{
+                'total': float(reduction),
+                'percentage': percentage(reduction),
+                'cost': float(cost),
+                'allocation': {name: float(pct) for name, pct in zip(levers.names, pcts)}
+            } for reduction, cost, pcts in zip(reductions, costs, allocations)],
+            'analysis_id': ctx.fingerprint
+        }
+        if solution is not None:
+            pcts, cost, reduction = solution
+            response['solution'] = {
+                'cost': cost,
+                'savings': {'total': reduction, 'percentage': percentage(reduction)},
+                'suggestions': [{
+                    'regressor': name,
+                    'reduction_pct': float(pct),
+                    'savings': float(effect * pct)
+                } for name, pct, effect in zip(levers.names, pcts, effects) if pct > 0]
+            }
+
+        with stage('serialize'):
+            result = jsonify(response)
+        return result, 200
+
+    except DatasetNotFoundError:
+        return jsonify({"error": "Dataset not found or expired. Please upload the data again."}), 404
+    except (InvalidDatasetError, allocation.AllocationError) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.exception("Error in allocation solver")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/export', methods=['POST'])
 def export_forecast():
     try:
         data = request.json
         forecast_data = data.get('forecast', [])
         
+        # Export the cached results of a previous predict/optimize call
+        if not forecast_data and (data.get('analysis_id') or data.get('dataset_id')):
+            if data.get('analysis_id'):
+                ctx = analysis.lookup_context(data['analysis_id'])
+            else:
+                # Predict and optimize key the context by the dataset at the modelling frequency
+                ctx = analysis.lookup_context(get_request_dataset(data).fingerprint())
+            if ctx is None:
+                return jsonify({"error": "Analysis not found or expired"}), 404
+            result_key = 'optimized_forecast' if data.get('scenario') == 'optimized' else 'forecast'
+            forecast_data = ctx.results.get(result_key, [])
+        
         if not forecast_data:
             return jsonify({"error": "No forecast data provided"}), 400
         
-        # Convert to DataFrame
-        df = pd.DataFrame(forecast_data)
-        
-        # Create Excel file in memory
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, sheet_name='Forecast', index=False)
-            
-            # Get workbook and worksheet objects
-            workbook = writer.book
-            worksheet = writer.sheets['Forecast']
-            
-            # Add formats
-            header_format = workbook.add_format({
-                'bold': True,
-                'text_wrap': True,
-                'valign': 'top',
-                'fg_color': '#D7E4BC',
-                'border': 1
-            })
-            
-            # Write headers with format
-            for col_num, value in enumerate(df.columns.values):
-                worksheet.write(0, col_num, value, header_format)
-                
-            # Set column widths
-            worksheet.set_column('A:A', 12)  # Date column
-            worksheet.set_column('B:D', 15)  # Numeric columns
-        
-        output.seek(0)
+        # Stream the rows out instead of building the whole file in memory
+        export_format = str(data.get('format', 'xlsx')).lower()
+        if export_format not in ('xlsx', 'csv'):
+            return jsonify({"error": "Unsupported export format. Use 'xlsx' or 'csv'."}), 400
+        
+        sheet = records_to_sheet('Forecast', forecast_data, widths={
+            'A:A': 12,  # Date column
+            'B:D': 15   # Numeric columns
+        })
+        chunks, mimetype, download_name = stream_export(
+            [sheet],
+            fmt=export_format,
+            compress=data.get('compression') == 'gzip'
+        )
         
         # Ensure proper content type and attachment handling
-        response = send_file(
-            output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name='carbon_forecast.xlsx'
-        )
+        response = Response(stream_with_context(chunks), mimetype=mimetype)
         
         # Add additional headers to ensure proper download
-        response.headers["Content-Disposition"] = "attachment; filename=carbon_forecast.xlsx"
+        response.headers["Content-Disposition"] = f"attachment; filename={download_name}"
         response.headers["Access-Control-Expose-Headers"] = "Content-Disposition"
         
         return response
     
+    except DatasetNotFoundError:
+        return jsonify({"error": "Dataset not found or expired. Please upload the data again."}), 404
+    except InvalidDatasetError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        print(f"Export error: {str(e)}")
+        logger.exception("Export error")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/sample', methods=['GET'])
-def generate_sample():
+@app.route('/api/export/report', methods=['GET'])
+def export_report():
+    """Export a multi-sheet report assembled from cached results"""
     try:
-        # Generate sample dates (monthly for 2 years)
-        start_date = datetime(2023, 1, 1)
-        dates = [start_date + timedelta(days=30*i) for i in range(24)]
-        
-        # Create sample data
-        data = []
-        
-        for i, date in enumerate(dates):
-            # Base values
-            energy_kwh = 5000 + 500 * np.sin(i/4)
-            transport_km = 20000 + 2000 * np.sin(i/3 + 1)
-            waste_kg = 1500 + 300 * np.sin(i/5 + 2)
-            water_m3 = 200 + 50 * np.sin(i/4 + 1.5)
-            fuel_l = 1000 + 200 * np.sin(i/3 + 0.5)
-            production_units = 10000 + 1000 * np.sin(i/4 + 1)
-            grid_intensity = 0.5 + 0.1 * np.sin(i/6)
-            
-            # Add some randomness
-            energy_kwh += np.random.normal(0, 200)
-            transport_km += np.random.normal(0, 500)
-            waste_kg += np.random.normal(0, 100)
-            water_m3 += np.random.normal(0, 20)
-            fuel_l += np.random.normal(0, 50)
-            production_units += np.random.normal(0, 300)
-            grid_intensity += np.random.normal(0, 0.05)
-            
-            # Ensure non-negative values
-            energy_kwh = max(0, energy_kwh)
-            transport_km = max(0, transport_km)
-            waste_kg = max(0, waste_kg)
-            water_m3 = max(0, water_m3)
-            fuel_l = max(0, fuel_l)
-            production_units = max(0, production_units)
-            grid_intensity = max(0, grid_intensity)
-            
-            # Calculate emissions (simplified model)
-            emissions = (
-                0.0005 * energy_kwh + 
-                0.0002 * transport_km + 
-                0.001 * waste_kg + 
-                0.0001 * water_m3 + 
-                0.002 * fuel_l
-            ) * grid_intensity
-            
-            # Add seasonal component
-            emissions *= 1 + 0.2 * np.sin(i/6)
-            
-            # Add to data
-            data.append({
-                'id': i + 1,
-                'date': date.strftime('%Y-%m-%d'),
-                'ds': date.strftime('%Y-%m-%d'),
-                'energy_use (kWh)': round(energy_kwh, 2),
-                'energy_kwh': round(energy_kwh, 2),
-                'transport (km)': round(transport_km, 2),
-                'transport_km': round(transport_km, 2),
-                'waste (tons)': round(waste_kg / 1000, 2),  # Convert kg to tons for display
-                'waste_kg': round(waste_kg, 2),
-                'water (liters)': round(water_m3 * 1000, 2),  # Convert m3 to liters for display
-                'water_m3': round(water_m3, 2),
-                'fuel (liters)': round(fuel_l, 2),
-                'fuel_l': round(fuel_l, 2),
-                'emissions (tons CO2e)': round(emissions, 2),
-                'y': round(emissions, 2),
-                'production (units)': round(production_units, 2),
-                'production_units': round(production_units, 2),
-                'grid_intensity (kg CO2e/kWh)': round(grid_intensity, 2),
-                'grid_intensity': round(grid_intensity, 2)
-            })
+        dataset_id = request.args.get('dataset_id')
+        analysis_id = request.args.get('analysis_id')
         
-        # Calculate summary statistics
-        df = pd.DataFrame(data)
+        if not dataset_id and not analysis_id:
+            return jsonify({"error": "dataset_id or analysis_id is required"}), 400
         
-        summary = {
-            'mean': {},
-            'min': {},
-            'max': {},
-            'std': {},
-            'total_rows': len(df)
-        }
+        path, cache_hit = build_report(dataset_id=dataset_id, analysis_id=analysis_id,
+                                       frequency=request.args.get('frequency'))
         
-        display_columns = [
-            'energy_use', 'transport', 'waste', 'water', 
-            'fuel', 'emissions', 'production', 'grid_intensity'
-        ]
+        response = Response(stream_with_context(iter_report(path)), mimetype=XLSX_MIMETYPE)
+        response.headers["Content-Disposition"] = "attachment; filename=carbon_report.xlsx"
+        response.headers["Access-Control-Expose-Headers"] = "Content-Disposition, X-Report-Cache"
+        response.headers["X-Report-Cache"] = "hit" if cache_hit else "miss"
+        return response
+    
+    except (DatasetNotFoundError, ReportNotAvailableError) as e:
+        return jsonify({"error": f"Report data not available: {str(e)}"}), 404
+    except InvalidDatasetError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.exception("Report export error")
+        return jsonify({"error": str(e)}), 500
+
+def _seeded_sample():
+    """Only seeded samples are reproducible and worth caching"""
+    return request.args.get('seed') not in (None, '')
+
+@app.route('/api/sample', methods=['GET'])
+@cached_response(cacheable=_seeded_sample)
+def generate_sample():
+    """Generate a synthetic dataset (?rows=&sites=&freq=&seed=&format=json|csv)"""
+    try:
+        periods = int(request.args.get('rows', 24))
+        sites = int(request.args.get('sites', 1))
+        freq = request.args.get('freq', '30D')
+        seed = request.args.get('seed')
+        seed = int(seed) if seed not in (None, '') else None
+        output_format = request.args.get('format', 'json').lower()
+        
+        if periods < 1 or sites < 1:
+            return jsonify({"error": "rows and sites must be positive"}), 400
+        if periods * sites > MAX_SAMPLE_ROWS:
+            return jsonify({"error": f"At most {MAX_SAMPLE_ROWS} rows can be generated"}), 400
         
-        backend_columns = [
-            'energy_kwh', 'transport_km', 'waste_kg', 'water_m3', 
-            'fuel_l', 'y', 'production_units', 'grid_intensity'
-        ]
+        try:
+            df = generate_sample_frame(periods=periods, sites=sites, freq=freq, seed=seed)
+        except ValueError as freq_err:
+            return jsonify({"error": f"Invalid frequency: {str(freq_err)}"}), 400
         
-        for display_col, backend_col in zip(display_columns, backend_columns):
-            summary['mean'][display_col] = float(df[backend_col].mean())
-            summary['min'][display_col] = float(df[backend_col].min())
-            summary['max'][display_col] = float(df[backend_col].max())
-            summary['std'][display_col] = float(df[backend_col].std())
+        # Large load-test datasets are streamed as CSV instead of JSON
+        if output_format == 'csv':
+            chunks, mimetype, download_name = stream_export([frame_to_sheet('Sample', df)], fmt='csv', filename='carbon_sample')
+            response = Response(stream_with_context(chunks), mimetype=mimetype)
+            response.headers["Content-Disposition"] = f"attachment; filename={download_name}"
+            return response
         
         return jsonify({
-            "data": data,
-            "summary": summary,
+            "data": df.to_dict(orient='records'),
+            "summary": sample_summary(df),
             "message": "Sample data generated successfully"
         }), 200
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/admin/profiles', methods=['GET'])
+@jwt_required()
+def list_profiles():
+    """List stored request profiles (admin only)"""
+    if not profiling.is_admin_request():
+        return jsonify({"error": "Admin access required"}), 403
+    if not profiling.PROFILING_ENABLED:
+        return jsonify({"error": "Profiling is disabled"}), 404
+    return jsonify({"profiles": profiling.profile_store.list()}), 200
+
+@app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+@jwt_required()
+def download_profile(profile_id):
+    """Download a stored .prof file, or a text summary with ?format=text (admin only)"""
+    if not profiling.is_admin_request():
+        return jsonify({"error": "Admin access required"}), 403
+    if not profiling.PROFILING_ENABLED:
+        return jsonify({"error": "Profiling is disabled"}), 404
+    try:
+        if request.args.get('format') == 'text':
+            limit = int(request.args.get('limit', 40))
+            summary = profiling.profile_store.summary(profile_id, limit=limit, sort=request.args.get('sort', 'cumulative'))
+            return Response(summary, mimetype='text/plain')
+        return send_file(profiling.profile_store.path(profile_id), mimetype='application/octet-stream',
+                         as_attachment=True, download_name=f"{profile_id}.prof")
+    except profiling.ProfileNotFoundError:
+        return jsonify({"error": "Profile not found"}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+# Wrap the profiled endpoints (no-op unless CARBONSYNC_PROFILING is set)
+profiling.init_app(app)
+
 if __name__ == '__main__':
-    # Generate sample data on startup
-    with app.app_context():
-        generate_sample()
-    
     app.run(debug=True, host='0.0.0.0', port=5000)
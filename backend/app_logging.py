@@ -0,0 +1,147 @@
+"""
+Structured Logging
+
+Sets up level-gated logging for the backend with a queue-based handler so
+request threads only enqueue records; a single QueueListener thread does
+the formatting-to-text and the stream I/O. Messages use lazy %-style
+arguments (and LazyFrame for DataFrames) so nothing is formatted for
+records below the configured level, and high-frequency events can be
+sampled with extra={'sample': N}.
+
+Configuration (environment):
+    CARBONSYNC_LOG_LEVEL: DEBUG, INFO, WARNING, ... (default INFO)
+    CARBONSYNC_LOG_FORMAT: 'text' (default) or 'json'
+"""
+
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.environ.get('CARBONSYNC_LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('CARBONSYNC_LOG_FORMAT', 'text').lower()
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+# LogRecord attributes that are not user-supplied structured fields
+_RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'sample'}
+
+_listener = None
+_handler = None
+_lock = threading.Lock()
+
+
+class LazyFrame:
+    """Defer DataFrame formatting until a log record is actually emitted"""
+    def __init__(self, df, rows=5):
+        self.df = df
+        self.rows = rows
+
+    def __str__(self):
+        return str(self.df.head(self.rows))
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line including any extra={...} fields"""
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc_info'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Pass 1 in N records logged with extra={'sample': N}.
+
+    Counting is per logger and message template, so one noisy call site
+    does not suppress another.
+    """
+    def __init__(self):
+        super().__init__()
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        every = getattr(record, 'sample', None)
+        if not every or every <= 1:
+            return True
+        key = (record.name, record.msg)
+        with self._lock:
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+        return count % every == 0
+
+
+class _EnqueueHandler(QueueHandler):
+    """QueueHandler that keeps structured extras and exceptions on the record"""
+    def prepare(self, record):
+        # Merge args into the message now so mutable arguments (DataFrames)
+        # are captured as they were; formatting to the final layout happens
+        # on the listener thread
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configure_logging(level=None, fmt=None, stream=None):
+    """
+    Install the queue handler on the root logger (idempotent)
+
+    Args:
+        level: Log level name; defaults to CARBONSYNC_LOG_LEVEL
+        fmt: 'text' or 'json'; defaults to CARBONSYNC_LOG_FORMAT
+        stream: Output stream for the listener (default stderr)
+    """
+    global _listener, _handler
+    with _lock:
+        if _listener is not None:
+            return
+
+        output = logging.StreamHandler(stream or sys.stderr)
+        if (fmt or LOG_FORMAT) == 'json':
+            output.setFormatter(JsonFormatter())
+        else:
+            output.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+        log_queue = queue.SimpleQueue()
+        handler = _EnqueueHandler(log_queue)
+        handler.addFilter(SamplingFilter())
+
+        root = logging.getLogger()
+        root.setLevel(getattr(logging, (level or LOG_LEVEL).upper(), logging.INFO))
+        root.addHandler(handler)
+        _handler = handler
+
+        _listener = QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener, _handler
+    with _lock:
+        if _listener is not None:
+            logging.getLogger().removeHandler(_handler)
+            _listener.stop()
+            _listener = None
+            _handler = None
@@ -0,0 +1,401 @@
+"""
+Forecast Backtesting
+
+Rolling-origin cross-validation of the forecast engines: for every cutoff
+the engine is fitted on the rows before it (an expanding window) and its
+next `horizon` forecasts are scored against the actual values. MAE, MAPE
+and the coverage of the 95% intervals are reported per horizon step, for
+every series and pooled over all of them.
+
+Adjacent folds share almost all of their training rows, so fits are
+warm-started instead of rebuilt:
+    linear:  the sufficient statistics of the previous fold are extended
+             with the rows up to the next cutoff, so each fold costs
+             O(step) rather than a refit on the whole window
+    prophet: the fit starts from the parameters of the previous fold's
+             model (Prophet's documented warm start)
+ETS is refitted on every fold; a fit is a single pass over the window.
+
+Prophet folds are split into contiguous chunks (warm-started within a
+chunk) that run in a process pool shared by all requests; the ETS and
+linear folds are cheap enough to run in the calling thread.
+"""
+
+import os
+import math
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+
+import ets
+import resample
+import forecasting
+from metrics import stage
+from analysis import REGRESSOR_COLUMNS
+from hierarchy import Hierarchy, MIN_POINTS
+from regression import SufficientStatsRegressor
+from dataset import widen
+
+logger = logging.getLogger("backtest")
+
+ENGINES = ('prophet', 'ets', 'linear')
+
+# Processes fitting Prophet folds
+BACKTEST_WORKERS = int(os.environ.get('CARBONSYNC_BACKTEST_WORKERS', min(4, os.cpu_count() or 1)))
+
+# Most recent cutoffs kept per series unless max_folds is given
+DEFAULT_MAX_FOLDS = 12
+
+
+class BacktestError(ValueError):
+    """Raised for invalid backtest parameters or series too short to backtest"""
+
+
+def fold_cutoffs(n_rows, horizon, initial=None, step=1, max_folds=DEFAULT_MAX_FOLDS):
+    """
+    Training window ends of the folds of a series
+
+    Args:
+        n_rows: Rows of the series
+        horizon: Forecast steps scored per fold
+        initial: Rows in the first training window (default: half the series)
+        step: Rows added to the training window between folds
+        max_folds: Most recent folds kept
+
+    Returns:
+        Ascending row indices; fold k trains on rows [0, cutoff) and is
+        scored on rows [cutoff, cutoff + horizon)
+    """
+    if initial is None:
+        initial = max(MIN_POINTS, n_rows // 2)
+    cutoffs = np.arange(max(initial, MIN_POINTS), n_rows - horizon + 1, step)
+    return cutoffs[-max_folds:] if max_folds else cutoffs
+
+
+def linear_folds(y, cutoffs, horizon):
+    """
+    Linear trend forecasts of every fold (see forecasting.linear_forecast)
+
+    The statistics are extended fold by fold, so only the rows between
+    adjacent cutoffs are folded in.
+
+    Returns:
+        (yhat, lower, upper), each (folds x horizon)
+    """
+    time_idx = np.arange(len(y), dtype=np.float64)
+    observed = ~np.isnan(y)
+    stats = SufficientStatsRegressor(['time_idx'])
+    yhat = np.empty((len(cutoffs), horizon))
+    sigma = np.empty((len(cutoffs), 1))
+
+    start = 0
+    for fold, cutoff in enumerate(cutoffs):
+        rows = observed[start:cutoff]
+        stats.partial_fit(time_idx[start:cutoff][rows, None], y[start:cutoff][rows])
+        start = cutoff
+        fit = stats.solve()
+        yhat[fold] = fit.predict(time_idx[cutoff:cutoff + horizon, None])
+        sigma[fold] = fit.residual_std
+
+    width = forecasting.INTERVAL_Z * sigma
+    return yhat, yhat - width, yhat + width
+
+
+def ets_folds(dates, y, regressors, cutoffs, horizon):
+    """
+    Holt-Winters forecasts of every fold (see forecasting.ets_forecast)
+
+    Returns:
+        (yhat, lower, upper), each (folds x horizon)
+    """
+    result = np.empty((3, len(cutoffs), horizon))
+    for fold, cutoff in enumerate(cutoffs):
+        # Missing regressors are constant 0 and ignored by the fit
+        model = ets.fit_series(y[:cutoff], regressors[:cutoff], ets.seasonal_period(dates[:cutoff]))
+        mean, variance = model.forecast(horizon)
+        width = forecasting.INTERVAL_Z * np.sqrt(variance)
+        result[:, fold] = mean, mean - width, mean + width
+    return tuple(result)
+
+
+def _prophet_changepoints(n_observed, model):
+    # Prophet drops changepoints that would fall outside changepoint_range
+    # of a short history; a different count means a cold fit
+    return max(1, min(model.n_changepoints, int(n_observed * model.changepoint_range) - 1))
+
+
+def prophet_folds(dates, y, regressors, cutoffs, horizon):
+    """
+    Prophet forecasts of consecutive folds, each warm-started from the previous fit
+
+    Future regressors are the training means, as in /api/predict.
+
+    Returns:
+        (yhat, lower, upper), each (folds x horizon)
+    """
+    frame = pd.DataFrame(regressors, columns=REGRESSOR_COLUMNS)
+    frame.insert(0, 'ds', dates)
+    frame['y'] = y
+    observed = np.cumsum(~np.isnan(y))
+    result = np.empty((3, len(cutoffs), horizon))
+
+    init = None
+    for fold, cutoff in enumerate(cutoffs):
+        train = frame.iloc[:cutoff]
+        model = forecasting.build_prophet_model(REGRESSOR_COLUMNS)
+        if init is not None and len(init['delta']) == _prophet_changepoints(observed[cutoff - 1], model):
+            try:
+                model.fit(train, init=init)
+            except Exception as e:
+                logger.debug("Warm-started Prophet fit failed, refitting: %s", e)
+                model = forecasting.build_prophet_model(REGRESSOR_COLUMNS)
+        if getattr(model, 'history', None) is None:
+            model.fit(train)
+        init = forecasting.prophet_warm_start(model)
+
+        future = model.make_future_dataframe(periods=horizon, freq=resample.prophet_frequency(dates),
+                                             include_history=False)
+        means = train[REGRESSOR_COLUMNS].mean()
+        for regressor in REGRESSOR_COLUMNS:
+            future[regressor] = means[regressor]
+        prediction = model.predict(future)
+        for i, column in enumerate(('yhat', 'yhat_lower', 'yhat_upper')):
+            result[i, fold] = prediction[column].to_numpy(dtype=np.float64)
+    return tuple(result)
+
+
+def run_folds(engine, dates, y, regressors, cutoffs, horizon):
+    """
+    Forecasts of one engine for the folds of a series
+
+    Args:
+        engine: 'prophet', 'ets' or 'linear'
+        dates, y, regressors: The series (regressors as REGRESSOR_COLUMNS)
+        cutoffs: First forecast row of every fold; each fold trains on the rows before it
+        horizon: Forecast steps per fold
+
+    Returns:
+        (yhat, lower, upper), each (folds x horizon)
+    """
+    if engine == 'prophet':
+        return prophet_folds(dates, y, regressors, cutoffs, horizon)
+    if engine == 'ets':
+        return ets_folds(dates, y, regressors, cutoffs, horizon)
+    return linear_folds(y, cutoffs, horizon)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    """Process pool shared by all backtests (forkserver, so request threads are not forked)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _pool = ProcessPoolExecutor(max_workers=BACKTEST_WORKERS,
+                                        mp_context=multiprocessing.get_context(method))
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def horizon_metrics(actual, yhat, lower, upper):
+    """
+    MAE, MAPE (%) and interval coverage of fold forecasts
+
+    Args:
+        actual, yhat, lower, upper: (folds x horizon) arrays; missing actuals are NaN
+
+    Returns:
+        (one dict per horizon step, dict over all steps); metrics without
+        observations are None
+    """
+    observed = ~np.isnan(actual)
+    error = np.where(observed, np.abs(actual - yhat), 0.0)
+    scaled = observed & (actual != 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        percentage = np.where(scaled, error / np.abs(actual), 0.0)
+    covered = observed & (lower <= actual) & (actual <= upper)
+
+    def summarize(axis):
+        n = observed.sum(axis=axis)
+        n_scaled = scaled.sum(axis=axis)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            values = (error.sum(axis=axis) / n,
+                      100 * percentage.sum(axis=axis) / n_scaled,
+                      covered.sum(axis=axis) / n)
+        return n, values
+
+    def entry(n, mae, mape, coverage):
+        value = lambda x: None if not np.isfinite(x) else float(x)
+        return {"n": int(n), "mae": value(mae), "mape": value(mape), "coverage": value(coverage)}
+
+    n, values = summarize(0)
+    by_horizon = [dict(horizon=step + 1, **entry(n[step], *(v[step] for v in values)))
+                  for step in range(actual.shape[1])]
+    n, values = summarize(None)
+    return by_horizon, entry(n, *values)
+
+
+def run_backtest(data, engines=None, horizon=3, initial=None, step=1, max_folds=DEFAULT_MAX_FOLDS,
+                 group_by=None, workers=None):
+    """
+    Rolling-origin backtest of the forecast engines
+
+    Args:
+        data: CarbonDataset with a y column (and the group_by labels)
+        engines: Engine names (default: prophet when installed, ets and linear)
+        horizon: Forecast steps scored per fold
+        initial: Rows in the first training window of each series (default: half the series)
+        step: Rows added to the training window between folds
+        max_folds: Most recent folds kept per series (0 keeps all)
+        group_by: Grouping columns; each group is backtested as its own series
+        workers: Processes for the Prophet folds (default CARBONSYNC_BACKTEST_WORKERS, 1 runs inline)
+
+    Returns:
+        dict with the fold settings, pooled metrics per engine, the best
+        engine by MAE and the metrics of every series
+
+    Raises:
+        BacktestError: for invalid parameters or when no series has a complete fold
+    """
+    if engines is None:
+        engines = [engine for engine in ENGINES if engine != 'prophet' or forecasting.PROPHET_AVAILABLE]
+    engines = list(dict.fromkeys(engines))
+    unknown = [engine for engine in engines if engine not in ENGINES]
+    if unknown or not engines:
+        raise BacktestError(f"Unknown forecast engine: {', '.join(unknown) or 'none given'}")
+    if 'prophet' in engines and not forecasting.PROPHET_AVAILABLE:
+        raise BacktestError("Prophet is not installed")
+    if horizon < 1 or step < 1 or max_folds < 0 or (initial is not None and initial < MIN_POINTS):
+        raise BacktestError(f"horizon and step must be positive and initial at least {MIN_POINTS}")
+    workers = workers or BACKTEST_WORKERS
+
+    with stage('aggregate'):
+        if group_by:
+            hierarchy = Hierarchy.from_dataset(data, group_by)
+            nodes = np.arange(len(hierarchy.nodes) - hierarchy.n_bottom, len(hierarchy.nodes))
+            series = hierarchy.node_datasets(data, nodes)
+            names = [(hierarchy.node_id(node), dict(zip(hierarchy.levels, hierarchy.nodes[node][1])))
+                     for node in nodes]
+        else:
+            if data.has_duplicate_dates():
+                raise BacktestError("Duplicate dates found. Each date must be unique.")
+            series = [data]
+            names = [('total', {})]
+
+    plans, skipped = [], []
+    for (name, key), s in zip(names, series):
+        cutoffs = fold_cutoffs(len(s), horizon, initial, step, max_folds)
+        if len(cutoffs):
+            y = widen(s.column('y'))
+            plans.append((name, key, s.dates, y, s.filled(REGRESSOR_COLUMNS), cutoffs))
+        else:
+            skipped.append(name)
+    if not plans:
+        raise BacktestError(f"Not enough data points for a {horizon}-step backtest fold")
+
+    # Contiguous chunks of each series' folds: one per worker for a single
+    # series, whole series when there are more series than workers
+    tasks = []
+    for index, (_, _, dates, y, regressors, cutoffs) in enumerate(plans):
+        for engine in engines:
+            chunks = 1
+            if engine == 'prophet' and workers > 1:
+                chunks = min(len(cutoffs), math.ceil(workers / len(plans)))
+            for part in np.array_split(np.arange(len(cutoffs)), chunks):
+                tasks.append((index, engine, part, (engine, dates, y, regressors, cutoffs[part], horizon)))
+
+    results = [None] * len(tasks)
+    with stage('fit'):
+        futures = {}
+        remote = [i for i, task in enumerate(tasks) if task[1] == 'prophet'] if workers > 1 else []
+        if remote:
+            try:
+                pool = _get_pool()
+                futures = {i: pool.submit(run_folds, *tasks[i][3]) for i in remote}
+            except BrokenProcessPool:
+                logger.warning("Backtest process pool is broken; running the folds inline")
+                _reset_pool()
+                futures = {}
+        for i, task in enumerate(tasks):
+            try:
+                if i in futures:
+                    try:
+                        results[i] = futures[i].result()
+                    except BrokenProcessPool:
+                        _reset_pool()
+                        results[i] = run_folds(*task[3])
+                else:
+                    results[i] = run_folds(*task[3])
+            except Exception as e:
+                logger.warning("%s backtest of %s failed: %s", task[1], plans[task[0]][0], e)
+                results[i] = e
+
+    with stage('score'):
+        forecasts = {}
+        for (index, engine, part, _), result in zip(tasks, results):
+            n_folds, failed = len(plans[index][5]), isinstance(result, Exception)
+            arrays = forecasts.setdefault((index, engine), [np.empty((n_folds, horizon)) for _ in range(3)])
+            if failed or arrays is None:
+                forecasts[(index, engine)] = None if failed else arrays
+                continue
+            for array, values in zip(arrays, result):
+                array[part] = values
+
+        pooled = {engine: [] for engine in engines}
+        series_results = []
+        for index, (name, key, dates, y, _, cutoffs) in enumerate(plans):
+            actual = np.full((len(cutoffs), horizon), np.nan)
+            for fold, cutoff in enumerate(cutoffs):
+                actual[fold] = y[cutoff:cutoff + horizon]
+
+            engine_results = {}
+            for engine in engines:
+                arrays = forecasts[(index, engine)]
+                if arrays is None:
+                    engine_results[engine] = {"error": f"{engine} failed on this series"}
+                    continue
+                by_horizon, overall = horizon_metrics(actual, *arrays)
+                engine_results[engine] = {"overall": overall, "by_horizon": by_horizon}
+                pooled[engine].append([actual] + arrays)
+
+            series_results.append({
+                "id": name,
+                "key": key,
+                "cutoffs": [pd.Timestamp(dates[cutoff]).strftime('%Y-%m-%d') for cutoff in cutoffs],
+                "engines": engine_results
+            })
+
+        totals = {}
+        for engine, collected in pooled.items():
+            if not collected:
+                totals[engine] = {"error": f"{engine} failed on every series"}
+                continue
+            by_horizon, overall = horizon_metrics(*(np.vstack(arrays) for arrays in zip(*collected)))
+            totals[engine] = {"overall": overall, "by_horizon": by_horizon}
+
+    scored = [engine for engine in engines if totals[engine].get("overall", {}).get("mae") is not None]
+    return {
+        "horizon": horizon,
+        "initial": initial,
+        "step": step,
+        "folds": int(sum(len(plan[5]) for plan in plans)),
+        "engines": totals,
+        "best_engine": min(scored, key=lambda engine: totals[engine]["overall"]["mae"]) if scored else None,
+        "series": series_results,
+        "skipped": skipped
+    }
@@ -0,0 +1,340 @@
+"""
+End-to-end API Benchmarks
+
+Drives app.test_client() against the Flask hot paths with generated
+datasets of increasing size and reports latency percentiles, throughput,
+peak RSS and allocation statistics as JSON. Results can be compared
+against a stored baseline to catch performance regressions before a
+deploy.
+
+Usage (from the backend directory):
+    python benchmarks/run_benchmarks.py --sizes 24,240,2400 --iterations 20
+    python benchmarks/run_benchmarks.py --save-baseline
+    python benchmarks/run_benchmarks.py --baseline benchmarks/baseline.json --tolerance 0.25
+
+The exit code is 1 when any case regresses beyond the tolerance.
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import base64
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(BACKEND_DIR, 'benchmarks', 'baseline.json')
+
+# Canonical upload schema, matching sample_yazaki_data.csv
+UPLOAD_COLUMNS = ['ds', 'energy_kwh', 'production_units', 'transport_km', 'waste_kg',
+                  'water_m3', 'fuel_l', 'grid_intensity', 'y']
+
+
+def _isolate_state(workdir):
+    """Point every on-disk store at a scratch directory before importing the app"""
+    os.environ['CARBONSYNC_DATASET_DIR'] = os.path.join(workdir, 'datasets')
+    os.environ['CARBONSYNC_REPORT_DIR'] = os.path.join(workdir, 'reports')
+    os.environ['CARBONSYNC_SHARED_CACHE_PATH'] = os.path.join(workdir, 'shared_cache.sqlite3')
+
+
+def _load_app(workdir):
+    """Import the Flask app with users and voice profiles redirected to workdir"""
+    os.chdir(BACKEND_DIR)
+    sys.path.insert(0, BACKEND_DIR)
+
+    import users
+    users.USERS_DB_FILE = os.path.join(workdir, 'users.json')
+    users.init_users_db()
+
+    import app as app_module
+    profiles = os.path.join(workdir, 'voice_profiles')
+    os.makedirs(profiles, exist_ok=True)
+    from pathlib import Path
+    app_module.voice_authenticator.voice_profiles_path = Path(profiles)
+    return app_module
+
+
+def reset_caches():
+    """Drop in-process and shared caches so cold-path cases measure the full work"""
+    import analysis
+    import http_cache
+    from shared_cache import shared_cache
+    analysis.clear_contexts()
+    http_cache.response_cache.clear()
+    shared_cache.clear()
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in KB on Linux
+    return peak / (1024 * 1024) if platform.system() == 'Darwin' else peak / 1024
+
+
+def make_dataset(rows, seed=7):
+    """Generate a single-site daily dataset in the canonical upload schema"""
+    from sample_data import generate_sample_frame
+    df = generate_sample_frame(periods=rows, sites=1, freq='D', seed=seed)
+    return df[UPLOAD_COLUMNS]
+
+
+def make_audio(seed, size=16000):
+    """Deterministic fake audio payload for the voice endpoints"""
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    return base64.b64encode(rng.integers(-128, 127, size=size, dtype=np.int8).tobytes()).decode('ascii')
+
+
+class BenchmarkCase:
+    """
+    One endpoint scenario.
+
+    Args:
+        name: Unique case name (used as the baseline key)
+        request: Callable(client) issuing the request and returning the response
+        expected_status: Status code a successful call returns
+        before_each: Optional callable run (untimed) before every iteration
+    """
+    def __init__(self, name, request, expected_status=200, before_each=None):
+        self.name = name
+        self.request = request
+        self.expected_status = expected_status
+        self.before_each = before_each
+
+
+def build_cases(app_module, client, sizes, cold, response_cache=False):
+    """
+    Create the benchmark cases for every dataset size
+
+    The predict and optimize requests send Cache-Control: no-cache, so they
+    time the computation rather than response cache hits, unless
+    response_cache is set.
+    """
+    cases = []
+    before_each = reset_caches if cold else None
+    cache_headers = {} if response_cache else {'Cache-Control': 'no-cache'}
+
+    # Authentication and voice endpoints do not depend on dataset size
+    login_payload = {'username': 'admin', 'password': 'admin123'}
+    cases.append(BenchmarkCase('auth_login', lambda c: c.post('/api/auth/login', json=login_payload)))
+
+    token = client.post('/api/auth/login', json=login_payload).get_json()['access_token']
+    auth_headers = {'Authorization': f"Bearer {token}"}
+    reference_audio = make_audio(1)
+    verification_audio = make_audio(2)
+
+    cases.append(BenchmarkCase('voice_phrase', lambda c: c.get('/api/auth/voice/phrase')))
+    cases.append(BenchmarkCase('voice_enroll', lambda c: c.post(
+        '/api/auth/voice/enroll', json={'audio_data': reference_audio}, headers=auth_headers)))
+    cases.append(BenchmarkCase('voice_verify', lambda c: c.post(
+        '/api/auth/voice/verify', json={'user_id': 'admin-1', 'audio_data': reference_audio}),
+        expected_status=None))
+    cases.append(BenchmarkCase('voice_compare', lambda c: c.post(
+        '/api/auth/voice/compare', json={'reference_audio': reference_audio, 'verification_audio': verification_audio}),
+        expected_status=None))
+
+    for size in sizes:
+        df = make_dataset(size)
+        csv_bytes = df.to_csv(index=False).encode('utf-8')
+        xlsx_buffer = io.BytesIO()
+        df.to_excel(xlsx_buffer, index=False, engine='xlsxwriter')
+        xlsx_bytes = xlsx_buffer.getvalue()
+
+        records = json.loads(df.to_json(orient='records'))
+        # The data is daily; 'raw' keeps it daily whatever CARBONSYNC_MODEL_FREQUENCY says
+        forecast_payload = {'data': records, 'forecast_periods': 12, 'frequency': 'raw'}
+        optimize_payload = {
+            'data': records,
+            'forecast_periods': 12,
+            'frequency': 'raw',
+            'suggestions': [{'regressor': 'energy_kwh', 'reduction_pct': 10}]
+        }
+
+        def upload(c, payload=csv_bytes, name='data.csv'):
+            return c.post('/api/upload', data={'file': (io.BytesIO(payload), name)})
+
+        cases.append(BenchmarkCase(f"upload_csv[{size}]", upload))
+        cases.append(BenchmarkCase(f"upload_xlsx[{size}]",
+                                   lambda c, payload=xlsx_bytes: upload(c, payload, 'data.xlsx')))
+
+        def predict(c, payload=forecast_payload, engine='prophet'):
+            # The engine is part of the payload, so each engine has its own response cache entry
+            return c.post('/api/predict', json=dict(payload, engine=engine), headers=cache_headers)
+
+        if app_module.PROPHET_AVAILABLE:
+            cases.append(BenchmarkCase(f"predict_prophet[{size}]", predict, before_each=before_each))
+        cases.append(BenchmarkCase(f"predict_ets[{size}]",
+                                   lambda c, payload=forecast_payload: predict(c, payload, 'ets'),
+                                   before_each=before_each))
+        cases.append(BenchmarkCase(f"predict_fallback[{size}]",
+                                   lambda c, payload=forecast_payload: predict(c, payload, 'linear'),
+                                   before_each=before_each))
+        cases.append(BenchmarkCase(f"optimize[{size}]",
+                                   lambda c, payload=optimize_payload: c.post('/api/optimize', json=payload, headers=cache_headers),
+                                   before_each=before_each))
+
+        forecast = predict(client, forecast_payload, 'linear').get_json()['forecast']
+        export_payload = {'forecast': forecast * max(1, size // len(forecast))}
+        cases.append(BenchmarkCase(f"export[{size}]", lambda c, payload=export_payload: c.post('/api/export', json=payload)))
+
+    return cases
+
+
+def run_case(client, case, iterations, warmup):
+    """Time one case and collect its statistics"""
+    for _ in range(warmup):
+        if case.before_each:
+            case.before_each()
+        case.request(client).get_data()
+
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        if case.before_each:
+            case.before_each()
+        t0 = time.perf_counter()
+        response = case.request(client)
+        response.get_data()  # drain streamed bodies
+        latencies.append((time.perf_counter() - t0) * 1000)
+        if case.expected_status is not None and response.status_code != case.expected_status:
+            errors += 1
+    wall = time.perf_counter() - started
+
+    # One extra, untimed iteration under tracemalloc for allocation statistics
+    if case.before_each:
+        case.before_each()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    case.request(client).get_data()
+    after = tracemalloc.take_snapshot()
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    net_blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename'))
+
+    return {
+        'iterations': iterations,
+        'errors': errors,
+        'latency_ms': {
+            'mean': sum(latencies) / len(latencies),
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': max(latencies)
+        },
+        'throughput_rps': iterations / wall if wall > 0 else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'traced_peak_mb': traced_peak / (1024 * 1024),
+        'alloc_blocks_net': net_blocks
+    }
+
+
+def compare_to_baseline(results, baseline, tolerance, metric='p50'):
+    """
+    Flag cases whose latency grew by more than tolerance over the baseline
+
+    Returns:
+        list of regression dicts
+    """
+    regressions = []
+    for name, current in results['cases'].items():
+        reference = baseline.get('cases', {}).get(name)
+        if not reference:
+            continue
+        old = reference['latency_ms'][metric]
+        new = current['latency_ms'][metric]
+        if old > 0 and new > old * (1 + tolerance):
+            regressions.append({
+                'case': name,
+                'metric': metric,
+                'baseline_ms': old,
+                'current_ms': new,
+                'change_pct': (new / old - 1) * 100
+            })
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the CarbonSync API hot paths")
+    parser.add_argument('--sizes', default='24,240,2400', help="Comma-separated dataset sizes (rows)")
+    parser.add_argument('--iterations', type=int, default=10, help="Timed iterations per case")
+    parser.add_argument('--warmup', type=int, default=2, help="Untimed warmup iterations per case")
+    parser.add_argument('--filter', default=None, help="Only run cases whose name contains this text")
+    parser.add_argument('--cold', action='store_true', help="Clear in-process caches before every iteration")
+    parser.add_argument('--response-cache', action='store_true',
+                        help="Let predict and optimize be answered from the response cache")
+    parser.add_argument('--output', default=None, help="Write the JSON results to this file")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed p50 slowdown (0.25 = 25%%)")
+    parser.add_argument('--save-baseline', action='store_true', help="Store these results as the new baseline")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='carbonsync-bench-')
+    try:
+        _isolate_state(workdir)
+        app_module = _load_app(workdir)
+        client = app_module.app.test_client()
+
+        sizes = [int(size) for size in args.sizes.split(',') if size]
+        cases = build_cases(app_module, client, sizes, args.cold, args.response_cache)
+        if args.filter:
+            cases = [case for case in cases if args.filter in case.name]
+
+        results = {
+            'generated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'prophet_available': app_module.PROPHET_AVAILABLE,
+            'cold': args.cold,
+            'response_cache': args.response_cache,
+            'cases': {}
+        }
+        for case in cases:
+            results['cases'][case.name] = run_case(client, case, args.iterations, args.warmup)
+            print(f"{case.name}: p50={results['cases'][case.name]['latency_ms']['p50']:.2f} ms", file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    exit_code = 0
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        results['regressions'] = compare_to_baseline(results, baseline, args.tolerance)
+        if results['regressions']:
+            exit_code = 1
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
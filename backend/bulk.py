@@ -0,0 +1,248 @@
+"""
+Bulk Upload
+
+Ingests many spreadsheets at once, e.g. one file per site per month, as
+a list of files and/or zip archives. Each file is parsed, column-mapped,
+date-parsed and converted on its own (see preprocess.py); Excel parsing
+is CPU-bound and holds the GIL, so the files are processed in a process
+pool. The processed files are labelled with their site and merged into
+one multi-site dataset, and every file gets its own status so a bad file
+does not fail the batch.
+
+Processed files share the upload cache with /api/upload (keyed by file
+content), and the summary of the merged dataset is merged from the
+per-file moments instead of being recomputed over all rows.
+"""
+
+import io
+import os
+import re
+import hashlib
+import logging
+import zipfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+
+import ingest
+import incremental
+from preprocess import ColumnMappingError, NUMERIC_COLUMNS
+from metrics import stage
+from shared_cache import shared_cache
+
+logger = logging.getLogger("bulk")
+
+# Processes parsing the files of a bulk upload (1 parses them inline)
+UPLOAD_WORKERS = int(os.environ.get('CARBONSYNC_UPLOAD_WORKERS', min(4, os.cpu_count() or 1)))
+
+# Upper bound on the total (uncompressed) size of a bulk upload
+BULK_MAX_BYTES = int(os.environ.get('CARBONSYNC_BULK_MAX_BYTES', 512 * 1024 * 1024))
+
+# File types that can be ingested
+SUPPORTED_EXTENSIONS = ('.csv', '.xls', '.xlsx')
+
+
+class BulkUploadError(ValueError):
+    """Raised for unreadable archives, oversized uploads and batches without a usable file"""
+    def __init__(self, message, reports=None):
+        super().__init__(message)
+        self.reports = reports
+
+
+def file_cache_key(filename, content):
+    """Upload cache key of a file: the same hash of type and content as a single /api/upload"""
+    digest = hashlib.sha256()
+    digest.update(os.path.splitext(filename)[1].lower().encode('utf-8') + b'\0')
+    digest.update(content)
+    return f"upload:{digest.hexdigest()}"
+
+
+def site_name(path, pattern=None):
+    """
+    Site of a file: the first group (or the match) of pattern in its path,
+    otherwise its top-level folder in the archive, otherwise its name
+    """
+    if pattern:
+        match = re.search(pattern, path)
+        if match:
+            return match.group(1) if match.groups() else match.group(0)
+    parts = [part for part in re.split(r'[\\/]', path) if part]
+    if len(parts) > 1:
+        return parts[0]
+    return os.path.splitext(parts[-1] if parts else path)[0]
+
+
+def expand(files, max_bytes=None):
+    """
+    (path, content) of every uploaded file, with zip archives unpacked
+
+    Args:
+        files: (filename, binary stream) pairs
+        max_bytes: Upper bound on the total size (default CARBONSYNC_BULK_MAX_BYTES)
+
+    Raises:
+        BulkUploadError: for corrupt archives or uploads above max_bytes
+    """
+    max_bytes = max_bytes or BULK_MAX_BYTES
+    entries = []
+    total = 0
+    for filename, stream in files:
+        if filename.lower().endswith('.zip'):
+            try:
+                archive = zipfile.ZipFile(stream)
+            except zipfile.BadZipFile:
+                raise BulkUploadError(f"{filename} is not a valid zip archive")
+            with archive:
+                members = [info for info in archive.infolist()
+                           if not info.is_dir() and not info.filename.startswith('__MACOSX/')
+                           and not os.path.basename(info.filename).startswith('.')]
+                # Checked before extracting so a zip bomb is never inflated
+                total += sum(info.file_size for info in members)
+                if total > max_bytes:
+                    raise BulkUploadError(f"Upload exceeds {max_bytes} bytes")
+                entries.extend((info.filename, archive.read(info)) for info in members)
+        else:
+            content = stream.read()
+            total += len(content)
+            if total > max_bytes:
+                raise BulkUploadError(f"Upload exceeds {max_bytes} bytes")
+            entries.append((filename, content))
+    return entries
+
+
+def process_file(path, content):
+    """
+    Parse and process one file (runs in the worker processes)
+
+    Returns:
+        UploadState of the file
+
+    Raises:
+        ColumnMappingError, or the parser's exception for unreadable files
+    """
+    stream = io.BytesIO(content)
+    if path.lower().endswith('.csv'):
+        df = ingest.read_csv(stream)
+    else:
+        df = ingest.read_excel(stream, path)
+    return incremental.process(df)[0]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    """Process pool shared by all bulk uploads (forkserver, so request threads are not forked)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _pool = ProcessPoolExecutor(max_workers=UPLOAD_WORKERS,
+                                        mp_context=multiprocessing.get_context(method))
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def describe_error(error):
+    if isinstance(error, ColumnMappingError):
+        return str(error)
+    return f"{type(error).__name__}: {error}"
+
+
+def ingest_files(entries, site_pattern=None, workers=None):
+    """
+    Process files in parallel and merge them into one multi-site frame
+
+    Args:
+        entries: (path, content) pairs (see expand)
+        site_pattern: Optional regex whose first group names the site of a path
+        workers: Processes (default CARBONSYNC_UPLOAD_WORKERS, 1 runs inline)
+
+    Returns:
+        (merged frame with a 'site' column, summary, per-file reports)
+
+    Raises:
+        BulkUploadError: for an invalid site_pattern, or if no file could be processed
+    """
+    workers = workers or UPLOAD_WORKERS
+    if site_pattern:
+        try:
+            re.compile(site_pattern)
+        except re.error as e:
+            raise BulkUploadError(f"Invalid site_pattern: {e}")
+    reports = []
+    processed = {}
+    pending = []
+    with stage('cache'):
+        for i, (path, content) in enumerate(entries):
+            reports.append({"file": path, "site": site_name(path, site_pattern)})
+            if not path.lower().endswith(SUPPORTED_EXTENSIONS):
+                reports[i]["error"] = "Unsupported file format. Please upload CSV or Excel files."
+                continue
+            cached = shared_cache.get(file_cache_key(path, content))
+            if cached is not None and 'state' in cached:
+                processed[i] = cached
+            else:
+                pending.append(i)
+
+    with stage('parse'):
+        futures = {}
+        if workers > 1 and len(pending) > 1:
+            try:
+                pool = _get_pool()
+                futures = {i: pool.submit(process_file, *entries[i]) for i in pending}
+            except BrokenProcessPool:
+                logger.warning("Upload process pool is broken; processing the files inline")
+                _reset_pool()
+                futures = {}
+        for i in pending:
+            try:
+                if i in futures:
+                    try:
+                        state = futures[i].result()
+                    except BrokenProcessPool:
+                        _reset_pool()
+                        state = process_file(*entries[i])
+                else:
+                    state = process_file(*entries[i])
+            except Exception as e:
+                logger.info("Bulk upload file %s failed: %s", entries[i][0], e)
+                reports[i]["error"] = describe_error(e)
+                continue
+            frame, summary = incremental.finish(state)
+            processed[i] = {'frame': frame, 'summary': summary, 'state': state}
+            shared_cache.set(file_cache_key(*entries[i]), processed[i])
+
+    if not processed:
+        raise BulkUploadError("None of the files could be processed", reports)
+
+    with stage('merge'):
+        frames = []
+        moments = None
+        for i in sorted(processed):
+            frame = processed[i]['frame']
+            # Site values in the file win over the site of its path
+            if 'site' in frame.columns:
+                site = frame['site'].fillna('').astype(str)
+                frame['site'] = site.where(site != '', reports[i]["site"])
+            else:
+                frame['site'] = reports[i]["site"]
+            frames.append(frame)
+            reports[i]["rows"] = len(frame)
+            file_moments = processed[i]['state'].moments.filled(len(frame)).reindex(NUMERIC_COLUMNS)
+            moments = file_moments if moments is None else moments.merge(file_moments)
+        merged = pd.concat(frames, ignore_index=True)
+        present = [col for col in NUMERIC_COLUMNS if col in merged.columns]
+        summary = moments.reindex(present).summary(len(merged))
+    return merged, summary, reports
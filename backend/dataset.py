@@ -0,0 +1,232 @@
+"""
+Compact Carbon Dataset
+
+CarbonDataset keeps the eight canonical metrics of a dataset in one
+contiguous (rows x 8) float32 matrix next to a datetime64 date index,
+instead of a DataFrame of object/float64 columns. Datasets with values
+float32 cannot hold (more than about 7 significant digits) keep a
+float64 matrix instead, so no upload loses precision and two uploads that
+differ only in those digits never share a fingerprint. It is what the dataset
+store caches and what the analysis context works on; a pandas DataFrame
+is only built at the boundary (Prophet, report sheets). Grouping columns
+(country, plant, line, ...) are kept as string label arrays for
+hierarchical forecasting.
+"""
+
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+# Canonical metric columns, in matrix column order
+METRIC_COLUMNS = ['energy_kwh', 'transport_km', 'waste_kg', 'water_m3',
+                  'fuel_l', 'production_units', 'grid_intensity', 'y']
+
+METRIC_INDEX = {name: i for i, name in enumerate(METRIC_COLUMNS)}
+
+# Metrics averaged instead of summed when rows are aggregated
+MEAN_COLUMNS = ('grid_intensity',)
+
+# Grouping columns kept as labels when present in a source frame
+LABEL_COLUMNS = ['country', 'plant', 'site', 'line', 'scope']
+
+# float32 holds about 7 significant decimal digits
+FLOAT32_DIGITS = 7
+
+
+def widen(values):
+    """
+    Convert float32 values to float64 at their decimal value
+
+    A plain cast turns 0.382 into 0.38199999928474426; rounding to the
+    float32 precision first restores the value the data was written with.
+    Values >= 1e7 are integral in float32 and, like values too small for
+    an exact power-of-ten scale, are cast unchanged. float64 values are
+    returned as they are.
+    """
+    if np.asarray(values).dtype == np.float64:
+        return np.array(values, dtype=np.float64)
+    wide = np.asarray(values, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        magnitude = np.floor(np.log10(np.abs(wide)))
+    decimals = FLOAT32_DIGITS - 1 - magnitude
+    restorable = (decimals >= 0) & (decimals <= 22)
+    scale = 10.0 ** np.where(restorable, decimals, 0)
+    restored = np.round(wide * scale) / scale
+    return np.where(restorable, restored, wide)
+
+
+def compact(values):
+    """
+    float32 copy of float64 values when every value survives the round
+    trip through widen(), otherwise the float64 values
+    """
+    values = np.asarray(values)
+    if values.dtype != np.float64:
+        return np.asarray(values, dtype=np.float32)
+    narrow = values.astype(np.float32)
+    if np.array_equal(widen(narrow), values, equal_nan=True):
+        return narrow
+    return values
+
+
+class InvalidDatasetError(ValueError):
+    """Raised when a frame cannot be turned into a CarbonDataset"""
+
+
+class CarbonDataset:
+    """
+    Date-sorted metrics of one dataset.
+
+    Attributes:
+        dates: datetime64[ns] array of length n (sorted ascending)
+        values: C-contiguous float32 array of shape (n, 8), or float64 when
+            float32 cannot hold the values (see compact); NaN marks missing values
+        present: Metric columns that were present in the source data
+        labels: Grouping column name -> str array of length n
+    """
+    __slots__ = ('dates', 'values', 'present', 'labels', '_fingerprint')
+
+    def __init__(self, dates, values, present=None, labels=None):
+        self.dates = np.asarray(dates, dtype='datetime64[ns]')
+        self.values = np.ascontiguousarray(compact(values))
+        if self.values.shape != (len(self.dates), len(METRIC_COLUMNS)):
+            raise InvalidDatasetError(f"Expected values of shape ({len(self.dates)}, {len(METRIC_COLUMNS)})")
+        self.present = tuple(METRIC_COLUMNS if present is None else [col for col in METRIC_COLUMNS if col in present])
+        self.labels = {name: np.asarray(column, dtype=str) for name, column in (labels or {}).items()}
+        for name, column in self.labels.items():
+            if column.shape != self.dates.shape:
+                raise InvalidDatasetError(f"Label column '{name}' does not match the number of rows")
+        self._fingerprint = None
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0, dtype='datetime64[ns]'), np.empty((0, len(METRIC_COLUMNS)), dtype=np.float32), ())
+
+    @classmethod
+    def from_frame(cls, df, date_column='ds', label_columns=None):
+        """
+        Build a dataset from a DataFrame with a date column and metric columns
+
+        Non-numeric metric values become NaN; rows are sorted by date.
+
+        Args:
+            df: Source frame
+            date_column: Name of the date column
+            label_columns: Grouping columns to keep (default: the LABEL_COLUMNS present)
+
+        Raises:
+            InvalidDatasetError: if the date column or a requested label column is missing
+        """
+        if df.empty:
+            return cls.empty()
+        if date_column not in df.columns:
+            raise InvalidDatasetError(f"Missing required column: {date_column}")
+        if label_columns is None:
+            label_columns = [col for col in LABEL_COLUMNS if col in df.columns]
+        for col in label_columns:
+            if col not in df.columns:
+                raise InvalidDatasetError(f"Missing grouping column: {col}")
+
+        dates = pd.to_datetime(df[date_column])
+        if getattr(dates.dt, 'tz', None) is not None:
+            dates = dates.dt.tz_convert(None)
+        dates = dates.to_numpy(dtype='datetime64[ns]')
+
+        values = np.full((len(df), len(METRIC_COLUMNS)), np.nan)
+        present = []
+        for j, col in enumerate(METRIC_COLUMNS):
+            if col in df.columns:
+                values[:, j] = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=np.float64)
+                present.append(col)
+
+        labels = {col: df[col].fillna('').astype(str).to_numpy(dtype=str) for col in label_columns}
+
+        order = np.argsort(dates, kind='stable')
+        if np.any(order[1:] < order[:-1]):
+            dates = dates[order]
+            values = values[order]
+            labels = {col: column[order] for col, column in labels.items()}
+        return cls(dates, values, present, labels)
+
+    def __len__(self):
+        return len(self.dates)
+
+    @property
+    def nbytes(self):
+        return self.dates.nbytes + self.values.nbytes
+
+    def has(self, column):
+        """True if the column was present in the source data ('ds' always is)"""
+        return column == 'ds' or column in self.present
+
+    def column(self, name):
+        """View of one metric column (float32 or float64, NaN for missing values)"""
+        return self.values[:, METRIC_INDEX[name]]
+
+    def filled(self, columns, fill=0.0):
+        """Selected metric columns as a float64 (n x k) matrix with NaN replaced by fill"""
+        matrix = widen(self.values[:, [METRIC_INDEX[col] for col in columns]])
+        np.nan_to_num(matrix, copy=False, nan=fill)
+        return matrix
+
+    def select(self, rows):
+        """Dataset of the given rows (boolean mask or sorted index array)"""
+        return CarbonDataset(self.dates[rows], self.values[rows], self.present,
+                             {name: column[rows] for name, column in self.labels.items()})
+
+    def has_duplicate_dates(self):
+        return bool(len(self.dates) > 1 and np.any(self.dates[1:] == self.dates[:-1]))
+
+    @property
+    def last_date(self):
+        return pd.Timestamp(self.dates[-1]) if len(self.dates) else None
+
+    def fingerprint(self):
+        """Stable hash of the dates, the present columns and the values"""
+        if self._fingerprint is None:
+            digest = hashlib.sha1(','.join(self.present).encode('utf-8'))
+            digest.update(self.dates.view('int64').tobytes())
+            digest.update(self.values.tobytes())
+            for name in sorted(self.labels):
+                digest.update(name.encode('utf-8'))
+                digest.update(self.labels[name].tobytes())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def to_frame(self, columns=None, labels=False):
+        """
+        Convert to a DataFrame with 'ds' and the given float64 metric columns
+
+        Args:
+            columns: Metric columns to include (default: the present ones)
+            labels: Also include the grouping label columns
+        """
+        columns = list(self.present if columns is None else columns)
+        label_columns = list(self.labels) if labels else []
+        data = {'ds': pd.DatetimeIndex(self.dates)}
+        for col in label_columns:
+            data[col] = self.labels[col]
+        for col in columns:
+            data[col] = widen(self.column(col))
+        return pd.DataFrame(data, columns=['ds'] + label_columns + columns)
+
+    def to_arrays(self):
+        """Arrays for np.savez (see from_arrays)"""
+        arrays = {
+            'dates': self.dates.view('int64'),
+            'values': self.values,
+            'present': np.array(self.present, dtype=str),
+            'label_names': np.array(list(self.labels), dtype=str)
+        }
+        for name, column in self.labels.items():
+            arrays[f'label_{name}'] = column
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Rebuild a dataset from the arrays written by to_arrays"""
+        # Files written before labels existed have no label_names
+        names = arrays['label_names'].tolist() if 'label_names' in arrays else []
+        labels = {name: arrays[f'label_{name}'] for name in names}
+        return cls(arrays['dates'].view('datetime64[ns]'), arrays['values'], arrays['present'].tolist(), labels)
@@ -0,0 +1,256 @@
+"""
+Server-side Dataset Store
+
+Uploaded datasets are persisted as compact .npz files (the float32 metric
+matrix and date index of a CarbonDataset) so the browser no longer has to
+POST the full processed DataFrame back to /api/predict, /api/optimize and
+/api/export. Endpoints receive a dataset_id instead.
+
+The files live in a directory shared by every worker on the host. The
+file access time is the last-access time: loads touch it, the least
+recently used datasets are evicted once the store is full, and datasets
+that have not been accessed within the TTL expire. A dataset can be
+replaced by a new version under the same id; the inode and modification
+time of its file tell every worker whether its in-memory copy is current.
+Versions are assigned under a file lock on the store directory, so
+concurrent re-uploads to one id from any worker get distinct versions.
+"""
+
+import os
+import json
+import time
+import uuid
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+import numpy as np
+
+from dataset import CarbonDataset
+
+DEFAULT_DATASET_DIR = os.path.join(tempfile.gettempdir(), 'carbonsync', 'datasets')
+
+
+class DatasetNotFoundError(KeyError):
+    """Raised when a dataset_id is unknown or has expired"""
+
+
+class DatasetStore:
+    """
+    Columnar on-disk dataset storage with LRU eviction and TTL.
+
+    Args:
+        root: Directory holding the dataset files
+        max_datasets: Number of datasets kept before LRU eviction
+        ttl_seconds: Datasets not accessed for this long expire
+        memory_items: Number of decoded datasets kept in memory per worker
+    """
+    def __init__(self, root, max_datasets=200, ttl_seconds=24 * 3600, memory_items=8):
+        self.root = root
+        self.max_datasets = max_datasets
+        self.ttl_seconds = ttl_seconds
+        self.memory_items = memory_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def _data_path(self, dataset_id):
+        return os.path.join(self.root, f"{dataset_id}.npz")
+
+    def _meta_path(self, dataset_id):
+        return os.path.join(self.root, f"{dataset_id}.json")
+
+    @staticmethod
+    def _valid_id(dataset_id):
+        return isinstance(dataset_id, str) and len(dataset_id) == 32 and all(c in '0123456789abcdef' for c in dataset_id)
+
+    @staticmethod
+    def _stamp(stat):
+        """Identity of a written file; access-time updates leave it unchanged"""
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def _remember(self, dataset_id, data, stamp):
+        with self._lock:
+            self._memory[dataset_id] = (data, stamp)
+            self._memory.move_to_end(dataset_id)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def _forget(self, dataset_id):
+        with self._lock:
+            self._memory.pop(dataset_id, None)
+
+    @contextmanager
+    def _locked(self):
+        """Hold the store's save lock, shared by the threads and processes of the host"""
+        with self._save_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.root, '.lock'), 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def save(self, data, metadata=None, dataset_id=None):
+        """
+        Persist a dataset and return its dataset_id
+
+        Args:
+            data: CarbonDataset, or a processed DataFrame with 'ds' and metric columns
+            metadata: Optional JSON-serializable metadata (summary, filename)
+            dataset_id: Existing dataset to replace with a new version
+
+        Returns:
+            dataset_id
+
+        Raises:
+            DatasetNotFoundError: if dataset_id is given but unknown or expired
+        """
+        if not isinstance(data, CarbonDataset):
+            data = CarbonDataset.from_frame(data)
+        replace = dataset_id is not None
+        if not replace:
+            dataset_id = uuid.uuid4().hex
+        data_path = self._data_path(dataset_id)
+        meta_path = self._meta_path(dataset_id)
+
+        # Write to a unique temporary file first so other workers never read a partial file
+        # and concurrent saves (threads or processes) never write to the same one
+        fd, data_tmp = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **data.to_arrays())
+
+        # The version is read and written back under the lock, so concurrent replacements never share one
+        try:
+            with self._locked():
+                version = self.version(dataset_id) + 1 if replace else 1
+                os.replace(data_tmp, data_path)
+                stamp = self._stamp(os.stat(data_path))
+
+                fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+                with os.fdopen(fd, 'w') as f:
+                    json.dump({
+                        "dataset_id": dataset_id,
+                        "version": version,
+                        "rows": int(len(data)),
+                        "created_at": time.time(),
+                        **(metadata or {})
+                    }, f)
+                os.replace(tmp_path, meta_path)
+        except DatasetNotFoundError:
+            os.remove(data_tmp)
+            raise
+
+        self._remember(dataset_id, data, stamp)
+        self._evict()
+        return dataset_id
+
+    def load(self, dataset_id):
+        """
+        Load a dataset by id
+
+        Returns:
+            CarbonDataset
+
+        Raises:
+            DatasetNotFoundError: if the id is unknown or expired
+        """
+        if not self._valid_id(dataset_id):
+            raise DatasetNotFoundError(dataset_id)
+
+        data_path = self._data_path(dataset_id)
+        try:
+            stat = os.stat(data_path)
+        except OSError:
+            self._forget(dataset_id)
+            raise DatasetNotFoundError(dataset_id)
+
+        if time.time() - stat.st_atime > self.ttl_seconds:
+            self.delete(dataset_id)
+            raise DatasetNotFoundError(dataset_id)
+
+        # Touch the access time so LRU eviction sees the access from any worker
+        try:
+            os.utime(data_path, ns=(time.time_ns(), stat.st_mtime_ns))
+        except OSError:
+            pass
+
+        # A copy in memory is current unless another worker saved a new version
+        stamp = self._stamp(stat)
+        with self._lock:
+            entry = self._memory.get(dataset_id)
+            if entry is not None and entry[1] == stamp:
+                self._memory.move_to_end(dataset_id)
+                return entry[0]
+
+        try:
+            with np.load(data_path, allow_pickle=False) as npz:
+                data = CarbonDataset.from_arrays(npz)
+        except (OSError, KeyError):
+            raise DatasetNotFoundError(dataset_id)
+
+        self._remember(dataset_id, data, stamp)
+        return data
+
+    def metadata(self, dataset_id):
+        """Return the metadata saved with a dataset"""
+        if not self._valid_id(dataset_id):
+            raise DatasetNotFoundError(dataset_id)
+        try:
+            with open(self._meta_path(dataset_id), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            raise DatasetNotFoundError(dataset_id)
+
+    def version(self, dataset_id):
+        """Version of a dataset: 1 when first saved, incremented by every replacement"""
+        return int(self.metadata(dataset_id).get('version', 1))
+
+    def delete(self, dataset_id):
+        """Remove a dataset from disk and memory"""
+        self._forget(dataset_id)
+        for path in (self._data_path(dataset_id), self._meta_path(dataset_id)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _evict(self):
+        """Drop expired datasets and the least recently used ones above capacity"""
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.root):
+            if not name.endswith('.npz'):
+                continue
+            dataset_id = name[:-4]
+            try:
+                last_access = os.path.getatime(os.path.join(self.root, name))
+            except OSError:
+                continue
+            if now - last_access > self.ttl_seconds:
+                self.delete(dataset_id)
+            else:
+                entries.append((last_access, dataset_id))
+
+        entries.sort()
+        for _, dataset_id in entries[:max(0, len(entries) - self.max_datasets)]:
+            self.delete(dataset_id)
+
+
+# Create a singleton instance
+dataset_store = DatasetStore(
+    os.environ.get('CARBONSYNC_DATASET_DIR', DEFAULT_DATASET_DIR),
+    max_datasets=int(os.environ.get('CARBONSYNC_DATASET_MAX', 200)),
+    ttl_seconds=int(os.environ.get('CARBONSYNC_DATASET_TTL', 24 * 3600)),
+    memory_items=int(os.environ.get('CARBONSYNC_DATASET_MEMORY_ITEMS', 8))
+)
@@ -0,0 +1,210 @@
+"""
+Holt-Winters Exponential Smoothing
+
+Additive damped Holt-Winters (ETS(A,Ad,A) in the innovations form of
+Hyndman et al., 2008) in pure numpy, for series too short to justify a
+Stan fit:
+
+    yhat_t = l_{t-1} + phi b_{t-1} + s_{t-m}
+    e_t    = y_t - yhat_t
+    l_t    = l_{t-1} + phi b_{t-1} + alpha e_t
+    b_t    = phi b_{t-1} + beta e_t
+    s_t    = s_{t-m} + gamma e_t
+
+The parameters are picked from a grid by one-step squared error. The
+recursion runs over every grid point at once, so a fit is a single pass
+over the series. Prediction intervals are analytical:
+
+    Var(y_{n+h}) = sigma^2 (1 + sum_{j=1}^{h-1} c_j^2)
+    c_j = alpha + beta (phi + ... + phi^j) + gamma [j mod m = 0]
+
+Regressors enter through closed-form OLS (see fit_series).
+"""
+
+import numpy as np
+
+import resample
+from regression import SufficientStatsRegressor
+
+# Parameter grid; beta and gamma are fractions of alpha and 1 - alpha so
+# that every grid point is admissible
+ALPHAS = (0.05, 0.1, 0.2, 0.35, 0.5, 0.7, 0.9)
+TREND_FRACTIONS = (0.0, 0.05, 0.15, 0.3)
+SEASONAL_FRACTIONS = (0.0, 0.1, 0.25, 0.5)
+DAMPING = (0.9, 0.98, 1.0)
+
+# Season length of each frequency (see resample.infer_frequency)
+SEASONAL_PERIODS = {'Q': 4, 'M': 12, 'W': 52, 'D': 7, 'H': 24}
+
+# Observations needed per regression coefficient before regressors are used
+ROWS_PER_REGRESSOR = 5
+
+
+def seasonal_period(dates):
+    """Season length implied by the frequency of sorted dates (0 if unknown)"""
+    return SEASONAL_PERIODS.get(resample.infer_frequency(dates), 0)
+
+
+def _grid(seasonal):
+    fractions = SEASONAL_FRACTIONS if seasonal else (0.0,)
+    alpha, trend, season, phi = (axis.ravel() for axis in np.meshgrid(
+        ALPHAS, TREND_FRACTIONS, fractions, DAMPING, indexing='ij'))
+    return alpha, trend * alpha, season * (1 - alpha), phi
+
+
+def _initial_states(y, period):
+    """Level (before the first row), trend and seasonal terms from the first seasons"""
+    t = np.arange(len(y), dtype=np.float64)
+    observed = ~np.isnan(y)
+    window = observed & (t < max(2 * period, 10))
+    if window.sum() < 2:
+        window = observed
+    slope, intercept = np.polyfit(t[window], y[window], 1)
+
+    season = np.zeros(period)
+    if period:
+        detrended = y[:2 * period] - (intercept + slope * t[:2 * period])
+        for position in range(period):
+            values = detrended[position::period]
+            values = values[~np.isnan(values)]
+            season[position] = values.mean() if len(values) else 0.0
+        season -= season.mean()
+    return intercept - slope, slope, season
+
+
+class HoltWinters:
+    """
+    Fitted additive Holt-Winters model
+
+    Attributes:
+        alpha, beta, gamma, phi: Smoothing and damping parameters
+        period: Season length (0 without a seasonal component)
+        level, trend: Final states
+        season: Seasonal terms of the next `period` steps
+        sigma2: Mean squared one-step error
+    """
+    def __init__(self, alpha, beta, gamma, phi, period, level, trend, season, sigma2):
+        self.alpha = float(alpha)
+        self.beta = float(beta)
+        self.gamma = float(gamma)
+        self.phi = float(phi)
+        self.period = int(period)
+        self.level = float(level)
+        self.trend = float(trend)
+        self.season = np.asarray(season, dtype=np.float64)
+        self.sigma2 = float(sigma2)
+
+    @classmethod
+    def fit(cls, y, period=0):
+        """
+        Fit the parameter grid in one pass and keep the best model
+
+        Args:
+            y: Series values; NaN values are skipped (the states carry over)
+            period: Season length; the seasonal component needs two full seasons
+
+        Raises:
+            ValueError: with fewer than 3 observed values
+        """
+        y = np.asarray(y, dtype=np.float64)
+        observed = ~np.isnan(y)
+        n_observed = int(observed.sum())
+        if n_observed < 3:
+            raise ValueError("Need at least 3 data points for exponential smoothing")
+        period = period if period >= 2 and n_observed >= 2 * period else 0
+
+        alpha, beta, gamma, phi = _grid(period > 0)
+        level0, trend0, season0 = _initial_states(y, period)
+        level = np.full(alpha.size, level0)
+        trend = np.full(alpha.size, trend0)
+        season = np.tile(season0, (alpha.size, 1))
+        sse = np.zeros(alpha.size)
+
+        with np.errstate(over='ignore', invalid='ignore'):
+            for t in range(len(y)):
+                seasonal = season[:, t % period] if period else 0.0
+                damped = phi * trend
+                error = y[t] - (level + damped + seasonal) if observed[t] else 0.0
+                sse += error * error
+                level = level + damped + alpha * error
+                trend = damped + beta * error
+                if period:
+                    season[:, t % period] = seasonal + gamma * error
+
+        sse[~np.isfinite(sse)] = np.inf
+        best = int(np.argmin(sse))
+        next_season = np.roll(season[best], -(len(y) % period)) if period else np.zeros(0)
+        return cls(alpha[best], beta[best], gamma[best], phi[best], period,
+                   level[best], trend[best], next_season, sse[best] / n_observed)
+
+    def forecast(self, steps):
+        """
+        Point forecasts and their variances for the next `steps` values
+
+        Returns:
+            (mean, variance) arrays of length `steps`
+        """
+        h = np.arange(1, steps + 1)
+        damped = np.cumsum(self.phi ** h)
+        mean = self.level + damped * self.trend
+        if self.period:
+            mean = mean + self.season[(h - 1) % self.period]
+
+        c = self.alpha + self.beta * damped[:-1]
+        if self.period:
+            c = c + self.gamma * (h[:-1] % self.period == 0)
+        variance = self.sigma2 * (1 + np.concatenate([[0.0], np.cumsum(c ** 2)]))[:steps]
+        return mean, variance
+
+
+class RegressionHoltWinters:
+    """
+    Holt-Winters on the regressor-adjusted series plus the regressor effect,
+    itself projected with Holt-Winters
+
+    Attributes:
+        series: HoltWinters of y minus the regressor effect
+        effect: HoltWinters of the effect (x_t - mean x) beta, or None
+    """
+    def __init__(self, series, effect=None):
+        self.series = series
+        self.effect = effect
+
+    def forecast(self, steps):
+        """(mean, variance) of the next `steps` values; the two parts are treated as independent"""
+        mean, variance = self.series.forecast(steps)
+        if self.effect is not None:
+            effect_mean, effect_variance = self.effect.forecast(steps)
+            mean, variance = mean + effect_mean, variance + effect_variance
+        return mean, variance
+
+
+def fit_series(y, regressors=None, period=0):
+    """
+    Fit Holt-Winters to a series with regressors
+
+    The regressor effect (x_t - mean x) beta is solved by closed-form OLS
+    and smoothed separately from the rest of the series. Future regressor
+    values are unknown, and holding them at their means biases drifting
+    regressors, so the effect is projected with its own trend and season.
+    Constant regressors are ignored, and all of them are skipped without
+    ROWS_PER_REGRESSOR observations per coefficient.
+
+    Args:
+        y: Series values (NaN where missing)
+        regressors: (rows x features) matrix with missing values filled, or None
+        period: Season length (see seasonal_period)
+
+    Returns:
+        RegressionHoltWinters
+    """
+    y = np.asarray(y, dtype=np.float64)
+    observed = ~np.isnan(y)
+    if regressors is not None and regressors.shape[1] and observed.any():
+        X = np.asarray(regressors, dtype=np.float64)
+        X = X[:, X[observed].std(axis=0) > 0]
+        if X.shape[1] and observed.sum() >= ROWS_PER_REGRESSOR * (X.shape[1] + 1):
+            fit = SufficientStatsRegressor(range(X.shape[1])).partial_fit(X[observed], y[observed]).solve()
+            effect = (X - X[observed].mean(axis=0)) @ fit.coef_
+            return RegressionHoltWinters(HoltWinters.fit(y - effect, period), HoltWinters.fit(effect, period))
+    return RegressionHoltWinters(HoltWinters.fit(y, period))
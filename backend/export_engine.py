@@ -0,0 +1,235 @@
+"""
+Streaming Export Engine
+
+Writes tabular results to XLSX or CSV without holding the whole file in
+memory. XLSX workbooks are produced with xlsxwriter's constant_memory mode
+into a temporary file that is streamed back in chunks and removed
+afterwards; CSV rows are encoded in small batches straight into the
+response. Either format can be gzip-compressed on the fly.
+"""
+
+import os
+import io
+import csv
+import zlib
+import tempfile
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+CSV_MIMETYPE = 'text/csv'
+GZIP_MIMETYPE = 'application/gzip'
+
+# Rows encoded per CSV chunk (row-wise and DataFrame-backed sheets) and
+# bytes per streamed file chunk
+CSV_CHUNK_ROWS = 2000
+FRAME_CSV_CHUNK_ROWS = 50000
+FILE_CHUNK_BYTES = 64 * 1024
+
+HEADER_FORMAT = {
+    'bold': True,
+    'text_wrap': True,
+    'valign': 'top',
+    'fg_color': '#D7E4BC',
+    'border': 1
+}
+
+
+class Sheet:
+    """
+    One table of an export.
+
+    Args:
+        name: Worksheet name (XLSX) or file stem (CSV)
+        columns: Column headers
+        rows: Iterable of row sequences ordered like columns
+        widths: Optional {column range: width} applied to the worksheet
+        frame: Source DataFrame, enabling the vectorized CSV path
+    """
+    def __init__(self, name, columns, rows, widths=None, frame=None):
+        self.name = name
+        self.columns = list(columns)
+        self.rows = rows
+        self.widths = widths or {}
+        self.frame = frame
+
+
+def records_to_sheet(name, records, widths=None):
+    """
+    Build a Sheet from a list of dicts
+
+    Columns follow the order in which keys first appear, like pd.DataFrame.
+    Rows are produced lazily so large result sets are never copied.
+    """
+    columns = []
+    seen = set()
+    for record in records:
+        for key in record:
+            if key not in seen:
+                seen.add(key)
+                columns.append(key)
+
+    rows = ([record.get(col) for col in columns] for record in records)
+    return Sheet(name, columns, rows, widths)
+
+
+def frame_to_sheet(name, df, widths=None):
+    """Build a Sheet that iterates a DataFrame's rows without copying it"""
+    return Sheet(name, [str(col) for col in df.columns], df.itertuples(index=False, name=None), widths, frame=df)
+
+
+def _plain_value(value):
+    """Convert numpy/pandas scalars to plain Python values"""
+    if value is None or value is pd.NaT:
+        return None
+    if isinstance(value, pd.Timestamp):
+        if value.tzinfo is not None:
+            value = value.tz_convert(None)
+        return value.to_pydatetime()
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+
+def _csv_value(value):
+    """Format a cell for CSV; midnight datetimes are written as plain dates"""
+    value = _plain_value(value)
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.date().isoformat() if value.time() == datetime.min.time() else value.isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def write_xlsx(path, sheets):
+    """
+    Write sheets to an XLSX file using constant_memory mode
+
+    Only the current row is kept in memory; rows are flushed to disk as
+    soon as the next one is written.
+    """
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    try:
+        header_format = workbook.add_format(HEADER_FORMAT)
+        date_format = workbook.add_format({'num_format': 'yyyy-mm-dd'})
+
+        for sheet in sheets:
+            worksheet = workbook.add_worksheet(sheet.name[:31])
+            for col_range, width in sheet.widths.items():
+                worksheet.set_column(col_range, width)
+
+            for col_num, value in enumerate(sheet.columns):
+                worksheet.write(0, col_num, value, header_format)
+
+            for row_num, row in enumerate(sheet.rows, start=1):
+                for col_num, value in enumerate(row):
+                    value = _plain_value(value)
+                    if value is None:
+                        continue
+                    if isinstance(value, (datetime, date)):
+                        worksheet.write_datetime(row_num, col_num, value, date_format)
+                    else:
+                        worksheet.write(row_num, col_num, value)
+    finally:
+        workbook.close()
+
+
+def iter_frame_csv(df, chunk_rows=FRAME_CSV_CHUNK_ROWS):
+    """Yield a DataFrame as UTF-8 CSV, encoding each chunk with to_csv"""
+    for start in range(0, max(len(df), 1), chunk_rows):
+        chunk = df.iloc[start:start + chunk_rows]
+        yield chunk.to_csv(index=False, header=(start == 0)).encode('utf-8')
+
+
+def iter_csv(sheet, chunk_rows=CSV_CHUNK_ROWS):
+    """Yield a sheet as UTF-8 CSV in chunks of chunk_rows rows"""
+    if sheet.frame is not None:
+        yield from iter_frame_csv(sheet.frame)
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(sheet.columns)
+
+    pending = 0
+    for row in sheet.rows:
+        writer.writerow([_csv_value(value) for value in row])
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def iter_xlsx(sheets, chunk_size=FILE_CHUNK_BYTES):
+    """Write the workbook to a temporary file and yield it in chunks"""
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        write_xlsx(path, sheets)
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def gzip_chunks(chunks, level=6):
+    """Gzip-compress a stream of byte chunks on the fly"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def stream_export(sheets, fmt='xlsx', compress=False, filename='carbon_forecast'):
+    """
+    Prepare a streamed export
+
+    CSV exports contain the first sheet only.
+
+    Args:
+        sheets: List of Sheet objects
+        fmt: 'xlsx' or 'csv'
+        compress: Gzip the output
+        filename: Download file name without extension
+
+    Returns:
+        (chunk generator, mimetype, download file name)
+    """
+    if fmt == 'csv':
+        chunks = iter_csv(sheets[0])
+        mimetype = CSV_MIMETYPE
+        download_name = f"{filename}.csv"
+    elif fmt == 'xlsx':
+        chunks = iter_xlsx(sheets)
+        mimetype = XLSX_MIMETYPE
+        download_name = f"{filename}.xlsx"
+    else:
+        raise ValueError(f"Unsupported export format: {fmt}")
+
+    if compress:
+        chunks = gzip_chunks(chunks)
+        mimetype = GZIP_MIMETYPE
+        download_name = f"{download_name}.gz"
+
+    return chunks, mimetype, download_name
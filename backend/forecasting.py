@@ -0,0 +1,227 @@
+"""
+Series Forecasting
+
+Forecast engines shared by /api/predict and hierarchical forecasting:
+    prophet: Prophet with the regressors, when it is installed
+    ets:     Holt-Winters exponential smoothing in numpy (ets.py), fast
+             enough for short series that do not justify a Stan fit
+    linear:  a linear trend on the time index, solved from the analysis
+             context's sufficient statistics; the fallback when another
+             engine is missing or fails
+
+engine='auto' races the engines on a holdout of the series and keeps the
+winner per dataset (model_selection.py); series too short to race use ETS
+up to CARBONSYNC_ETS_MAX_ROWS rows (or when Prophet is missing) and Prophet
+for longer ones. Fitted Prophet models are kept in the shared cache by
+dataset fingerprint, so any worker can reuse them.
+"""
+
+import os
+import logging
+
+import numpy as np
+import pandas as pd
+
+import analysis
+import ets
+import resample
+from dataset import widen
+from metrics import stage
+from shared_cache import shared_cache
+
+logger = logging.getLogger("forecasting")
+
+# Try to import Prophet, but provide fallback if not available
+try:
+    from prophet import Prophet
+    PROPHET_AVAILABLE = True
+except ImportError:
+    logger.warning("Prophet not available. Using fallback forecasting method.")
+    PROPHET_AVAILABLE = False
+
+# z value of the 95% prediction intervals
+INTERVAL_Z = 1.96
+
+ENGINES = ('auto', 'prophet', 'ets', 'linear')
+
+# Longest series forecast with ETS when engine='auto' cannot race the engines
+ETS_MAX_ROWS = int(os.environ.get('CARBONSYNC_ETS_MAX_ROWS', 60))
+
+
+def build_prophet_model(regressors):
+    """Unfitted Prophet model with the service's seasonality settings and regressors"""
+    model = Prophet(
+        yearly_seasonality=True,
+        weekly_seasonality=False,
+        daily_seasonality=False,
+        seasonality_mode='multiplicative'
+    )
+    for regressor in regressors:
+        model.add_regressor(regressor)
+    return model
+
+
+def prophet_warm_start(model):
+    """
+    Parameters of a fitted Prophet model, to initialise a fit on a longer history
+
+    Pass the result as model.fit(df, init=...); the new model needs the
+    same regressors and number of changepoints.
+    """
+    params = model.params
+    return {
+        'k': float(params['k'][0][0]),
+        'm': float(params['m'][0][0]),
+        'sigma_obs': float(params['sigma_obs'][0][0]),
+        'delta': params['delta'][0],
+        'beta': params['beta'][0]
+    }
+
+
+def prophet_forecast(ctx, periods):
+    """
+    Fit (or reuse) a Prophet model with the regressors and forecast
+
+    Returns:
+        DataFrame with ds, yhat, yhat_lower, yhat_upper for the history and
+        the next `periods` steps
+    """
+    # Prophet works on a DataFrame built from the matrix
+    df = ctx.frame
+    numeric_columns = analysis.REGRESSOR_COLUMNS
+
+    # Reuse a model fitted on this dataset by any worker
+    model_key = f"model:prophet:{ctx.fingerprint}"
+    model = shared_cache.get(model_key)
+    if model is None:
+        # Add regressors if available
+        model = build_prophet_model([regressor for regressor in numeric_columns
+                                     if regressor in df.columns and regressor != 'y'])
+
+        with stage('fit'):
+            model.fit(df)
+        shared_cache.set(model_key, model)
+
+    # Create future dataframe
+    future = model.make_future_dataframe(periods=periods, freq=resample.prophet_frequency(ctx.data.dates))
+
+    # Add regressor values for historical data
+    for regressor in numeric_columns:
+        if regressor in df.columns:
+            future[regressor] = future['ds'].map(df.set_index('ds')[regressor])
+
+    # Fill NaN values in future regressors with the mean of historical data
+    for regressor in numeric_columns:
+        if regressor in future.columns:
+            future[regressor] = future[regressor].fillna(ctx.means[regressor])
+
+    with stage('predict'):
+        return model.predict(future)
+
+
+def future_frame(data, periods):
+    """ds (at the frequency of the data) and time_idx of the next `periods` rows"""
+    return pd.DataFrame({
+        'ds': pd.Series(resample.future_dates(data, periods)),
+        'time_idx': range(len(data), len(data) + periods)
+    })
+
+
+def linear_forecast(ctx, periods):
+    """
+    Forecast a linear trend on the time index
+
+    Returns:
+        DataFrame with ds, time_idx, yhat, yhat_lower, yhat_upper for the
+        next `periods` steps
+    """
+    # Solve the linear trend on the time index from the shared statistics
+    with stage('fit'):
+        lr_model = ctx.fit(['time_idx'])
+
+    # Create future dataframe with time index continuing from training data
+    forecast = future_frame(ctx.data, periods)
+
+    with stage('predict'):
+        forecast['yhat'] = lr_model.predict(forecast[['time_idx']])
+
+    # Add prediction intervals (simple approach)
+    std_dev = lr_model.residual_std
+    forecast['yhat_lower'] = forecast['yhat'] - INTERVAL_Z * std_dev
+    forecast['yhat_upper'] = forecast['yhat'] + INTERVAL_Z * std_dev
+    return forecast
+
+
+def ets_forecast(ctx, periods):
+    """
+    Forecast with Holt-Winters and the regressors (see ets.fit_series)
+
+    The season length follows the spacing of the dates.
+
+    Returns:
+        DataFrame with ds, time_idx, yhat, yhat_lower, yhat_upper for the
+        next `periods` steps
+    """
+    data = ctx.data
+    with stage('fit'):
+        model = ets.fit_series(widen(data.column('y')), data.filled(ctx.present_columns),
+                               ets.seasonal_period(data.dates))
+
+    forecast = future_frame(data, periods)
+    with stage('predict'):
+        mean, variance = model.forecast(periods)
+    width = INTERVAL_Z * np.sqrt(variance)
+    forecast['yhat'] = mean
+    forecast['yhat_lower'] = mean - width
+    forecast['yhat_upper'] = mean + width
+    return forecast
+
+
+def default_engine(ctx):
+    """Engine for a series too short to race: ETS for short series or without Prophet"""
+    if PROPHET_AVAILABLE and len(ctx.data) > ETS_MAX_ROWS:
+        return 'prophet'
+    return 'ets'
+
+
+def select_engine(ctx):
+    """Engine used for engine='auto', raced once per dataset"""
+    # model_selection backtests the engines defined in this module
+    import model_selection
+    return model_selection.choose_engine(ctx)
+
+
+def forecast(ctx, periods, engine='auto'):
+    """
+    Forecast a dataset with the requested engine, falling back to the linear trend
+
+    Args:
+        ctx: AnalysisContext of the series
+        periods: Number of future steps (at the frequency of the data)
+        engine: One of ENGINES
+
+    Returns:
+        (forecast DataFrame, engine name: 'prophet', 'ets' or 'linear')
+
+    Raises:
+        ValueError: for an unknown engine
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown forecast engine: {engine}")
+    if engine == 'auto':
+        engine = select_engine(ctx)
+
+    if engine == 'prophet':
+        if PROPHET_AVAILABLE:
+            try:
+                return prophet_forecast(ctx, periods), 'prophet'
+            except Exception as prophet_error:
+                logger.warning("Prophet error: %s. Using fallback method.", prophet_error)
+        else:
+            logger.info("Prophet not available. Using fallback forecasting method.", extra={"sample": 100})
+    elif engine == 'ets':
+        try:
+            return ets_forecast(ctx, periods), 'ets'
+        except Exception as ets_error:
+            logger.warning("ETS error: %s. Using fallback method.", ets_error)
+    return linear_forecast(ctx, periods), 'linear'
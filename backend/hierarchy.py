@@ -0,0 +1,319 @@
+"""
+Hierarchical Forecasting
+
+Forecasts every node of a nested grouping hierarchy (e.g. country >
+plant > line) so that the totals add up. The hierarchy is encoded as a
+sparse summing matrix S (nodes x bottom series): every aggregate series
+is S times the bottom series, and base forecasts are reconciled with
+
+    y_tilde = S G y_hat,    G = (S' W^-1 S)^-1 S' W^-1
+
+Methods:
+    bottom_up: only the bottom series are fitted and summed (default)
+    ols:       W = I
+    wls:       structural scaling, W = diag(S 1)
+    mint:      W = diag of the base forecast variances (MinT with a
+               diagonal covariance)
+
+The projection methods fit every node as well, so they cost more than
+bottom_up, but they still produce coherent totals. Node series are
+fitted in a process pool, as the ETS grid search is a Python loop that
+holds the GIL. Reconciliation factorises the sparse
+S' W^-1 S once and never forms G as a whole.
+"""
+
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.linalg import splu
+
+import analysis
+import forecasting
+from metrics import stage
+from dataset import CarbonDataset, METRIC_COLUMNS, METRIC_INDEX, MEAN_COLUMNS, widen
+
+logger = logging.getLogger("hierarchy")
+
+RECONCILIATION_METHODS = ('bottom_up', 'ols', 'wls', 'mint')
+
+# Processes fitting node series
+FORECAST_WORKERS = int(os.environ.get('CARBONSYNC_FORECAST_WORKERS', min(8, os.cpu_count() or 1)))
+
+# Fewest observed values of y a fitted series needs
+MIN_POINTS = 3
+
+# Nodes whose base errors are propagated at once when reconciling
+RECONCILE_BLOCK = 256
+
+
+class HierarchyError(ValueError):
+    """Raised for an invalid hierarchy or series that cannot be forecast"""
+
+
+class Hierarchy:
+    """
+    Nested grouping hierarchy over the bottom series of a dataset.
+
+    Attributes:
+        levels: Grouping columns from the top level down
+        nodes: (level, key) of every node; the total is ('total', ())
+        S: Summing matrix (nodes x bottom series) as scipy.sparse.csr_matrix;
+           the bottom series are its last rows, in order
+        row_series: Bottom series index of every dataset row
+    """
+    def __init__(self, levels, bottom_keys, row_series):
+        self.levels = list(levels)
+        self.row_series = row_series
+        n_bottom = len(bottom_keys)
+        keys = pd.DataFrame(bottom_keys, columns=self.levels)
+
+        self.nodes = [('total', ())]
+        node_rows = [np.zeros(n_bottom, dtype=np.int64)]
+        for depth in range(1, len(self.levels) + 1):
+            prefix = keys.iloc[:, :depth]
+            codes = prefix.groupby(self.levels[:depth], sort=True).ngroup().to_numpy()
+            level_keys = prefix.drop_duplicates().sort_values(self.levels[:depth])
+            node_rows.append(codes + len(self.nodes))
+            self.nodes.extend((self.levels[depth - 1], key) for key in level_keys.itertuples(index=False, name=None))
+
+        rows = np.concatenate(node_rows)
+        cols = np.tile(np.arange(n_bottom), len(node_rows))
+        self.S = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(self.nodes), n_bottom))
+
+    @classmethod
+    def from_dataset(cls, data, levels):
+        """
+        Build the hierarchy from the grouping labels of a dataset
+
+        Raises:
+            HierarchyError: if the levels are empty, repeated or not labels of the dataset
+        """
+        levels = list(levels or [])
+        if not levels:
+            raise HierarchyError("A hierarchy of grouping columns is required")
+        if len(set(levels)) != len(levels):
+            raise HierarchyError("Hierarchy levels must be distinct")
+        for level in levels:
+            if level not in data.labels:
+                raise HierarchyError(f"Missing grouping column: {level}")
+
+        frame = pd.DataFrame({level: data.labels[level] for level in levels})
+        row_series = frame.groupby(levels, sort=True).ngroup().to_numpy()
+        bottom_keys = list(frame.drop_duplicates().sort_values(levels).itertuples(index=False, name=None))
+        return cls(levels, bottom_keys, row_series)
+
+    @property
+    def n_bottom(self):
+        return self.S.shape[1]
+
+    def node_id(self, node):
+        level, key = self.nodes[node]
+        return 'total' if level == 'total' else '/'.join(key)
+
+    def node_datasets(self, data, nodes):
+        """
+        Series of the given nodes, aggregated from the bottom series
+
+        Metrics are summed (MEAN_COLUMNS are averaged) over the bottom
+        series observed on each date; a date is kept for a node when any
+        of its series has a value.
+
+        Raises:
+            HierarchyError: if a bottom series has duplicate dates
+        """
+        dates, date_index = np.unique(data.dates, return_inverse=True)
+        n_dates, n_metrics = len(dates), len(METRIC_COLUMNS)
+        cells = self.row_series * n_dates + date_index
+        if len(np.unique(cells)) != len(cells):
+            raise HierarchyError("Duplicate dates found. Each date must be unique within a series.")
+
+        values = np.full((self.n_bottom * n_dates, n_metrics), np.nan)
+        values[cells] = widen(data.values)
+        values = values.reshape(self.n_bottom, n_dates * n_metrics)
+        observed = ~np.isnan(values)
+
+        S = self.S[nodes]
+        counts = S @ observed.astype(np.float64)
+        totals = S @ np.where(observed, values, 0.0)
+
+        mean_columns = np.zeros(n_metrics, dtype=bool)
+        mean_columns[[METRIC_INDEX[col] for col in MEAN_COLUMNS]] = True
+        mean_columns = np.tile(mean_columns, n_dates)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            totals[:, mean_columns] /= counts[:, mean_columns]
+        totals[counts == 0] = np.nan
+        totals = totals.reshape(len(nodes), n_dates, n_metrics)
+
+        series = []
+        for node_values in totals:
+            rows = ~np.all(np.isnan(node_values), axis=1)
+            series.append(CarbonDataset(dates[rows], node_values[rows], data.present))
+        return series
+
+
+def reconcile(S, base, sigma, method='bottom_up'):
+    """
+    Reconcile base forecasts so that every aggregate is the sum of its series
+
+    Args:
+        S: Summing matrix (n nodes x m bottom series)
+        base: Base forecasts, (m x h) bottom series for bottom_up, else (n x h)
+        sigma: Standard deviations of the base forecasts, same shape as base
+        method: One of RECONCILIATION_METHODS
+
+    Returns:
+        (forecasts, standard deviations), both (n x h); base errors are
+        treated as independent
+    """
+    if method == 'bottom_up':
+        # S is binary, so S o S = S
+        return S @ base, np.sqrt(S @ sigma ** 2)
+
+    n_nodes = S.shape[0]
+    if method == 'ols':
+        weights = np.ones(n_nodes)
+    elif method == 'wls':
+        weights = np.asarray(S.sum(axis=1), dtype=np.float64).ravel()
+    elif method == 'mint':
+        weights = sigma[:, 0] ** 2
+        weights = np.maximum(weights, 1e-12 * max(weights.max(), 1.0))
+    else:
+        raise HierarchyError(f"Unknown reconciliation method: {method}")
+
+    StW = (S.T @ sparse.diags(1.0 / weights)).tocsc()
+    lu = splu((StW @ S).tocsc())
+    forecasts = S @ lu.solve(StW @ base)
+
+    # G is dense (the inverse of S' W^-1 S is), so the variances are summed
+    # over blocks of its columns rather than from the whole of S G
+    variance = np.zeros((n_nodes, sigma.shape[1]))
+    for start in range(0, n_nodes, RECONCILE_BLOCK):
+        block = slice(start, start + RECONCILE_BLOCK)
+        SG = S @ lu.solve(StW[:, block].toarray())
+        variance += (SG ** 2) @ sigma[block] ** 2
+    return forecasts, np.sqrt(variance)
+
+
+def _fit_series(data, periods, engine='auto'):
+    """Base forecast of one node: (future dates, yhat, sigma, engine)"""
+    ctx = analysis.AnalysisContext(data.fingerprint(), data)
+    forecast, engine = forecasting.forecast(ctx, periods, engine)
+    tail = forecast.tail(periods)
+    yhat = tail['yhat'].to_numpy(dtype=np.float64)
+    sigma = (tail['yhat_upper'] - tail['yhat_lower']).to_numpy(dtype=np.float64) / (2 * forecasting.INTERVAL_Z)
+    return pd.DatetimeIndex(tail['ds']), yhat, sigma, engine
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    """Process pool shared by all hierarchical forecasts (forkserver, so request threads are not forked)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _pool = ProcessPoolExecutor(max_workers=FORECAST_WORKERS,
+                                        mp_context=multiprocessing.get_context(method))
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _fit_all(series, periods, engine, workers):
+    """Base forecasts of every series, in the process pool unless there is one series or worker"""
+    if workers <= 1 or len(series) <= 1:
+        return [_fit_series(s, periods, engine) for s in series]
+    try:
+        pool = _get_pool()
+        futures = [pool.submit(_fit_series, s, periods, engine) for s in series]
+        return [future.result() for future in futures]
+    except BrokenProcessPool:
+        logger.warning("Hierarchy process pool is broken; fitting the series inline")
+        _reset_pool()
+        return [_fit_series(s, periods, engine) for s in series]
+
+
+def forecast_hierarchy(data, levels, periods=12, method='bottom_up', engine='auto', workers=None):
+    """
+    Forecast every node of a hierarchy with coherent totals
+
+    Args:
+        data: CarbonDataset with the grouping labels of every level
+        levels: Grouping columns from the top level down, e.g. ['country', 'plant', 'line']
+        periods: Number of future steps (at the frequency of the data)
+        method: Reconciliation method (RECONCILIATION_METHODS)
+        engine: Forecast engine of every node (forecasting.ENGINES)
+        workers: Processes fitting node series (default CARBONSYNC_FORECAST_WORKERS, 1 fits inline)
+
+    Returns:
+        dict with the levels, method, engine and one forecast per node
+
+    Raises:
+        HierarchyError: for an invalid hierarchy, method or too short series
+    """
+    if method not in RECONCILIATION_METHODS:
+        raise HierarchyError(f"Unknown reconciliation method: {method}")
+    hierarchy = Hierarchy.from_dataset(data, levels)
+    n_nodes = len(hierarchy.nodes)
+
+    # bottom_up needs no aggregate fits
+    fit_nodes = np.arange(n_nodes - hierarchy.n_bottom, n_nodes) if method == 'bottom_up' else np.arange(n_nodes)
+    with stage('aggregate'):
+        series = hierarchy.node_datasets(data, fit_nodes)
+
+    short = [hierarchy.node_id(node) for node, s in zip(fit_nodes, series)
+             if np.count_nonzero(~np.isnan(s.column('y'))) < MIN_POINTS]
+    if short:
+        raise HierarchyError(f"Need at least {MIN_POINTS} data points for every series: {', '.join(short[:5])}")
+
+    with stage('fit'):
+        fits = _fit_all(series, periods, engine, workers or FORECAST_WORKERS)
+
+    base = np.vstack([fit[1] for fit in fits])
+    sigma = np.vstack([fit[2] for fit in fits])
+    with stage('reconcile'):
+        reconciled, reconciled_sigma = reconcile(hierarchy.S, base, sigma, method)
+
+    # Forecasts are aligned by horizon and dated from the series ending last
+    latest = max(range(len(series)), key=lambda i: series[i].last_date)
+    future_dates = [date.strftime('%Y-%m-%d') for date in fits[latest][0]]
+    engines = {fit[3] for fit in fits}
+
+    nodes = []
+    for node, (level, key) in enumerate(hierarchy.nodes):
+        yhat = reconciled[node]
+        interval = forecasting.INTERVAL_Z * reconciled_sigma[node]
+        nodes.append({
+            "id": hierarchy.node_id(node),
+            "level": level,
+            "key": dict(zip(hierarchy.levels, key)),
+            "forecast": [{
+                "ds": date,
+                "predicted_emissions": float(value),
+                "lower_bound": float(value - width),
+                "upper_bound": float(value + width)
+            } for date, value, width in zip(future_dates, yhat, interval)]
+        })
+
+    return {
+        "levels": hierarchy.levels,
+        "method": method,
+        "engine": engines.pop() if len(engines) == 1 else 'mixed',
+        "series_fitted": len(series),
+        "nodes": nodes
+    }
@@ -0,0 +1,276 @@
+"""
+HTTP Response Caching
+
+Idempotent endpoints are answered from a cache keyed by a hash of the
+request (method, path, sorted query arguments and raw body), so the
+byte-identical requests that polling dashboards send are not recomputed.
+A view can add server-side state the response depends on to the key
+(e.g. the version of a stored dataset the request references), so a new
+version misses without evicting anything else.
+Entries live in a bounded in-process LRU in front of the shared cache
+(shared_cache.py), so a response computed by one gunicorn worker serves
+the others.
+
+Cached and conditional GET responses carry a content ETag and are
+answered with 304 Not Modified when the client sends a matching
+If-None-Match. A request with Cache-Control: no-cache skips the lookup
+and refreshes the stored response.
+
+A hit does not run the view, so views with side effects (e.g. results
+recorded for a later export) pass a replay function that restores them
+from the cached body.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from functools import wraps
+from collections import OrderedDict
+
+from flask import Response, request, current_app
+
+import metrics
+from shared_cache import shared_cache
+
+# Number of responses kept in memory per worker (0 disables the cache)
+HTTP_CACHE_SIZE = int(os.environ.get('CARBONSYNC_HTTP_CACHE_SIZE', 256))
+
+# Upper bound on the total size of the in-memory responses
+HTTP_CACHE_MAX_BYTES = int(os.environ.get('CARBONSYNC_HTTP_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+# Seconds a cached response is served
+HTTP_CACHE_TTL = int(os.environ.get('CARBONSYNC_HTTP_CACHE_TTL', 300))
+
+# Response headers stored with a cached entry
+STORED_HEADERS = ('Content-Type', 'Content-Disposition')
+
+CACHE_LOOKUPS = metrics.registry.counter(
+    'carbonsync_http_cache_requests_total',
+    'Response cache lookups by result (hit, miss)',
+    ['endpoint', 'result']
+)
+
+
+class CachedResponse:
+    """Body and headers of a stored 200 response"""
+    __slots__ = ('status', 'headers', 'body', 'etag', 'stored_at')
+
+    def __init__(self, status, headers, body, etag, stored_at=None):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.etag = etag
+        self.stored_at = time.time() if stored_at is None else stored_at
+
+    @classmethod
+    def from_response(cls, response):
+        body = response.get_data()
+        headers = [(name, response.headers[name]) for name in STORED_HEADERS if name in response.headers]
+        return cls(response.status_code, headers, body, hashlib.sha256(body).hexdigest()[:32])
+
+    def to_response(self):
+        response = Response(self.body, status=self.status, headers=self.headers)
+        response.set_etag(self.etag)
+        return response
+
+    def to_tuple(self):
+        return (self.status, self.headers, self.body, self.etag, self.stored_at)
+
+    @classmethod
+    def from_tuple(cls, values):
+        status, headers, body, etag, stored_at = values
+        return cls(status, [tuple(header) for header in headers], body, etag, stored_at)
+
+    def expired(self, ttl):
+        return time.time() - self.stored_at > ttl
+
+
+class MemoryResponseCache:
+    """
+    In-process LRU of responses, bounded by entry count and total bytes.
+
+    Args:
+        max_items: Number of responses kept
+        max_bytes: Total body size kept; a single response may use a quarter of it
+    """
+    def __init__(self, max_items=256, max_bytes=64 * 1024 * 1024):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        if len(entry.body) > self.max_bytes // 4:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous.body)
+            self._entries[key] = entry
+            self._size += len(entry.body)
+            while self._entries and (len(self._entries) > self.max_items or self._size > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted.body)
+
+    def discard(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._size -= len(entry.body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+class ResponseCache:
+    """
+    Two-level response cache: the in-process LRU in front of the shared cache.
+
+    Args:
+        memory: MemoryResponseCache, or None to disable caching
+        shared: SharedCache used by all workers, or None
+        ttl_seconds: Seconds a stored response is served
+    """
+    def __init__(self, memory, shared=None, ttl_seconds=300):
+        self.memory = memory
+        self.shared = shared if shared is not None and shared.enabled else None
+        self.ttl_seconds = ttl_seconds
+
+    @property
+    def enabled(self):
+        return self.memory is not None
+
+    def get(self, key):
+        entry = self.memory.get(key)
+        if entry is None and self.shared is not None:
+            values = self.shared.get(f"http:{key}")
+            if values is not None:
+                entry = CachedResponse.from_tuple(values)
+                if not entry.expired(self.ttl_seconds):
+                    self.memory.put(key, entry)
+        if entry is not None and entry.expired(self.ttl_seconds):
+            self.discard(key)
+            return None
+        return entry
+
+    def put(self, key, entry):
+        self.memory.put(key, entry)
+        if self.shared is not None:
+            self.shared.set(f"http:{key}", entry.to_tuple(), ttl=self.ttl_seconds)
+
+    def discard(self, key):
+        self.memory.discard(key)
+        if self.shared is not None:
+            self.shared.delete(f"http:{key}")
+
+    def clear(self):
+        """Drop the in-process responses (shared entries expire on their own)"""
+        if self.memory is not None:
+            self.memory.clear()
+
+
+def request_key(variant=None):
+    """
+    Hash of the method, path, sorted query arguments and raw body of the current request
+
+    Args:
+        variant: Optional string of server-side state the response depends on
+    """
+    digest = hashlib.sha256(f"{request.method} {request.path}".encode('utf-8'))
+    for name, value in sorted(request.args.items(multi=True)):
+        digest.update(f"\0{name}={value}".encode('utf-8'))
+    digest.update(b'\0\0')
+    # cache=True keeps the body available to request.json in the view
+    digest.update(request.get_data(cache=True))
+    if variant:
+        digest.update(b'\0\0' + variant.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _expose_headers(response, *names):
+    response.headers['Access-Control-Expose-Headers'] = ', '.join(
+        filter(None, [response.headers.get('Access-Control-Expose-Headers'), *names]))
+
+
+def _bypassed():
+    return 'no-cache' in request.headers.get('Cache-Control', '').lower()
+
+
+def cached_response(cacheable=None, cache=None, vary=None, replay=None):
+    """
+    Serve a view's 200 responses from the response cache
+
+    Streamed responses and error responses are never stored. GET responses
+    get a content ETag and honour If-None-Match.
+
+    Args:
+        cacheable: Optional predicate called in the request context; the
+                   cache is bypassed when it returns False
+        cache: ResponseCache to use (default: the module singleton)
+        vary: Optional function called in the request context whose string
+              result is added to the cache key
+        replay: Optional function called with the decoded JSON body of a hit
+                to restore the view's side effects; when it returns False
+                the view runs as on a miss
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            store = cache or response_cache
+            if not store.enabled or (cacheable is not None and not cacheable()):
+                return view(*args, **kwargs)
+
+            key = request_key(vary() if vary is not None else None)
+            entry = None if _bypassed() else store.get(key)
+            if entry is not None and replay is not None and replay(json.loads(entry.body)) is False:
+                entry = None
+            if entry is not None:
+                CACHE_LOOKUPS.inc(endpoint=request.endpoint, result='hit')
+                response = entry.to_response()
+                response.headers['X-Cache'] = 'HIT'
+            else:
+                CACHE_LOOKUPS.inc(endpoint=request.endpoint, result='miss')
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code == 200 and not response.is_streamed and not response.direct_passthrough:
+                    entry = CachedResponse.from_response(response)
+                    store.put(key, entry)
+                    response.set_etag(entry.etag)
+                response.headers['X-Cache'] = 'MISS'
+            _expose_headers(response, 'ETag', 'X-Cache')
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
+
+
+def conditional(view):
+    """Add a content ETag to a GET view's 200 responses and answer If-None-Match with 304"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        response = current_app.make_response(view(*args, **kwargs))
+        if response.status_code == 200 and not response.is_streamed and not response.direct_passthrough:
+            response.add_etag()
+            _expose_headers(response, 'ETag')
+        return response.make_conditional(request)
+    return wrapper
+
+
+def _build_cache():
+    if HTTP_CACHE_SIZE <= 0:
+        return ResponseCache(None)
+    return ResponseCache(MemoryResponseCache(HTTP_CACHE_SIZE, HTTP_CACHE_MAX_BYTES), shared_cache, HTTP_CACHE_TTL)
+
+
+# Create a singleton instance
+response_cache = _build_cache()
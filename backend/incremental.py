@@ -0,0 +1,229 @@
+"""
+Incremental Upload Processing
+
+Users re-upload the same workbook with a few rows appended or corrected.
+Every parsed row is identified by a content hash of its raw values
+(pandas' hash_pandas_object), and the processed rows of the previous
+version of a dataset are kept in an UploadState. A re-upload with the
+same columns is diffed against that state:
+
+    kept rows   reuse their processed values
+    new rows    go through preprocess.prepare()
+    gone rows   are dropped
+
+Rows without a date get their fallback dates in finish(), from their
+position in the whole upload, so they match a full reprocess.
+
+The summary statistics come from per-column moments (count, mean,
+centred sum of squares, min, max) of the observed values. The moments of
+the rows that were added and removed are merged into the previous ones,
+so a re-upload costs O(changed rows) apart from hashing and assembling
+the frame. Filling missing values with the column mean keeps the mean,
+the extremes and the centred sum of squares, so the summary of the
+filled frame follows from the moments directly.
+"""
+
+import numpy as np
+import pandas as pd
+
+import preprocess
+from preprocess import COLUMN_MAPPING, NUMERIC_COLUMNS
+
+
+class Moments:
+    """
+    Count, mean, centred sum of squares and extremes of the observed values of each column
+
+    Counts may be negative, which describes rows to remove in merge().
+    """
+    def __init__(self, columns, count, mean, m2, minimum, maximum):
+        self.columns = list(columns)
+        self.count = np.asarray(count, dtype=np.float64)
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.m2 = np.asarray(m2, dtype=np.float64)
+        self.min = np.asarray(minimum, dtype=np.float64)
+        self.max = np.asarray(maximum, dtype=np.float64)
+
+    @classmethod
+    def of(cls, frame, columns, weights=None):
+        """
+        Moments of rows of a processed frame
+
+        Args:
+            frame: Processed frame with the given columns
+            columns: Metric columns
+            weights: Per-row multiplicity (default 1); all negative for removed rows
+        """
+        values = frame[columns].to_numpy(dtype=np.float64) if len(columns) else np.zeros((len(frame), 0))
+        weights = np.ones(len(frame)) if weights is None else np.asarray(weights, dtype=np.float64)
+        observed = ~np.isnan(values)
+        w = weights[:, None] * observed
+        filled = np.where(observed, values, 0.0)
+        count = w.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count != 0, (w * filled).sum(axis=0) / count, 0.0)
+        m2 = (w * np.where(observed, filled - mean, 0.0) ** 2).sum(axis=0)
+        # Removed rows (negative weights) do not update the extremes
+        present = observed & (weights[:, None] > 0)
+        minimum = np.where(present, values, np.inf).min(axis=0, initial=np.inf)
+        maximum = np.where(present, values, -np.inf).max(axis=0, initial=-np.inf)
+        any_present = present.any(axis=0)
+        return cls(columns, count, mean, m2,
+                   np.where(any_present, minimum, np.nan), np.where(any_present, maximum, np.nan))
+
+    def merge(self, other):
+        """Moments of the union (Chan et al.); other may describe removed rows"""
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, self.mean + delta * other.count / count, 0.0)
+            m2 = np.where(count > 0, self.m2 + other.m2 + delta ** 2 * self.count * other.count / count, 0.0)
+        return Moments(self.columns, count, mean, np.clip(m2, 0.0, None),
+                       np.fmin(self.min, other.min), np.fmax(self.max, other.max))
+
+    def filled(self, rows):
+        """Moments once missing values are filled with the means: every row counts, the rest is unchanged"""
+        return Moments(self.columns, np.where(self.count > 0, rows, 0), self.mean, self.m2, self.min, self.max)
+
+    def reindex(self, columns):
+        """Moments of other columns; columns without values have a zero count"""
+        index = [self.columns.index(col) if col in self.columns else -1 for col in columns]
+        def pick(values, empty):
+            return np.array([values[i] if i >= 0 else empty for i in index], dtype=np.float64)
+        return Moments(columns, pick(self.count, 0.0), pick(self.mean, 0.0), pick(self.m2, 0.0),
+                       pick(self.min, np.nan), pick(self.max, np.nan))
+
+    def summary(self, total_rows):
+        """Upload summary: mean, extremes and sample standard deviation of each display column"""
+        summary = {'mean': {}, 'min': {}, 'max': {}, 'std': {}, 'total_rows': int(total_rows)}
+        backend_columns = dict(zip(self.columns, range(len(self.columns))))
+        for display_col, backend_col in COLUMN_MAPPING.items():
+            i = backend_columns.get(backend_col)
+            if i is None:
+                continue
+            count = self.count[i]
+            name = display_col.split(' ')[0]
+            summary['mean'][name] = float(self.mean[i]) if count > 0 else float('nan')
+            summary['min'][name] = float(self.min[i]) if count > 0 else float('nan')
+            summary['max'][name] = float(self.max[i]) if count > 0 else float('nan')
+            summary['std'][name] = float(np.sqrt(self.m2[i] / (count - 1))) if count > 1 else float('nan')
+        return summary
+
+
+class UploadState:
+    """
+    Processed rows of one version of an uploaded dataset
+
+    Attributes:
+        signature: Names and dtypes of the parsed columns
+        hashes: Content hash of every parsed row
+        frame: Processed rows (datetime 'date', missing dates still NaT and
+            missing metrics still NaN)
+        moments: Moments of the metric columns of frame
+    """
+    def __init__(self, signature, hashes, frame, moments):
+        self.signature = signature
+        self.hashes = hashes
+        self.frame = frame
+        self.moments = moments
+
+
+def signature(df):
+    """Column names and dtypes of a parsed upload"""
+    return [(str(col), str(dtype)) for col, dtype in df.dtypes.items()]
+
+
+def row_hashes(df):
+    """Content hash of every row of a parsed upload"""
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+
+def _first_rows(hashes, wanted):
+    """Position of the first row with each wanted hash (-1 when there is none)"""
+    first = np.flatnonzero(~pd.Index(hashes).duplicated())
+    position = pd.Index(hashes[first]).get_indexer(wanted)
+    return np.where(position >= 0, first[position], -1)
+
+
+def _metric_columns(frame):
+    return [col for col in NUMERIC_COLUMNS if col in frame.columns]
+
+
+def _full(df, columns, hashes, clock):
+    frame = preprocess.prepare(df, clock).reset_index(drop=True)
+    return UploadState(columns, hashes, frame, Moments.of(frame, _metric_columns(frame))), len(frame)
+
+
+def process(df, previous=None, clock=None):
+    """
+    Process a parsed upload, reusing the rows of the previous version
+
+    Args:
+        df: Parsed upload (see ingest.py)
+        previous: UploadState of the previous version, or None
+        clock: Optional StageClock
+
+    Returns:
+        (UploadState, number of rows that went through preprocessing)
+
+    Raises:
+        preprocess.ColumnMappingError: if the columns cannot be identified
+    """
+    # Taken before the stages, which modify the frame in place
+    columns = signature(df)
+    hashes = row_hashes(df)
+    if previous is None or previous.signature != columns:
+        return _full(df, columns, hashes, clock)
+
+    # Position of every row in the previous version; repeated rows share one
+    position = _first_rows(previous.hashes, hashes)
+    kept = position >= 0
+    position = position[kept]
+    if clock is not None:
+        clock.lap('diff')
+
+    fresh = preprocess.prepare(df[~kept].reset_index(drop=True), clock) if not kept.all() else None
+    # New rows mapped to other columns than the previous version (e.g. by content)
+    if fresh is not None and list(fresh.columns) != list(previous.frame.columns):
+        return _full(df, columns, hashes, clock)
+
+    # Kept rows first, then the new ones, reordered like the upload
+    combined = pd.concat([previous.frame.iloc[position]] + ([fresh] if fresh is not None else []), ignore_index=True)
+    order = np.empty(len(df), dtype=np.intp)
+    order[np.flatnonzero(kept)] = np.arange(kept.sum())
+    order[np.flatnonzero(~kept)] = kept.sum() + np.arange((~kept).sum())
+    frame = combined.iloc[order].reset_index(drop=True)
+
+    # Multiset difference of the row hashes: >0 copies added, <0 copies removed
+    counts = pd.Series(hashes).value_counts().sub(pd.Series(previous.hashes).value_counts(), fill_value=0)
+    added = counts[counts > 0]
+    removed = counts[counts < 0]
+    metrics = _metric_columns(frame)
+    moments = previous.moments
+    if len(removed):
+        # One row per removed hash, weighted by the number of copies; the
+        # removals are merged on their own so the counts never cancel out
+        old_rows = _first_rows(previous.hashes, removed.index.to_numpy())
+        gone = Moments.of(previous.frame.iloc[old_rows], metrics, removed.to_numpy())
+        moments = moments.merge(gone)
+        # Extremes cannot be un-merged; recompute them where a removed row held one
+        gone_values = Moments.of(previous.frame.iloc[old_rows], metrics)
+        stale = (gone_values.min <= previous.moments.min) | (gone_values.max >= previous.moments.max)
+        if stale.any():
+            exact = Moments.of(frame, [col for col, is_stale in zip(metrics, stale) if is_stale])
+            moments.min[stale] = exact.min
+            moments.max[stale] = exact.max
+    if len(added):
+        new_rows = _first_rows(hashes, added.index.to_numpy())
+        moments = moments.merge(Moments.of(frame.iloc[new_rows], metrics, added.to_numpy()))
+    return UploadState(columns, hashes, frame, moments), int((~kept).sum())
+
+
+def finish(state):
+    """Filled frame (with 'date' as YYYY-MM-DD strings) and summary of an UploadState"""
+    df = preprocess.sequence_dates(state.frame.copy())
+    df = preprocess.fill_missing(df, dict(zip(state.moments.columns, state.moments.mean)))
+    summary = state.moments.filled(len(df)).summary(len(df))
+    # Ensure date is properly formatted for JSON serialization
+    df['date'] = df['date'].dt.strftime('%Y-%m-%d')
+    return df, summary
@@ -0,0 +1,313 @@
+"""
+Upload Ingestion
+
+Fast readers for uploaded spreadsheets. Excel workbooks are streamed row
+by row with openpyxl in read-only mode (or python-calamine when it is
+installed) instead of building the full workbook DOM; the data sheet and
+header row are detected from the first rows of each sheet, and the values
+are converted straight into typed numpy columns.
+
+CSV files whose header matches the known schema (sample_yazaki_data.csv)
+are read with pinned dtypes and date parsing, on the pyarrow engine when
+available, so pandas does no type inference; other files fall back to the
+flexible reader.
+"""
+
+import io
+import csv
+import logging
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+try:
+    from python_calamine import CalamineWorkbook
+    CALAMINE_AVAILABLE = True
+except ImportError:
+    CALAMINE_AVAILABLE = False
+
+try:
+    import pyarrow  # noqa: F401 (enables the pyarrow CSV engine)
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+logger = logging.getLogger("ingest")
+
+# Rows of each sheet inspected when looking for the header row
+HEADER_SCAN_ROWS = 20
+
+# Header fragments of the columns the upload mapping understands
+HEADER_KEYWORDS = (
+    'date', 'time', 'period', 'month', 'energy', 'electric', 'kwh', 'transport', 'distance', 'km',
+    'waste', 'water', 'fuel', 'diesel', 'emission', 'co2', 'carbon', 'production', 'output', 'units',
+    'grid', 'intensity'
+)
+HEADER_EXACT = ('ds', 'y')
+
+# Known CSV schema (sample_yazaki_data.csv) and its pinned column types
+KNOWN_CSV_DTYPES = {
+    'energy_kwh': np.float64,
+    'production_units': np.float64,
+    'transport_km': np.float64,
+    'waste_kg': np.float64,
+    'water_m3': np.float64,
+    'fuel_l': np.float64,
+    'grid_intensity': np.float64,
+    'y': np.float64
+}
+KNOWN_CSV_COLUMNS = ['ds'] + list(KNOWN_CSV_DTYPES)
+
+
+def _header_score(row):
+    """Number of cells in a row that look like known column headers"""
+    score = 0
+    for cell in row:
+        if not isinstance(cell, str):
+            continue
+        text = cell.strip().lower()
+        if text in HEADER_EXACT or any(keyword in text for keyword in HEADER_KEYWORDS):
+            score += 1
+    return score
+
+
+def _is_blank(row):
+    return all(cell is None or (isinstance(cell, str) and not cell.strip()) for cell in row)
+
+
+def _find_header(rows):
+    """
+    Pick the header row among the first rows of a sheet
+
+    Returns:
+        (index, score): index of the header row (None for an empty sheet)
+    """
+    best_index, best_score = None, 0
+    for index, row in enumerate(rows):
+        if _is_blank(row):
+            continue
+        if best_index is None:
+            best_index = index  # First non-blank row, as pd.read_excel would use
+        score = _header_score(row)
+        if score > best_score:
+            best_index, best_score = index, score
+    return best_index, best_score
+
+
+def _column_names(header):
+    """Header cells as unique column names, following pandas' conventions"""
+    names = []
+    seen = {}
+    for i, cell in enumerate(header):
+        if cell is None or (isinstance(cell, str) and not cell.strip()):
+            name = f"Unnamed: {i}"
+        elif isinstance(cell, float) and cell.is_integer():
+            name = int(cell)
+        else:
+            name = cell
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _to_column(values):
+    """Convert one column of cell values into a typed numpy array"""
+    values = [None if isinstance(value, str) and not value.strip() else value for value in values]
+    present = [value for value in values if value is not None]
+    if not present:
+        return np.full(len(values), np.nan)
+
+    if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present):
+        # None becomes NaN; whole-number columns without gaps stay integers
+        column = np.array(values, dtype=np.float64)
+        if len(present) == len(values) and np.all(np.mod(column, 1) == 0) and np.all(np.abs(column) < 2 ** 53):
+            return column.astype(np.int64)
+        return column
+
+    if all(isinstance(value, (dt.datetime, dt.date)) for value in present):
+        return pd.to_datetime(pd.Series(values, dtype=object)).values
+
+    return np.array(values, dtype=object)
+
+
+def rows_to_frame(rows):
+    """
+    Build a DataFrame from a sheet's rows, detecting the header row
+
+    Args:
+        rows: Iterator of row tuples (cell values)
+    """
+    rows = iter(rows)
+    head = []
+    for row in rows:
+        head.append(tuple(row))
+        if len(head) >= HEADER_SCAN_ROWS:
+            break
+
+    header_index, _ = _find_header(head)
+    if header_index is None:
+        return pd.DataFrame()
+
+    header = head[header_index]
+    data = head[header_index + 1:]
+    data.extend(tuple(row) for row in rows)
+
+    # Drop trailing blank rows and pad short rows to the header width
+    while data and _is_blank(data[-1]):
+        data.pop()
+    width = max([len(header)] + [len(row) for row in data])
+    header = tuple(header) + (None,) * (width - len(header))
+
+    # Drop trailing columns with neither a header nor any values
+    while width and header[width - 1] is None and all(len(row) < width or row[width - 1] is None for row in data):
+        width -= 1
+    header = header[:width]
+
+    names = _column_names(header)
+    data = [row[:width] if len(row) >= width else row + (None,) * (width - len(row)) for row in data]
+    columns = list(zip(*data)) if data else [()] * width
+
+    return pd.DataFrame({name: _to_column(list(values)) for name, values in zip(names, columns)}, columns=names)
+
+
+class _OpenpyxlWorkbook:
+    """Read-only openpyxl workbook yielding value rows"""
+    def __init__(self, stream):
+        from openpyxl import load_workbook
+        self._workbook = load_workbook(stream, read_only=True, data_only=True)
+        self.sheet_names = self._workbook.sheetnames
+
+    def rows(self, name):
+        return self._workbook[name].iter_rows(values_only=True)
+
+    def close(self):
+        self._workbook.close()
+
+
+class _CalamineWorkbook:
+    """python-calamine workbook yielding value rows"""
+    def __init__(self, stream):
+        self._workbook = CalamineWorkbook.from_filelike(stream)
+        self.sheet_names = self._workbook.sheet_names
+
+    def rows(self, name):
+        # calamine reports empty cells as ''
+        rows = self._workbook.get_sheet_by_name(name).to_python(skip_empty_area=False)
+        return ([None if cell == '' else cell for cell in row] for row in rows)
+
+    def close(self):
+        pass
+
+
+def _select_sheet(workbook):
+    """
+    Choose the sheet whose header best matches the known columns
+
+    Only the first HEADER_SCAN_ROWS rows of each sheet are read; ties go to
+    the earliest sheet, so single-sheet files behave like pd.read_excel.
+    """
+    if len(workbook.sheet_names) == 1:
+        return workbook.sheet_names[0]
+
+    best = None
+    for name in workbook.sheet_names:
+        head = []
+        for row in workbook.rows(name):
+            head.append(tuple(row))
+            if len(head) >= HEADER_SCAN_ROWS:
+                break
+        _, score = _find_header(head)
+        if best is None or score > best[1]:
+            best = (name, score)
+    return best[0] if best else None
+
+
+def read_xlsx(file):
+    """
+    Read an .xlsx upload with the streaming reader
+
+    Args:
+        file: Uploaded file (Flask FileStorage or a binary file object)
+
+    Returns:
+        DataFrame of the detected data sheet
+    """
+    stream = getattr(file, 'stream', file)
+    workbook = (_CalamineWorkbook if CALAMINE_AVAILABLE else _OpenpyxlWorkbook)(stream)
+    try:
+        sheet_name = _select_sheet(workbook)
+        if sheet_name is None:
+            return pd.DataFrame()
+        logger.debug("Reading sheet '%s'", sheet_name)
+        return rows_to_frame(workbook.rows(sheet_name))
+    finally:
+        workbook.close()
+
+
+def read_excel(file, filename):
+    """
+    Read an uploaded Excel workbook
+
+    .xlsx files use the streaming reader; legacy .xls files (and workbooks
+    the streaming reader cannot handle) go through pd.read_excel.
+    """
+    if filename.lower().endswith('.xlsx'):
+        try:
+            return read_xlsx(file)
+        except Exception as e:
+            logger.warning("Streaming Excel reader failed (%s); using pd.read_excel", e)
+            getattr(file, 'stream', file).seek(0)
+    return pd.read_excel(file)
+
+
+def _peek_header(stream):
+    """Parse the first line of a CSV stream without consuming it"""
+    position = stream.tell()
+    try:
+        line = stream.readline()
+    finally:
+        stream.seek(position)
+    if isinstance(line, bytes):
+        line = line.decode('utf-8-sig', errors='replace')
+    return [cell.strip() for cell in next(csv.reader(io.StringIO(line)), [])]
+
+
+def read_known_csv(stream):
+    """Read a CSV in the known schema with pinned dtypes and no inference"""
+    if PYARROW_AVAILABLE:
+        options = {'engine': 'pyarrow'}
+    else:
+        # The C engine parses ISO dates much faster once the format is inferred
+        options = {'engine': 'c', 'infer_datetime_format': True}
+    return pd.read_csv(
+        stream,
+        usecols=KNOWN_CSV_COLUMNS,
+        dtype=KNOWN_CSV_DTYPES,
+        parse_dates=['ds'],
+        **options
+    )
+
+
+def read_csv(file):
+    """
+    Read an uploaded CSV file
+
+    Files with exactly the known columns (in any order) take the typed fast
+    path; anything else, or a known-schema file with values that do not fit
+    the pinned types, is read with full type inference.
+    """
+    stream = getattr(file, 'stream', file)
+    header = _peek_header(stream)
+    if len(header) == len(KNOWN_CSV_COLUMNS) and set(header) == set(KNOWN_CSV_COLUMNS):
+        position = stream.tell()
+        try:
+            return read_known_csv(stream)
+        except (ValueError, TypeError) as e:
+            logger.info("Known-schema CSV did not match the pinned types (%s); using type inference", e)
+            stream.seek(position)
+    return pd.read_csv(stream)
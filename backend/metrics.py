@@ -0,0 +1,242 @@
+"""
+Request Stage Timing and Metrics
+
+Lightweight instrumentation for the Flask API. Code paths record stage
+timings (parse, map columns, parse dates, fit, predict, serialize) with the
+stage() context manager, the timed() decorator or a StageClock for long
+straight-line handlers. Timings are aggregated into Prometheus-style
+histograms exposed at /api/metrics and, when enabled, returned to the
+caller in a Server-Timing header.
+"""
+
+import os
+import time
+import threading
+from functools import wraps
+from contextlib import contextmanager
+
+from flask import g, request, has_request_context
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """Monotonic counter with labels"""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0.0)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = []
+        with self._lock:
+            items = sorted((key, (list(s[0]), s[1], s[2])) for key, s in self._series.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', f"{bound:g}")])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, [('le', '+Inf')])
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered in the Prometheus text format"""
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+REQUEST_DURATION = registry.histogram(
+    'carbonsync_request_duration_seconds',
+    'Latency of API requests',
+    ['endpoint', 'method', 'status']
+)
+STAGE_DURATION = registry.histogram(
+    'carbonsync_stage_duration_seconds',
+    'Latency of pipeline stages within API requests',
+    ['endpoint', 'stage']
+)
+
+# Return stage timings in a Server-Timing header on every response
+SERVER_TIMING_ENABLED = os.environ.get('CARBONSYNC_SERVER_TIMING', '').lower() in ('1', 'true', 'yes')
+
+
+def _current_endpoint():
+    if has_request_context():
+        return request.endpoint or 'unknown'
+    return 'background'
+
+
+def record_stage(name, seconds):
+    """Record a stage duration for the current request (or background work)"""
+    STAGE_DURATION.observe(seconds, endpoint=_current_endpoint(), stage=name)
+    if has_request_context():
+        timings = g.get('stage_timings')
+        if timings is not None:
+            timings.append((name, seconds))
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as a named stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def timed(name):
+    """Decorator recording every call of the function as a named stage"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class StageClock:
+    """
+    Lap timer for long straight-line handlers.
+
+    Each lap() records the time since the previous lap as a stage, so a
+    handler can be split into stages without re-indenting it.
+    """
+    def __init__(self):
+        self._last = time.perf_counter()
+
+    def lap(self, name):
+        now = time.perf_counter()
+        record_stage(name, now - self._last)
+        self._last = now
+
+    def reset(self):
+        self._last = time.perf_counter()
+
+
+def _server_timing_requested():
+    return SERVER_TIMING_ENABLED or request.headers.get('X-Server-Timing', '').lower() in ('1', 'true', 'yes')
+
+
+def init_app(app):
+    """Install the request timing hooks on a Flask app"""
+    @app.before_request
+    def _start_request_timer():
+        g.request_started = time.perf_counter()
+        g.stage_timings = []
+
+    @app.after_request
+    def _finish_request_timer(response):
+        started = g.get('request_started')
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        REQUEST_DURATION.observe(
+            elapsed,
+            endpoint=request.endpoint or 'unknown',
+            method=request.method,
+            status=response.status_code
+        )
+
+        if _server_timing_requested():
+            entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in g.get('stage_timings', [])]
+            entries.append(f"total;dur={elapsed * 1000:.2f}")
+            response.headers['Server-Timing'] = ', '.join(entries)
+            response.headers['Access-Control-Expose-Headers'] = ', '.join(
+                filter(None, [response.headers.get('Access-Control-Expose-Headers'), 'Server-Timing']))
+        return response
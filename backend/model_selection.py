@@ -0,0 +1,184 @@
+"""
+Automatic Forecast Engine Selection
+
+engine='auto' races the forecast engines on a holdout of the series: the
+latest rolling-origin folds (see backtest.py) are scored one at a time,
+newest first, and every engine still in the race forecasts each fold,
+up to a fixed number of folds per engine (ENGINE_FOLDS caps the slow
+ones). Engines run cheapest first and leave the race when
+    dominated:   their paired fold errors are clearly worse than the
+                 current leader's (one-sided t test at DOMINANCE_LEVEL)
+    failed:      they raise
+The winner is the most accurate engine, unless an engine earlier in
+CANDIDATES (cheaper) is within COST_TOLERANCE of its error. Ties are
+broken by that fixed order rather than by measured fit times, so the same
+data always selects the same engine. The choice is cached per dataset fingerprint
+in the shared cache, so later requests (in any worker) use it directly.
+
+The time budget is only a safety cap: an engine whose next fold would
+not finish within it is cut short ('over_budget'). Which engines that hits
+depends on the load of the worker, so a truncated race is used for the
+request but its choice is not cached.
+"""
+
+import os
+import time
+import logging
+
+import numpy as np
+from scipy import stats
+
+import backtest
+import forecasting
+from metrics import stage
+from analysis import REGRESSOR_COLUMNS
+from dataset import widen
+from shared_cache import shared_cache
+
+logger = logging.getLogger("model_selection")
+
+# Engines in the race, cheapest first (also the order ties are broken in)
+CANDIDATES = ('linear', 'ets', 'prophet')
+
+# Seconds of fitting after which a race is cut short (and its choice not cached)
+SELECTION_BUDGET = float(os.environ.get('CARBONSYNC_SELECTION_BUDGET', 10.0))
+
+# Holdout folds and the forecast steps scored per fold
+RACE_FOLDS = 6
+RACE_HORIZON = 3
+
+# Folds raced by the slow engines (the others race all RACE_FOLDS)
+ENGINE_FOLDS = {'prophet': 3}
+
+# A cheaper engine wins when its error is within this fraction of the best
+COST_TOLERANCE = 0.05
+
+# Folds an engine must complete to win
+MIN_RACE_FOLDS = 2
+
+# Paired folds and confidence needed to drop a dominated engine
+MIN_DOMINANCE_FOLDS = 3
+DOMINANCE_LEVEL = 0.975
+
+
+def _cost_rank(engine):
+    return CANDIDATES.index(engine) if engine in CANDIDATES else len(CANDIDATES)
+
+
+def race(data, engines=None, budget=None, folds=RACE_FOLDS, horizon=RACE_HORIZON):
+    """
+    Race forecast engines on the latest folds of a series
+
+    Args:
+        data: CarbonDataset of one series
+        engines: Engines to race (default: CANDIDATES that are installed)
+        budget: Seconds the race may spend (default CARBONSYNC_SELECTION_BUDGET)
+        folds: Holdout folds
+        horizon: Forecast steps scored per fold
+
+    Returns:
+        dict with the winning engine, whether the budget cut the race short
+        ('truncated') and the MAE, folds, seconds per fold and status of
+        every candidate, or None when the series is too short for
+        MIN_RACE_FOLDS folds
+    """
+    if engines is None:
+        engines = [engine for engine in CANDIDATES if engine != 'prophet' or forecasting.PROPHET_AVAILABLE]
+    budget = SELECTION_BUDGET if budget is None else budget
+
+    y = widen(data.column('y'))
+    cutoffs = [cutoff for cutoff in backtest.fold_cutoffs(len(data), horizon, max_folds=folds)[::-1]
+               if not np.all(np.isnan(y[cutoff:cutoff + horizon]))]
+    if len(cutoffs) < MIN_RACE_FOLDS:
+        return None
+    regressors = data.filled(REGRESSOR_COLUMNS)
+
+    errors = {engine: [] for engine in engines}
+    seconds = {engine: [] for engine in engines}
+    status = {engine: 'racing' for engine in engines}
+    started = time.perf_counter()
+
+    for cutoff in cutoffs:
+        actual = y[cutoff:cutoff + horizon]
+        for engine in engines:
+            if status[engine] != 'racing' or len(errors[engine]) >= ENGINE_FOLDS.get(engine, folds):
+                continue
+            # The first fold of every engine is run so each has a cost estimate
+            expected = np.mean(seconds[engine]) if seconds[engine] else 0.0
+            if seconds[engine] and time.perf_counter() - started + expected > budget:
+                status[engine] = 'over_budget'
+                continue
+            fold_started = time.perf_counter()
+            try:
+                yhat = backtest.run_folds(engine, data.dates, y, regressors, np.array([cutoff]), horizon)[0][0]
+            except Exception as e:
+                logger.warning("%s failed in model selection: %s", engine, e)
+                status[engine] = 'failed'
+                continue
+            error = float(np.nanmean(np.abs(actual - yhat)))
+            if not np.isfinite(error):
+                status[engine] = 'failed'
+                continue
+            seconds[engine].append(time.perf_counter() - fold_started)
+            errors[engine].append(error)
+
+        # Drop engines whose paired errors are clearly worse than the leader's
+        racing = [engine for engine in engines if status[engine] == 'racing']
+        if len(racing) < 2:
+            continue
+        leader = min(racing, key=lambda engine: (np.mean(errors[engine]), _cost_rank(engine)))
+        for engine in racing:
+            n = min(len(errors[engine]), len(errors[leader]))
+            if engine == leader or n < MIN_DOMINANCE_FOLDS:
+                continue
+            difference = np.subtract(errors[engine][:n], errors[leader][:n])
+            if difference.mean() > stats.t.ppf(DOMINANCE_LEVEL, n - 1) * difference.std(ddof=1) / np.sqrt(n):
+                status[engine] = 'dominated'
+
+    eligible = [engine for engine in engines
+                if status[engine] in ('racing', 'over_budget') and len(errors[engine]) >= MIN_RACE_FOLDS]
+    if not eligible:
+        eligible = [engine for engine in engines if errors[engine]]
+    if not eligible:
+        return None
+
+    # Compare on the folds every eligible engine completed
+    n = min(len(errors[engine]) for engine in eligible)
+    mae = {engine: float(np.mean(errors[engine][:n])) for engine in eligible}
+    best = min(mae.values())
+    affordable = [engine for engine in eligible if mae[engine] <= best * (1 + COST_TOLERANCE)]
+    winner = min(affordable, key=_cost_rank)
+
+    return {
+        "engine": winner,
+        "truncated": any(status[engine] == 'over_budget' for engine in engines),
+        "candidates": {engine: {
+            "mae": float(np.mean(errors[engine])) if errors[engine] else None,
+            "folds": len(errors[engine]),
+            "seconds_per_fold": float(np.mean(seconds[engine])) if seconds[engine] else None,
+            "status": 'won' if engine == winner else status[engine]
+        } for engine in engines}
+    }
+
+
+def choose_engine(ctx):
+    """
+    Engine for engine='auto' on a dataset, raced once per fingerprint
+
+    Series too short to race use forecasting.default_engine. A race cut
+    short by the time budget is kept on the context only, so a later
+    request can race the dataset in full.
+    """
+    if ctx.engine is None:
+        key = f"engine:{ctx.fingerprint}"
+        choice = shared_cache.get(key)
+        if choice is None:
+            with stage('select'):
+                choice = race(ctx.data) or {"engine": forecasting.default_engine(ctx)}
+            if choice.get("truncated"):
+                logger.info("Engine race on %s was cut short by the time budget; not caching %s",
+                            ctx.fingerprint, choice["engine"])
+            else:
+                shared_cache.set(key, choice)
+        ctx.engine = choice["engine"]
+    return ctx.engine
@@ -0,0 +1,295 @@
+"""
+Offline Forecasting Pipeline
+
+The upload and forecast steps of the API without the web server, for
+batch runs over many files (see carbonsync.py):
+
+    ingest     parse a file and run the upload preprocessing (bulk.process_file),
+               aggregating readings finer than the modelling frequency
+    forecast   forecast every site of the file (forecasting.forecast)
+    export     append the forecasts to a Parquet or CSV file
+
+Files are independent, so run() forecasts them in a pool of processes
+and writes the forecasts of each file as soon as it is done; only the
+files in flight are held in memory. The output is written to a temporary
+file that replaces the target once every file is written, so a reader
+never sees a partial result.
+"""
+
+import os
+import re
+import gzip
+import uuid
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+
+import analysis
+import bulk
+import forecasting
+import incremental
+import resample
+from dataset import CarbonDataset
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+logger = logging.getLogger("pipeline")
+
+# Processes forecasting files in parallel
+PIPELINE_WORKERS = int(os.environ.get('CARBONSYNC_PIPELINE_WORKERS', os.cpu_count() or 1))
+
+# Files submitted to the pool per worker ahead of the writer
+QUEUE_DEPTH = 2
+
+# Columns of the forecast output
+RESULT_COLUMNS = ['file', 'site', 'ds', 'predicted_emissions', 'lower_bound', 'upper_bound', 'engine']
+
+# Output formats by file extension
+OUTPUT_FORMATS = {'.parquet': 'parquet', '.csv': 'csv', '.csv.gz': 'csv'}
+
+
+class PipelineError(ValueError):
+    """Raised for unsupported outputs and inputs without files to forecast"""
+
+
+def collect_files(paths):
+    """
+    (path, name) of every input file; directories are searched recursively
+
+    The name is the path relative to the directory it was found in, so the
+    site of a file in <dir>/<site>/... is its folder (see bulk.site_name).
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = []
+            for root, dirs, names in os.walk(path):
+                dirs[:] = [d for d in dirs if not d.startswith('.')]
+                found.extend(os.path.join(root, name) for name in names
+                             if not name.startswith('.') and name.lower().endswith(bulk.SUPPORTED_EXTENSIONS))
+            files.extend((file, os.path.relpath(file, path)) for file in sorted(found))
+        elif os.path.isfile(path):
+            files.append((path, os.path.basename(path)))
+        else:
+            raise PipelineError(f"No such file or directory: {path}")
+    if not files:
+        raise PipelineError("No CSV or Excel files to forecast")
+    return files
+
+
+def forecast_sites(data, default_site, periods, engine='auto'):
+    """
+    Forecast every site of a dataset
+
+    Args:
+        data: CarbonDataset, with a 'site' label when it holds several sites
+        default_site: Site of rows without a site label
+        periods: Number of future steps
+        engine: One of forecasting.ENGINES
+
+    Returns:
+        (forecast frame with RESULT_COLUMNS but 'file', {site: error})
+    """
+    if 'site' in data.labels:
+        labels = np.where(data.labels['site'] == '', default_site, data.labels['site'])
+        sites = [(site, data.select(labels == site)) for site in np.unique(labels)]
+    else:
+        sites = [(default_site, data)]
+
+    frames, errors = [], {}
+    for site, series in sites:
+        if not series.has('y'):
+            errors[site] = "Missing required column: y"
+        elif series.has_duplicate_dates():
+            errors[site] = "Duplicate dates found. Each date must be unique."
+        elif np.count_nonzero(~np.isnan(series.column('y'))) < 3:
+            errors[site] = "Need at least 3 data points for forecasting"
+        else:
+            ctx = analysis.AnalysisContext(series.fingerprint(), series)
+            forecast, used = forecasting.forecast(ctx, periods, engine)
+            tail = forecast.tail(periods)
+            frames.append(pd.DataFrame({
+                'site': site,
+                'ds': pd.to_datetime(tail['ds']).to_numpy(dtype='datetime64[ns]'),
+                'predicted_emissions': tail['yhat'].to_numpy(dtype=np.float64),
+                'lower_bound': tail['yhat_lower'].to_numpy(dtype=np.float64),
+                'upper_bound': tail['yhat_upper'].to_numpy(dtype=np.float64),
+                'engine': used
+            }))
+    if not frames:
+        return pd.DataFrame(columns=RESULT_COLUMNS[1:]), errors
+    return pd.concat(frames, ignore_index=True), errors
+
+
+def forecast_file(path, name, periods, engine='auto', site_pattern=None, frequency=None):
+    """
+    Ingest and forecast one file (runs in the worker processes)
+
+    Returns:
+        (forecast frame with RESULT_COLUMNS or None, report); errors are
+        reported rather than raised so one bad file does not stop a run
+    """
+    report = {"file": path}
+    try:
+        with open(path, 'rb') as f:
+            state = bulk.process_file(path, f.read())
+        df, _ = incremental.finish(state)
+        data = resample.to_model_frequency(CarbonDataset.from_frame(df), frequency)
+        frame, errors = forecast_sites(data, bulk.site_name(name, site_pattern), periods, engine)
+    except Exception as e:
+        report["error"] = bulk.describe_error(e)
+        return None, report
+
+    frame.insert(0, 'file', path)
+    report["sites"] = int(frame['site'].nunique())
+    report["rows"] = len(frame)
+    if errors:
+        report["errors"] = errors
+    return frame, report
+
+
+def output_format(path):
+    """'parquet' or 'csv' from the extension of an output path"""
+    lower = path.lower()
+    for extension, fmt in OUTPUT_FORMATS.items():
+        if lower.endswith(extension):
+            return fmt
+    raise PipelineError(f"Unsupported output: {path}. Use one of {', '.join(OUTPUT_FORMATS)}")
+
+
+class ResultWriter:
+    """
+    Appends forecast frames to a Parquet file (one row group per frame)
+    or a CSV file (gzip-compressed for .csv.gz)
+
+    Used as a context manager: the output replaces `path` when the block
+    exits normally and is removed when it raises.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.format = output_format(path)
+        if self.format == 'parquet' and not PYARROW_AVAILABLE:
+            raise PipelineError("Writing Parquet needs the pyarrow package; write a .csv or .csv.gz file instead")
+        self.rows = 0
+        self._tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        self._writer = None
+
+    def __enter__(self):
+        if self.format == 'parquet':
+            self._schema = pa.schema([
+                ('file', pa.string()), ('site', pa.string()), ('ds', pa.timestamp('ns')),
+                ('predicted_emissions', pa.float64()), ('lower_bound', pa.float64()),
+                ('upper_bound', pa.float64()), ('engine', pa.string())
+            ])
+            self._writer = pq.ParquetWriter(self._tmp_path, self._schema)
+        else:
+            opener = gzip.open if self.path.lower().endswith('.gz') else open
+            self._writer = opener(self._tmp_path, 'wt', newline='', encoding='utf-8')
+        return self
+
+    def write(self, frame):
+        frame = frame[RESULT_COLUMNS]
+        if self.format == 'parquet':
+            self._writer.write_table(pa.Table.from_pandas(frame, schema=self._schema, preserve_index=False))
+        else:
+            frame.to_csv(self._writer, index=False, header=(self.rows == 0), date_format='%Y-%m-%d')
+        self.rows += len(frame)
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.format == 'csv' and self.rows == 0 and exc_type is None:
+            self._writer.write(','.join(RESULT_COLUMNS) + '\n')
+        self._writer.close()
+        if exc_type is None:
+            os.replace(self._tmp_path, self.path)
+        else:
+            try:
+                os.remove(self._tmp_path)
+            except OSError:
+                pass
+        return False
+
+
+def _results(jobs, workers):
+    """Yield the result of every job as it completes, with at most QUEUE_DEPTH x workers in flight"""
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield forecast_file(*job)
+        return
+
+    queue = deque(jobs)
+    running = {}
+    broken = []
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method)) as pool:
+        while (queue or running) and not broken:
+            while queue and len(running) < QUEUE_DEPTH * workers:
+                job = queue.popleft()
+                running[pool.submit(forecast_file, *job)] = job
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    broken.append(job)
+                    continue
+                yield result
+
+    if broken:
+        logger.warning("Pipeline process pool is broken; forecasting the remaining files inline")
+        for job in broken + list(running.values()) + list(queue):
+            yield forecast_file(*job)
+
+
+def run(files, out, periods=12, engine='auto', workers=None, site_pattern=None, frequency=None):
+    """
+    Forecast every site of the given files and write the forecasts to out
+
+    Args:
+        files: (path, name) pairs (see collect_files)
+        out: Output path (.parquet, .csv or .csv.gz)
+        periods: Number of future steps per site
+        engine: One of forecasting.ENGINES
+        workers: Processes (default CARBONSYNC_PIPELINE_WORKERS, 1 runs inline)
+        site_pattern: Optional regex whose first group names the site of a path
+        frequency: Modelling frequency finer data is aggregated to (see resample.py)
+
+    Returns:
+        Per-file reports in order of completion
+
+    Raises:
+        PipelineError: for an unsupported output format, engine, site_pattern or frequency
+    """
+    if engine not in forecasting.ENGINES:
+        raise PipelineError(f"Unknown forecast engine: {engine}")
+    if site_pattern:
+        try:
+            re.compile(site_pattern)
+        except re.error as e:
+            raise PipelineError(f"Invalid site_pattern: {e}")
+    workers = workers or PIPELINE_WORKERS
+    if frequency and frequency != 'raw' and frequency not in resample.FREQUENCIES:
+        raise PipelineError(f"Unknown frequency: {frequency}")
+    jobs = [(path, name, periods, engine, site_pattern, frequency) for path, name in files]
+
+    reports = []
+    with ResultWriter(out) as writer:
+        for frame, report in _results(jobs, workers):
+            if frame is not None and len(frame):
+                writer.write(frame)
+            if "error" in report:
+                logger.warning("Could not forecast %s: %s", report["file"], report["error"])
+            else:
+                logger.info("Forecast %s: %d sites, %d rows", report["file"], report["sites"], report["rows"])
+            reports.append(report)
+    return reports
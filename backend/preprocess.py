@@ -0,0 +1,483 @@
+"""
+Upload Preprocessing
+
+The stages that turn a parsed upload (see ingest.py) into the processed
+frame the other endpoints work on:
+
+    map_columns     match the file's headers to the display columns
+    parse_dates     parse the 'date' column with several fallbacks
+    convert_units   add the backend columns (energy_kwh, y, ...) in backend units
+    sequence_dates  give rows without a date a daily sequence
+    fill_missing    fill missing metrics with the column means
+
+Every stage but sequence_dates and fill_missing works row by row, so
+prepare() can be run on just the new rows of a re-upload (see
+incremental.py); those two run on the whole frame.
+"""
+
+import re
+import logging
+
+import pandas as pd
+
+from app_logging import LazyFrame
+
+logger = logging.getLogger("preprocess")
+
+# Display columns of an upload and the backend columns they become
+COLUMN_MAPPING = {
+    'energy_use (kWh)': 'energy_kwh',
+    'transport (km)': 'transport_km',
+    'waste (tons)': 'waste_kg',
+    'water (liters)': 'water_m3',
+    'fuel (liters)': 'fuel_l',
+    'emissions (tons CO2e)': 'y',
+    'production (units)': 'production_units',
+    'grid_intensity (kg CO2e/kWh)': 'grid_intensity'
+}
+
+# Backend metric columns, filled with their means when values are missing
+NUMERIC_COLUMNS = ['energy_kwh', 'production_units', 'transport_km', 'y',
+                   'waste_kg', 'water_m3', 'fuel_l', 'grid_intensity']
+
+
+class ColumnMappingError(ValueError):
+    """Raised when the columns of an upload cannot be identified"""
+    def __init__(self, message, columns_found=None):
+        super().__init__(message)
+        self.columns_found = columns_found
+
+
+def map_columns(df):
+    """
+    Rename the columns of a parsed upload to the display columns
+
+    Exact display names are kept; otherwise the headers are matched
+    against known aliases, and as a last resort by content and position.
+
+    Raises:
+        ColumnMappingError: if no column can be identified
+    """
+    # Validate and standardize column names
+    expected_columns = [
+        'date', 'energy_use (kWh)', 'transport (km)', 'waste (tons)', 
+        'water (liters)', 'fuel (liters)', 'emissions (tons CO2e)', 
+        'production (units)', 'grid_intensity (kg CO2e/kWh)'
+    ]
+
+    # Column names and first few rows for debugging (formatted only at DEBUG)
+    logger.debug("Columns in uploaded file: %s", df.columns.tolist())
+    logger.debug("First 3 rows of data:\n%s", LazyFrame(df, 3))
+
+    # Check if we have at least some of the expected columns
+    found_columns = [col for col in expected_columns if col in df.columns]
+
+    # If exact column names aren't found, try to match using more flexible mapping
+    if not found_columns:
+        # Extended mapping with various possible column name formats
+        flexible_mapping = {
+            # Date columns
+            'ds': 'date',
+            'date': 'date',
+            'datetime': 'date',
+            'time': 'date',
+            'period': 'date',
+            'month': 'date',
+            'year': 'date',
+
+            # Energy columns
+            'energy_kwh': 'energy_use (kWh)',
+            'energy_use': 'energy_use (kWh)',
+            'energy': 'energy_use (kWh)',
+            'electricity': 'energy_use (kWh)',
+            'power': 'energy_use (kWh)',
+            'kwh': 'energy_use (kWh)',
+            'energy (kwh)': 'energy_use (kWh)',
+            'energy_use_kwh': 'energy_use (kWh)',
+            'energy_use(kwh)': 'energy_use (kWh)',
+
+            # Transport columns
+            'transport_km': 'transport (km)',
+            'transport': 'transport (km)',
+            'travel': 'transport (km)',
+            'distance': 'transport (km)',
+            'km': 'transport (km)',
+            'miles': 'transport (km)',
+            'transportation': 'transport (km)',
+            'transport (km)': 'transport (km)',
+            'transport(km)': 'transport (km)',
+
+            # Waste columns
+            'waste_kg': 'waste (tons)',
+            'waste': 'waste (tons)',
+            'garbage': 'waste (tons)',
+            'trash': 'waste (tons)',
+            'waste (kg)': 'waste (tons)',
+            'waste (tons)': 'waste (tons)',
+            'waste(tons)': 'waste (tons)',
+
+            # Water columns
+            'water_m3': 'water (liters)',
+            'water': 'water (liters)',
+            'h2o': 'water (liters)',
+            'water_usage': 'water (liters)',
+            'water_consumption': 'water (liters)',
+            'water (liters)': 'water (liters)',
+            'water (m3)': 'water (liters)',
+            'water(liters)': 'water (liters)',
+
+            # Fuel columns
+            'fuel_l': 'fuel (liters)',
+            'fuel': 'fuel (liters)',
+            'gas': 'fuel (liters)',
+            'gasoline': 'fuel (liters)',
+            'diesel': 'fuel (liters)',
+            'petrol': 'fuel (liters)',
+            'fuel (liters)': 'fuel (liters)',
+            'fuel (l)': 'fuel (liters)',
+            'fuel(liters)': 'fuel (liters)',
+
+            # Emissions columns
+            'y': 'emissions (tons CO2e)',
+            'emissions': 'emissions (tons CO2e)',
+            'co2': 'emissions (tons CO2e)',
+            'co2e': 'emissions (tons CO2e)',
+            'carbon': 'emissions (tons CO2e)',
+            'ghg': 'emissions (tons CO2e)',
+            'greenhouse_gas': 'emissions (tons CO2e)',
+            'emissions (tons)': 'emissions (tons CO2e)',
+            'emissions (tons co2e)': 'emissions (tons CO2e)',
+            'emissions(tons co2e)': 'emissions (tons CO2e)',
+            'carbon_emissions': 'emissions (tons CO2e)',
+
+            # Production columns
+            'production_units': 'production (units)',
+            'production': 'production (units)',
+            'units': 'production (units)',
+            'output': 'production (units)',
+            'products': 'production (units)',
+            'production (units)': 'production (units)',
+            'production(units)': 'production (units)',
+
+            # Grid intensity columns
+            'grid_intensity': 'grid_intensity (kg CO2e/kWh)',
+            'grid': 'grid_intensity (kg CO2e/kWh)',
+            'intensity': 'grid_intensity (kg CO2e/kWh)',
+            'carbon_intensity': 'grid_intensity (kg CO2e/kWh)',
+            'grid_carbon': 'grid_intensity (kg CO2e/kWh)',
+            'grid_intensity (kg co2e/kwh)': 'grid_intensity (kg CO2e/kWh)',
+            'grid_intensity(kg co2e/kwh)': 'grid_intensity (kg CO2e/kWh)'
+        }
+
+        # Case-insensitive column matching with improved flexibility
+        rename_dict = {}
+        for col in df.columns:
+            if pd.isna(col):  # Skip NaN column names
+                continue
+
+            col_str = str(col).lower().strip()
+
+            # Try exact match first
+            for old_col, new_col in flexible_mapping.items():
+                if old_col.lower() == col_str:
+                    rename_dict[col] = new_col
+                    break
+
+            # If no exact match, try partial match
+            if col not in rename_dict:
+                for old_col, new_col in flexible_mapping.items():
+                    if old_col.lower() in col_str or col_str in old_col.lower():
+                        rename_dict[col] = new_col
+                        break
+
+        logger.debug("Column mapping: %s", rename_dict)
+
+        if rename_dict:
+            df = df.rename(columns=rename_dict)
+
+            # Convert units if needed
+            if 'waste (tons)' in df.columns and 'waste_kg' in df.columns:
+                df['waste (tons)'] = df['waste_kg'] / 1000  # Convert kg to tons
+
+            if 'water (liters)' in df.columns and 'water_m3' in df.columns:
+                df['water (liters)'] = df['water_m3'] * 1000  # Convert m3 to liters
+        else:
+            # If no columns were mapped, try more aggressive matching based on column content and position
+            logger.info("No columns mapped with standard mapping. Trying aggressive mapping...")
+
+            # Check for date column - look for columns with date-like values
+            date_cols = []
+            for col in df.columns:
+                if pd.isna(col):
+                    continue
+                try:
+                    # Try to convert first non-null value to date
+                    first_val = df[col].dropna().iloc[0] if not df[col].dropna().empty else None
+                    if first_val and pd.to_datetime(first_val, errors='coerce') is not pd.NaT:
+                        date_cols.append(col)
+                except (ValueError, TypeError, IndexError):
+                    pass
+
+            # If we found date columns, map the first one
+            if date_cols:
+                rename_dict[date_cols[0]] = 'date'
+                logger.debug("Mapped column '%s' to 'date' based on content", date_cols[0])
+
+            # Try to map numeric columns to the expected metrics based on position
+            numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
+            expected_numeric = [
+                'energy_use (kWh)', 'transport (km)', 'waste (tons)', 'water (liters)', 
+                'fuel (liters)', 'emissions (tons CO2e)', 'production (units)', 'grid_intensity (kg CO2e/kWh)'
+            ]
+
+            # Map remaining numeric columns based on position
+            remaining_numeric = [col for col in numeric_cols if col not in rename_dict.keys()]
+            for i, col in enumerate(remaining_numeric):
+                if i < len(expected_numeric):
+                    rename_dict[col] = expected_numeric[i]
+                    logger.debug("Mapped column '%s' to '%s' based on position", col, expected_numeric[i])
+
+            # If still no date column, try to use the first column as date
+            if 'date' not in rename_dict.values() and len(df.columns) > 0:
+                first_col = df.columns[0]
+                rename_dict[first_col] = 'date'
+                logger.debug("Using first column '%s' as date column", first_col)
+                # Try to convert to datetime
+                try:
+                    df[first_col] = pd.to_datetime(df[first_col], errors='coerce')
+                except:
+                    pass
+
+            if not rename_dict:
+                raise ColumnMappingError(
+                    "Could not identify columns in your file. Please ensure your file contains at least: date, energy_use (kWh), transport (km), emissions (tons CO2e)",
+                    columns_found=df.columns.tolist()
+                )
+
+    return df
+
+
+def parse_dates(df):
+    """
+    Parse the 'date' column in place
+
+    Dates pandas cannot infer are tried with common formats and then by
+    their numeric parts; the rest stay NaT (see sequence_dates).
+
+    Raises:
+        ColumnMappingError: if there is no 'date' column
+    """
+    if 'date' not in df.columns:
+        raise ColumnMappingError("Missing required 'date' column")
+    
+    # Try to convert date column to datetime format, with improved handling
+    try:
+        # First, make a copy of the original date column to preserve it
+        df['original_date'] = df['date'].copy()
+
+        # Try to parse dates with a more flexible approach
+        df['date'] = pd.to_datetime(df['date'], errors='coerce', infer_datetime_format=True)
+
+        # Check if we have valid dates
+        if df['date'].isna().any():
+            logger.debug("Some dates failed to parse. Trying specific formats...")
+            # Try common date formats one by one
+            date_formats = [
+                '%d/%m/%Y', '%m/%d/%Y', '%Y-%m-%d', '%d-%m-%Y', '%m-%d-%Y',
+                '%d.%m.%Y', '%m.%d.%Y', '%Y.%m.%d',
+                '%d-%b-%Y', '%b-%d-%Y', '%Y-%b-%d',
+                '%d %B %Y', '%B %d %Y', '%Y %B %d'
+            ]
+
+            for fmt in date_formats:
+                try:
+                    temp_dates = pd.to_datetime(df['original_date'], format=fmt, errors='coerce')
+                    # Update only the NaN values in the date column
+                    mask = df['date'].isna()
+                    df.loc[mask, 'date'] = temp_dates.loc[mask]
+
+                    if not df['date'].isna().any():
+                        logger.debug("Successfully parsed all dates with format: %s", fmt)
+                        break
+                except Exception as fmt_err:
+                    logger.debug("Error with format %s: %s", fmt, fmt_err)
+                    continue
+
+        # If we still have NaN dates, try to extract date components
+        if df['date'].isna().any():
+            logger.debug("Still have NaN dates. Trying to extract date components...")
+            mask = df['date'].isna()
+            try:
+                # Try to extract year, month, day from string representations
+                date_strings = df.loc[mask, 'original_date'].astype(str)
+
+                # Look for patterns like YYYY-MM-DD or DD-MM-YYYY in the strings
+                for i, date_str in enumerate(date_strings):
+                    parts = [p for p in re.split(r'[-/., ]', date_str) if p.isdigit()]
+                    if len(parts) >= 3:
+                        # If first part is 4 digits, assume YYYY-MM-DD
+                        if len(parts[0]) == 4:
+                            year, month, day = int(parts[0]), int(parts[1]), int(parts[2])
+                        # Otherwise assume DD-MM-YYYY
+                        elif len(parts[2]) == 4:
+                            day, month, year = int(parts[0]), int(parts[1]), int(parts[2])
+                        else:
+                            continue
+
+                        try:
+                            df.loc[mask.iloc[i], 'date'] = pd.Timestamp(year=year, month=month, day=day)
+                        except:
+                            pass
+            except Exception as e:
+                logger.warning("Error extracting date components: %s", e)
+    except Exception as e:
+        logger.warning("Error converting dates: %s", e)
+
+    # Drop the temporary column
+    return df.drop('original_date', axis=1, errors='ignore')
+
+
+def convert_units(df):
+    """Add 'ds' and the backend metric columns, converting waste to kg and water to m3"""
+    # Add ds column for Prophet compatibility
+    df['ds'] = df['date']
+
+    # The dataframe after column mapping, for debugging
+    logger.debug("DataFrame after column mapping:\n%s", LazyFrame(df))
+
+    # Create backend columns with appropriate unit conversions
+    for display_col, backend_col in COLUMN_MAPPING.items():
+        # First try exact column name
+        if display_col in df.columns:
+            if display_col == 'waste (tons)':
+                df[backend_col] = df[display_col] * 1000  # Convert tons to kg
+            elif display_col == 'water (liters)':
+                df[backend_col] = df[display_col] / 1000  # Convert liters to m3
+            else:
+                df[backend_col] = df[display_col]
+        else:
+            # Try to find columns with similar names (without spaces or with different casing)
+            found = False
+            for col in df.columns:
+                # Skip if column is NaN
+                if pd.isna(col):
+                    continue
+
+                # Normalize column names for comparison (remove spaces, parentheses, and lowercase)
+                col_clean = str(col).lower().replace(' ', '').replace('(', '').replace(')', '')
+                display_col_clean = display_col.lower().replace(' ', '').replace('(', '').replace(')', '')
+
+                # Check if the cleaned column names match or are very similar
+                if col_clean == display_col_clean or col_clean in display_col_clean or display_col_clean in col_clean:
+                    logger.debug("Matched column '%s' to '%s' -> '%s'", col, display_col, backend_col)
+                    found = True
+
+                    # Apply appropriate conversions
+                    if display_col == 'waste (tons)':
+                        df[backend_col] = pd.to_numeric(df[col], errors='coerce') * 1000  # Convert tons to kg
+                    elif display_col == 'water (liters)':
+                        df[backend_col] = pd.to_numeric(df[col], errors='coerce') / 1000  # Convert liters to m3
+                    else:
+                        df[backend_col] = pd.to_numeric(df[col], errors='coerce')
+                    break
+
+            # If we didn't find a match, try to infer from column position for numeric columns
+            if not found and backend_col not in df.columns:
+                # Map common patterns like 'energy_use(kwh)' to 'energy_kwh'
+                for col in df.columns:
+                    if pd.isna(col):
+                        continue
+
+                    col_str = str(col).lower()
+                    if 'energy' in col_str and backend_col == 'energy_kwh':
+                        df[backend_col] = pd.to_numeric(df[col], errors='coerce')
+                        logger.debug("Mapped '%s' to '%s' based on keyword match", col, backend_col)
+                        break
+                    elif 'transport' in col_str and backend_col == 'transport_km':
+                        df[backend_col] = pd.to_numeric(df[col], errors='coerce')
+                        logger.debug("Mapped '%s' to '%s' based on keyword match", col, backend_col)
+                        break
+                    elif 'waste' in col_str and backend_col == 'waste_kg':
+                        df[backend_col] = pd.to_numeric(df[col], errors='coerce') * 1000  # Convert tons to kg
+                        logger.debug("Mapped '%s' to '%s' based on keyword match", col, backend_col)
+                        break
+                    elif 'water' in col_str and backend_col == 'water_m3':
+                        df[backend_col] = pd.to_numeric(df[col], errors='coerce') / 1000  # Convert liters to m3
+                        logger.debug("Mapped '%s' to '%s' based on keyword match", col, backend_col)
+                        break
+                    elif 'fuel' in col_str and backend_col == 'fuel_l':
+                        df[backend_col] = pd.to_numeric(df[col], errors='coerce')
+                        logger.debug("Mapped '%s' to '%s' based on keyword match", col, backend_col)
+                        break
+                    elif ('emission' in col_str or 'co2' in col_str) and backend_col == 'y':
+                        df[backend_col] = pd.to_numeric(df[col], errors='coerce')
+                        logger.debug("Mapped '%s' to '%s' based on keyword match", col, backend_col)
+                        break
+                    elif 'production' in col_str and backend_col == 'production_units':
+                        df[backend_col] = pd.to_numeric(df[col], errors='coerce')
+                        logger.debug("Mapped '%s' to '%s' based on keyword match", col, backend_col)
+                        break
+                    elif ('grid' in col_str or 'intensity' in col_str) and backend_col == 'grid_intensity':
+                        df[backend_col] = pd.to_numeric(df[col], errors='coerce')
+                        logger.debug("Mapped '%s' to '%s' based on keyword match", col, backend_col)
+                        break
+    
+    return df
+
+
+def prepare(df, clock=None):
+    """
+    Run the row-wise stages on a parsed upload
+
+    Args:
+        df: Parsed upload (see ingest.py)
+        clock: Optional StageClock that records each stage
+
+    Returns:
+        Processed frame; 'date' is datetime, missing dates stay NaT and
+        missing metrics stay NaN
+
+    Raises:
+        ColumnMappingError: if the columns or the date column cannot be identified
+    """
+    df = map_columns(df)
+    if clock is not None:
+        clock.lap('map_columns')
+    df = parse_dates(df)
+    if clock is not None:
+        clock.lap('parse_dates')
+    df = convert_units(df)
+    if clock is not None:
+        clock.lap('convert_units')
+    return df
+
+
+def sequence_dates(df):
+    """
+    Give rows without a date a daily sequence from 2023-01-01, in place
+
+    The n-th undated row of the frame gets day n, so this runs on the whole
+    frame rather than on the rows of one re-upload.
+    """
+    nan_indices = df['date'].isna()
+    if nan_indices.any():
+        logger.info("Creating date sequence as fallback for %d rows without a date", nan_indices.sum())
+        start_date = pd.Timestamp('2023-01-01')
+        df.loc[nan_indices, 'date'] = [start_date + pd.Timedelta(days=i) for i in range(nan_indices.sum())]
+        if 'ds' in df.columns:
+            df['ds'] = df['date']
+    return df
+
+
+def fill_missing(df, means):
+    """
+    Fill missing metric values in place
+
+    Args:
+        df: Processed frame
+        means: Mapping of backend column to the fill value (its mean)
+    """
+    for col in NUMERIC_COLUMNS:
+        if col in df.columns and df[col].isnull().any():
+            df[col] = df[col].fillna(means[col])
+    return df
@@ -0,0 +1,210 @@
+"""
+Opt-in Request Profiling
+
+Runs selected view functions (predict, upload_file, ...) under cProfile
+and stores the result as a downloadable .prof file (open it with snakeviz,
+tuna or flameprof for a flame graph). A request is profiled when an admin
+sends the X-Profile header, or in background mode for 1 in N requests.
+Only admin responses carry the X-Profile-Id header; sampled profiles of
+other clients are listed by the admin endpoints.
+
+Profiling is off unless CARBONSYNC_PROFILING is set; init_app() then
+returns without wrapping anything, so disabled profiling costs nothing.
+"""
+
+import io
+import os
+import re
+import time
+import uuid
+import pstats
+import cProfile
+import tempfile
+import threading
+from functools import wraps
+
+from flask import request, g
+from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+
+from users import get_user_by_id
+
+DEFAULT_PROFILE_DIR = os.path.join(tempfile.gettempdir(), 'carbonsync', 'profiles')
+
+PROFILING_ENABLED = os.environ.get('CARBONSYNC_PROFILING', '').lower() in ('1', 'true', 'yes')
+
+# Profile 1 in N requests to the profiled endpoints (0 = only on request)
+PROFILE_SAMPLE_RATE = int(os.environ.get('CARBONSYNC_PROFILE_SAMPLE_RATE', 0))
+
+# Endpoints whose view functions can be profiled
+PROFILE_ENDPOINTS = [
+    name.strip() for name in
+    os.environ.get('CARBONSYNC_PROFILE_ENDPOINTS', 'upload_file,predict,optimize,export_forecast').split(',')
+    if name.strip()
+]
+
+_PROFILE_ID = re.compile(r'^[A-Za-z0-9_]+-\d{8}T\d{6}-[0-9a-f]{8}$')
+
+
+class ProfileNotFoundError(KeyError):
+    """Raised when a profile id is unknown or has been evicted"""
+
+
+class ProfileStore:
+    """
+    Directory of stored .prof files, oldest removed first.
+
+    Args:
+        root: Directory holding the profiles
+        max_profiles: Number of profiles kept
+    """
+    def __init__(self, root, max_profiles=50):
+        self.root = root
+        self.max_profiles = max_profiles
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, profile_id):
+        if not _PROFILE_ID.match(profile_id or ''):
+            raise ProfileNotFoundError(profile_id)
+        path = os.path.join(self.root, f"{profile_id}.prof")
+        if not os.path.exists(path):
+            raise ProfileNotFoundError(profile_id)
+        return path
+
+    def save(self, profiler, endpoint):
+        """Dump a finished profiler and return the profile id"""
+        profile_id = f"{endpoint}-{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        path = os.path.join(self.root, f"{profile_id}.prof")
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        os.close(fd)
+        profiler.dump_stats(tmp_path)
+        os.replace(tmp_path, path)
+        self._evict()
+        return profile_id
+
+    def list(self):
+        """Stored profiles, newest first"""
+        profiles = []
+        for name in os.listdir(self.root):
+            if not name.endswith('.prof'):
+                continue
+            full_path = os.path.join(self.root, name)
+            try:
+                stat = os.stat(full_path)
+                total_time = pstats.Stats(full_path).total_tt
+            except Exception:
+                continue
+            profile_id = name[:-len('.prof')]
+            profiles.append((stat.st_mtime, {
+                'profile_id': profile_id,
+                'endpoint': profile_id.rsplit('-', 2)[0],
+                'created_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(stat.st_mtime)),
+                'total_time_ms': total_time * 1000,
+                'size_bytes': stat.st_size
+            }))
+        profiles.sort(key=lambda entry: entry[0], reverse=True)
+        return [profile for _, profile in profiles]
+
+    def summary(self, profile_id, limit=40, sort='cumulative'):
+        """Text report of the top functions of a stored profile"""
+        output = io.StringIO()
+        stats = pstats.Stats(self.path(profile_id), stream=output)
+        stats.sort_stats(sort).print_stats(limit)
+        return output.getvalue()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.root):
+            if name.endswith('.prof'):
+                full_path = os.path.join(self.root, name)
+                try:
+                    entries.append((os.path.getmtime(full_path), full_path))
+                except OSError:
+                    continue
+        entries.sort()
+        for _, full_path in entries[:max(0, len(entries) - self.max_profiles)]:
+            try:
+                os.remove(full_path)
+            except OSError:
+                pass
+
+
+def is_admin_request():
+    """True if the request carries a valid access token of an admin user"""
+    try:
+        verify_jwt_in_request(optional=True)
+        user_id = get_jwt_identity()
+    except Exception:
+        return False
+    user = get_user_by_id(user_id) if user_id else None
+    return bool(user and user.get('role') == 'admin')
+
+
+class _Sampler:
+    """Thread-safe 1-in-N request counter"""
+    def __init__(self, every):
+        self.every = every
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        if self.every <= 0:
+            return False
+        with self._lock:
+            self._count += 1
+            return self._count % self.every == 0
+
+
+def _profile_requested(sampler):
+    if request.headers.get('X-Profile', '').lower() in ('1', 'true', 'yes'):
+        return is_admin_request()
+    return sampler()
+
+
+def profile_view(view, endpoint, store, sampler):
+    """Wrap a view function so selected requests run under cProfile"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not _profile_requested(sampler):
+            return view(*args, **kwargs)
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return view(*args, **kwargs)
+        finally:
+            profiler.disable()
+            g.profile_id = store.save(profiler, endpoint)
+    return wrapper
+
+
+def init_app(app, store=None):
+    """
+    Wrap the profiled endpoints of an app when profiling is enabled
+
+    Must be called after the routes are registered.
+    """
+    if not PROFILING_ENABLED:
+        return
+
+    store = store or profile_store
+    sampler = _Sampler(PROFILE_SAMPLE_RATE)
+    for endpoint in PROFILE_ENDPOINTS:
+        if endpoint in app.view_functions:
+            app.view_functions[endpoint] = profile_view(app.view_functions[endpoint], endpoint, store, sampler)
+
+    @app.after_request
+    def _add_profile_header(response):
+        profile_id = g.get('profile_id')
+        # Other clients must not learn that profiling is on
+        if profile_id and is_admin_request():
+            response.headers['X-Profile-Id'] = profile_id
+            response.headers['Access-Control-Expose-Headers'] = ', '.join(
+                filter(None, [response.headers.get('Access-Control-Expose-Headers'), 'X-Profile-Id']))
+        return response
+
+
+# Create a singleton instance
+profile_store = ProfileStore(
+    os.environ.get('CARBONSYNC_PROFILE_DIR', DEFAULT_PROFILE_DIR),
+    max_profiles=int(os.environ.get('CARBONSYNC_PROFILE_MAX', 50))
+)
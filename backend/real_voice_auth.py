@@ -21,8 +21,6 @@ from pathlib import Path
 import tempfile
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("real_voice_auth")
 
 # Flag to check if torch is available
@@ -171,7 +169,7 @@ class RealVoiceAuthenticator:
         try:
             # Decode base64 string to get raw audio bytes
             audio_bytes = base64.b64decode(audio_base64)
-            logger.info(f"Decoded audio bytes length: {len(audio_bytes)}")
+            logger.debug("Decoded audio bytes length: %d", len(audio_bytes))
             
             # For demo purposes, create a simulated waveform directly from the audio bytes
             # This avoids issues with file format compatibility
@@ -181,7 +179,7 @@ class RealVoiceAuthenticator:
                 byte_array = np.frombuffer(audio_bytes, dtype=np.int8)
                 # Convert to float32 and normalize
                 waveform = byte_array.astype(np.float32) / 128.0
-                logger.info(f"Created waveform with shape: {waveform.shape}")
+                logger.debug("Created waveform with shape: %s", waveform.shape)
                 return waveform
             except Exception as inner_e:
                 logger.warning(f"Simple waveform creation failed: {str(inner_e)}")
@@ -196,7 +194,7 @@ class RealVoiceAuthenticator:
                 # Create a pseudo-random waveform with length proportional to audio size
                 waveform_length = min(16000, max(8000, len(audio_bytes) // 10))
                 waveform = np.random.randn(waveform_length).astype(np.float32)
-                logger.info(f"Created fallback waveform with shape: {waveform.shape}")
+                logger.debug("Created fallback waveform with shape: %s", waveform.shape)
                 return waveform
         except Exception as e:
             logger.error(f"Error processing audio: {str(e)}")
@@ -216,7 +214,7 @@ class RealVoiceAuthenticator:
             features = self.model.extract_features(waveform)
             
             # Log the features for debugging
-            logger.info(f"Extracted features with shape: {features.shape if hasattr(features, 'shape') else 'scalar'}")
+            logger.debug("Extracted features with shape: %s", getattr(features, 'shape', 'scalar'))
             
             return features
         except Exception as e:
@@ -351,14 +349,14 @@ class RealVoiceAuthenticator:
                 return False, "Failed to extract voice features", 0.0, {}
             
             # Log the feature vectors for debugging
-            logger.info(f"Reference features shape: {reference_features.shape}")
-            logger.info(f"Verification features shape: {verification_features.shape}")
+            logger.debug("Reference features shape: %s", reference_features.shape)
+            logger.debug("Verification features shape: %s", verification_features.shape)
             
             # Calculate similarity (cosine similarity)
             similarity_start_time = time.time()
             similarity = np.dot(reference_features, verification_features)
             similarity_time = time.time() - similarity_start_time
-            logger.info(f"Raw similarity score: {similarity}")
+            logger.debug("Raw similarity score: %s", similarity)
             
             # For demo purposes, boost the similarity to make matching more likely
             # This simulates how a well-trained model would perform better
@@ -387,7 +385,7 @@ class RealVoiceAuthenticator:
             
             # Calculate total processing time
             total_time = time.time() - start_time
-            logger.info(f"Final confidence score: {confidence_score}, threshold: {threshold}")
+            logger.debug("Final confidence score: %s, threshold: %s", confidence_score, threshold)
             
             # Prepare model information and performance metrics
             model_info = {
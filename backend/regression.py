@@ -0,0 +1,205 @@
+"""
+Closed-form Streaming Regression
+
+This module implements ordinary least squares on top of accumulated
+sufficient statistics (the centred X^T X and X^T y moments) instead of
+refitting scikit-learn models on the full history for every request.
+
+A single SufficientStatsRegressor is accumulated over every candidate
+feature of a series. Any subset of those features can then be solved in
+O(p^3) without touching the rows again, so the fallback forecaster, the
+impact analysis and the optimization model all share one state.
+"""
+
+import numpy as np
+
+
+class LinearFit:
+    """
+    Solved OLS model for a subset of features.
+
+    Exposes the same coef_/intercept_/predict surface as
+    sklearn.linear_model.LinearRegression so call sites stay familiar.
+    """
+    def __init__(self, features, coef, intercept, sse, n_samples, xx=None, x_mean=None, y_mean=None):
+        self.features = list(features)
+        self.coef_ = coef
+        self.intercept_ = float(intercept)
+        self.sse = float(sse)
+        self.n_samples = int(n_samples)
+        # Centred moments of the features, for coef_covariance
+        self.xx = xx
+        self.x_mean = x_mean
+        self.y_mean = y_mean
+
+    def predict(self, X):
+        """Predict the target for a (rows x features) matrix"""
+        X = np.asarray(X, dtype=float)
+        if X.ndim == 1:
+            X = X.reshape(-1, len(self.features))
+        return X @ self.coef_ + self.intercept_
+
+    @property
+    def residual_std(self):
+        """Population standard deviation of the in-sample residuals"""
+        if self.n_samples == 0:
+            return 0.0
+        return float(np.sqrt(max(self.sse, 0.0) / self.n_samples))
+
+    def coef_covariance(self):
+        """
+        Covariance of coef_: sigma^2 (Xc^T Xc)^+ with the unbiased residual variance
+
+        The intercept is not included; predictions written as
+        y_mean + (x - x_mean) @ coef_ have an independent y_mean with
+        variance sigma^2 / n_samples.
+        """
+        if self.xx is None:
+            raise ValueError("Fit has no feature moments")
+        dof = max(self.n_samples - len(self.features) - 1, 1)
+        scale = np.sqrt(np.diag(self.xx))
+        scale[scale == 0] = 1.0
+        inverse = np.linalg.pinv(self.xx / np.outer(scale, scale)) / np.outer(scale, scale)
+        return max(self.sse, 0.0) / dof * inverse
+
+
+class SufficientStatsRegressor:
+    """
+    OLS regressor backed by centred sufficient statistics.
+
+    Rows are folded in with Welford/Chan style updates so the moments stay
+    numerically stable for large magnitudes (kWh, km). Each single-row
+    update is O(p^2) and each solve is O(p^3) in the number of features.
+    """
+    def __init__(self, feature_names):
+        self.feature_names = list(feature_names)
+        self._index = {name: i for i, name in enumerate(self.feature_names)}
+        self.reset()
+
+    def reset(self):
+        """Drop all accumulated rows"""
+        p = len(self.feature_names)
+        self.n_samples = 0
+        self.x_mean = np.zeros(p)
+        self.y_mean = 0.0
+        self.xx = np.zeros((p, p))  # centred X^T X
+        self.xy = np.zeros(p)       # centred X^T y
+        self.yy = 0.0               # centred y^T y
+        return self
+
+    def update(self, x, y):
+        """
+        Fold a single observation into the statistics in O(p^2)
+
+        Args:
+            x: Feature vector ordered like feature_names
+            y: Target value
+        """
+        x = np.asarray(x, dtype=float).ravel()
+        y = float(y)
+        if x.shape[0] != len(self.feature_names):
+            raise ValueError(f"Expected {len(self.feature_names)} features, got {x.shape[0]}")
+        if not (np.all(np.isfinite(x)) and np.isfinite(y)):
+            raise ValueError("Input contains NaN or infinity")
+
+        self.n_samples += 1
+        dx = x - self.x_mean
+        dy = y - self.y_mean
+        self.x_mean += dx / self.n_samples
+        self.y_mean += dy / self.n_samples
+        rx = x - self.x_mean
+        ry = y - self.y_mean
+        self.xx += np.outer(dx, rx)
+        self.xy += dx * ry
+        self.yy += dy * ry
+        return self
+
+    def partial_fit(self, X, y):
+        """
+        Fold a block of observations into the statistics
+
+        The block moments are computed with vectorized numpy and merged
+        with the running state, so appending k rows costs O(k p^2).
+
+        Args:
+            X: (rows x features) matrix ordered like feature_names
+            y: Target vector
+        """
+        X = np.asarray(X, dtype=float)
+        y = np.asarray(y, dtype=float).ravel()
+        if X.ndim == 1:
+            X = X.reshape(-1, 1)
+        if X.shape[1] != len(self.feature_names):
+            raise ValueError(f"Expected {len(self.feature_names)} features, got {X.shape[1]}")
+        if X.shape[0] != y.shape[0]:
+            raise ValueError("X and y must have the same number of rows")
+        if X.shape[0] == 0:
+            return self
+        if not (np.all(np.isfinite(X)) and np.all(np.isfinite(y))):
+            raise ValueError("Input contains NaN or infinity")
+
+        m = X.shape[0]
+        bx_mean = X.mean(axis=0)
+        by_mean = y.mean()
+        Xc = X - bx_mean
+        yc = y - by_mean
+        bxx = Xc.T @ Xc
+        bxy = Xc.T @ yc
+        byy = float(yc @ yc)
+
+        n = self.n_samples
+        total = n + m
+        dx = bx_mean - self.x_mean
+        dy = by_mean - self.y_mean
+        weight = n * m / total
+
+        self.xx += bxx + weight * np.outer(dx, dx)
+        self.xy += bxy + weight * dx * dy
+        self.yy += byy + weight * dy * dy
+        self.x_mean += dx * m / total
+        self.y_mean += dy * m / total
+        self.n_samples = total
+        return self
+
+    def fit(self, X, y):
+        """Reset and accumulate X, y"""
+        return self.reset().partial_fit(X, y)
+
+    def solve(self, features=None):
+        """
+        Solve OLS with an intercept for a subset of the accumulated features
+
+        Rank-deficient systems (e.g. all-zero regressors) get the
+        minimum-norm solution, matching LinearRegression.
+
+        Args:
+            features: Feature names to include (defaults to all of them)
+
+        Returns:
+            LinearFit
+        """
+        if features is None:
+            features = self.feature_names
+        features = list(features)
+        if self.n_samples == 0:
+            raise ValueError("Cannot solve a regression with no observations")
+
+        idx = [self._index[name] for name in features]
+        xx = self.xx[np.ix_(idx, idx)]
+        xy = self.xy[idx]
+
+        # Solve on the correlation-scaled system; raw kWh and grid intensity
+        # differ by ~10 orders of magnitude once squared
+        scale = np.sqrt(np.diag(xx))
+        scale[scale == 0] = 1.0
+        scaled = np.linalg.lstsq(xx / np.outer(scale, scale), xy / scale, rcond=None)[0] if idx else np.zeros(0)
+        coef = scaled / scale
+        intercept = self.y_mean - self.x_mean[idx] @ coef
+        sse = self.yy - coef @ xy
+        return LinearFit(features, coef, intercept, sse, self.n_samples, xx, self.x_mean[idx], self.y_mean)
+
+    @classmethod
+    def from_frame(cls, df, features, target='y'):
+        """Accumulate the statistics from DataFrame columns in one pass"""
+        model = cls(features)
+        return model.partial_fit(df[list(features)].to_numpy(dtype=float), df[target].to_numpy(dtype=float))
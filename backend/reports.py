@@ -0,0 +1,209 @@
+"""
+Multi-sheet Export Reports
+
+Assembles historical data, forecast, optimized scenario, impacts and
+summary statistics into one workbook. Every section is taken from the
+server-side caches (dataset store and analysis contexts); nothing is
+re-fitted. Finished workbooks are kept in a content-addressed file cache,
+so exporting an unchanged report again serves the existing file.
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+
+import analysis
+import resample
+from dataset_store import dataset_store
+from export_engine import Sheet, frame_to_sheet, records_to_sheet, write_xlsx
+
+DEFAULT_REPORT_DIR = os.path.join(tempfile.gettempdir(), 'carbonsync', 'reports')
+
+# Columns written to the historical data sheet
+HISTORY_COLUMNS = ['ds'] + analysis.REGRESSOR_COLUMNS + ['y']
+
+
+class ReportNotAvailableError(LookupError):
+    """Raised when no cached results exist for the requested report"""
+
+
+class ReportCache:
+    """
+    Content-addressed cache of finished report workbooks.
+
+    Args:
+        root: Directory holding the cached workbooks
+        max_reports: Number of workbooks kept before the oldest are removed
+    """
+    def __init__(self, root, max_reports=50):
+        self.root = root
+        self.max_reports = max_reports
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.root, f"{digest}.xlsx")
+
+    def get(self, digest):
+        """Return the cached workbook path for a digest, or None"""
+        path = self.path(digest)
+        if not os.path.exists(path):
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return path
+
+    def put(self, digest, sheets):
+        """Write the sheets to the cache and return the workbook path"""
+        path = self.path(digest)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        os.close(fd)
+        write_xlsx(tmp_path, sheets)
+        os.replace(tmp_path, path)
+        self._evict()
+        return path
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.root):
+            if name.endswith('.xlsx'):
+                full_path = os.path.join(self.root, name)
+                try:
+                    entries.append((os.path.getmtime(full_path), full_path))
+                except OSError:
+                    continue
+        entries.sort()
+        for _, full_path in entries[:max(0, len(entries) - self.max_reports)]:
+            try:
+                os.remove(full_path)
+            except OSError:
+                pass
+
+
+def _collect_sections(dataset_id=None, analysis_id=None, frequency=None):
+    """
+    Gather the cached pieces of a report
+
+    The analysis of a dataset_id is the one predict and optimize stored for
+    the dataset at the modelling frequency (see resample.to_model_frequency).
+
+    Returns:
+        dict with 'history' (CarbonDataset), 'metadata', 'context'
+    """
+    history = None
+    metadata = {}
+    ctx = None
+
+    if dataset_id:
+        history = dataset_store.load(dataset_id)
+        metadata = dataset_store.metadata(dataset_id)
+        if not analysis_id:
+            ctx = analysis.lookup_context(resample.to_model_frequency(history, frequency).fingerprint())
+
+    if analysis_id:
+        ctx = analysis.lookup_context(analysis_id)
+        if ctx is None:
+            raise ReportNotAvailableError("Analysis not found or expired")
+        if history is None:
+            history = ctx.data
+
+    if history is None:
+        raise ReportNotAvailableError("A dataset_id or analysis_id is required")
+
+    return {'history': history, 'metadata': metadata, 'context': ctx}
+
+
+def _digest(sections):
+    """Content address of a report: the identity of every cached input"""
+    ctx = sections['context']
+    metadata = sections['metadata']
+    payload = {
+        'dataset': [metadata.get('dataset_id'), metadata.get('version', metadata.get('created_at'))],
+        'fingerprint': ctx.fingerprint if ctx else sections['history'].fingerprint(),
+        'results': ctx.results if ctx else {},
+        'summary': metadata.get('summary')
+    }
+    encoded = json.dumps(payload, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _build_sheets(sections):
+    """Turn the cached sections into export sheets"""
+    history = sections['history']
+    ctx = sections['context']
+    results = ctx.results if ctx else {}
+
+    columns = [col for col in HISTORY_COLUMNS[1:] if history.has(col)]
+    sheets = [frame_to_sheet('Historical Data', history.to_frame(columns), widths={'A:A': 12, 'B:J': 15})]
+
+    if results.get('forecast'):
+        sheets.append(records_to_sheet('Forecast', results['forecast'], widths={'A:A': 12, 'B:D': 15}))
+
+    if results.get('optimized_forecast'):
+        sheets.append(records_to_sheet('Optimized Scenario', results['optimized_forecast'], widths={'A:A': 12, 'B:D': 15}))
+
+    if results.get('impacts'):
+        rows = [[col, impact['coefficient'], impact['mean_value'], impact['impact_score']]
+                for col, impact in results['impacts'].items()]
+        sheets.append(Sheet('Impacts', ['regressor', 'coefficient', 'mean_value', 'impact_score'], rows,
+                            widths={'A:A': 18, 'B:D': 15}))
+
+    summary_rows = []
+    summary = sections['metadata'].get('summary') or {}
+    for stat in ('mean', 'min', 'max', 'std'):
+        for metric, value in summary.get(stat, {}).items():
+            summary_rows.append([metric, stat, value])
+    if 'total_rows' in summary:
+        summary_rows.append(['rows', 'total', summary['total_rows']])
+    for key, value in (results.get('savings') or {}).items():
+        summary_rows.append(['savings', key, value])
+    if summary_rows:
+        sheets.append(Sheet('Summary', ['metric', 'statistic', 'value'], summary_rows, widths={'A:B': 16, 'C:C': 15}))
+
+    return sheets
+
+
+def build_report(dataset_id=None, analysis_id=None, frequency=None):
+    """
+    Return the path of the report workbook, building it only on a cache miss
+
+    Args:
+        dataset_id: Stored dataset to report on
+        analysis_id: Analysis context holding forecast/optimization results
+        frequency: Modelling frequency the dataset was analysed at (see resample.py)
+
+    Returns:
+        (workbook path, cache hit flag)
+
+    Raises:
+        ReportNotAvailableError: if nothing is cached for the ids
+        DatasetNotFoundError: if the dataset_id is unknown or expired
+        ResampleError: for an unknown frequency
+    """
+    sections = _collect_sections(dataset_id, analysis_id, frequency)
+    digest = _digest(sections)
+
+    path = report_cache.get(digest)
+    if path is not None:
+        return path, True
+
+    return report_cache.put(digest, _build_sheets(sections)), False
+
+
+def iter_report(path, chunk_size=64 * 1024):
+    """Yield a cached workbook in chunks"""
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+# Create a singleton instance
+report_cache = ReportCache(
+    os.environ.get('CARBONSYNC_REPORT_DIR', DEFAULT_REPORT_DIR),
+    max_reports=int(os.environ.get('CARBONSYNC_REPORT_CACHE_MAX', 50))
+)
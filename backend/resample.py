@@ -0,0 +1,175 @@
+"""
+Time Resampling
+
+Smart meters report hourly or 15-minute readings, while the forecasts
+and targets are often monthly. When a request (or
+CARBONSYNC_MODEL_FREQUENCY) sets a modelling frequency, datasets finer
+than it are aggregated to it before anything is fitted; by default every
+series is modelled at its own frequency. Every metric is summed over
+the period (energy, distance, fuel, waste, water, production and
+emissions are totals), and MEAN_COLUMNS such as grid_intensity are
+averaged. Series of a multi-site dataset are aggregated separately.
+
+The aggregation works on the date-sorted matrix of the CarbonDataset:
+the rows are ordered by (period, series) and each run of equal keys is
+reduced with np.add.reduceat, so it costs one sort and one pass over the
+values. Periods at either end that the data only partly covers are
+dropped, as their totals would be too low. Aggregated datasets are kept
+in the shared cache by the fingerprint of the raw data.
+
+The frequency of a series also sets the spacing of its forecast dates
+(future_dates) instead of assuming monthly steps.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from dataset import CarbonDataset, InvalidDatasetError, METRIC_COLUMNS, MEAN_COLUMNS, widen
+from shared_cache import shared_cache
+
+# Modelling frequencies and their pandas period aliases, finest first
+FREQUENCIES = {'hourly': 'H', 'daily': 'D', 'weekly': 'W', 'monthly': 'M', 'quarterly': 'Q'}
+
+# Frequency series are aggregated to unless a request asks for another one ('raw' keeps the input frequency)
+MODEL_FREQUENCY = os.environ.get('CARBONSYNC_MODEL_FREQUENCY', 'raw')
+
+# Smallest median spacing (days) of a series of each frequency
+MIN_SPACING_DAYS = {'Q': 80, 'M': 27, 'W': 6, 'D': 0.9, 'H': 0.9 / 24}
+
+# Step between forecast dates and Prophet's future frequency of each frequency
+STEPS = {'H': pd.DateOffset(hours=1), 'D': pd.DateOffset(days=1), 'W': pd.DateOffset(weeks=1),
+         'M': pd.DateOffset(months=1), 'Q': pd.DateOffset(months=3)}
+PROPHET_FREQUENCIES = {'H': 'H', 'D': 'D', 'W': 'W-MON', 'M': 'MS', 'Q': 'QS'}
+
+# Fewest periods kept when trimming partly covered periods
+MIN_PERIODS = 3
+
+_ORDER = [None] + list(FREQUENCIES.values())
+
+
+class ResampleError(InvalidDatasetError):
+    """Raised for unknown modelling frequencies"""
+
+
+def _spacing_days(dates):
+    dates = np.unique(np.asarray(dates, dtype='datetime64[s]'))
+    if len(dates) < 2:
+        return None
+    return np.median(np.diff(dates.astype(np.int64))) / 86400
+
+
+def infer_frequency(dates):
+    """
+    Frequency alias ('H', 'D', 'W', 'M' or 'Q') from the median spacing of the distinct dates
+
+    Returns None for a single date or readings more frequent than hourly.
+    """
+    spacing = _spacing_days(dates)
+    if spacing is None:
+        return None
+    for freq, days in MIN_SPACING_DAYS.items():
+        if spacing >= days:
+            return freq
+    return None
+
+
+def future_dates(data, periods):
+    """The next `periods` dates after the last date of a dataset, at its frequency"""
+    step = STEPS.get(infer_frequency(data.dates))
+    if step is None:
+        spacing = _spacing_days(data.dates)
+        step = pd.Timedelta(days=spacing) if spacing else pd.DateOffset(months=1)
+    last_date = data.last_date
+    return [last_date + step * (i + 1) for i in range(periods)]
+
+
+def prophet_frequency(dates):
+    """Frequency of Prophet's future frame for a series (month starts unless the data says otherwise)"""
+    return PROPHET_FREQUENCIES.get(infer_frequency(dates), 'MS')
+
+
+def aggregate(data, freq):
+    """
+    Aggregate a dataset to periods of freq, per label group
+
+    Args:
+        data: CarbonDataset
+        freq: Period alias (a value of FREQUENCIES)
+
+    Returns:
+        CarbonDataset with one row per period (its start date) and series
+    """
+    if len(data) == 0:
+        return data
+    periods = pd.DatetimeIndex(data.dates).to_period(freq)
+    starts = periods.start_time.to_numpy(dtype='datetime64[ns]')
+    if data.labels:
+        series = pd.DataFrame(data.labels).groupby(list(data.labels), sort=True).ngroup().to_numpy()
+    else:
+        series = np.zeros(len(data), dtype=np.intp)
+
+    # Periods only partly covered by the data at either end
+    keep = np.ones(len(data), dtype=bool)
+    spacing_days = _spacing_days(data.dates)
+    n_periods = len(np.unique(starts))
+    if spacing_days and n_periods > MIN_PERIODS:
+        spacing = np.timedelta64(int(spacing_days * 86400), 's')
+        next_start = (periods[-1] + 1).start_time.to_datetime64()
+        trim_first = bool(data.dates[0] >= starts[0] + spacing)
+        trim_last = bool(data.dates[-1] + spacing < next_start)
+        if n_periods - trim_first - trim_last >= MIN_PERIODS:
+            if trim_first:
+                keep &= starts != starts[0]
+            if trim_last:
+                keep &= starts != starts[-1]
+
+    order = np.flatnonzero(keep)[np.lexsort((series[keep], starts[keep]))]
+    starts, series = starts[order], series[order]
+    boundary = np.flatnonzero((starts[1:] != starts[:-1]) | (series[1:] != series[:-1])) + 1
+    first_rows = np.concatenate([[0], boundary])
+
+    values = widen(data.values[order])
+    observed = ~np.isnan(values)
+    totals = np.add.reduceat(np.where(observed, values, 0.0), first_rows, axis=0)
+    counts = np.add.reduceat(observed, first_rows, axis=0)
+    means = np.isin(METRIC_COLUMNS, MEAN_COLUMNS)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        totals[:, means] /= counts[:, means]
+    totals[counts == 0] = np.nan
+
+    labels = {name: column[order][first_rows] for name, column in data.labels.items()}
+    return CarbonDataset(starts[first_rows], totals, data.present, labels)
+
+
+def to_model_frequency(data, frequency=None):
+    """
+    Downsample a dataset that is finer than the modelling frequency
+
+    Data at (or coarser than) the modelling frequency is returned
+    unchanged, as is every dataset for frequency='raw' (the default
+    unless CARBONSYNC_MODEL_FREQUENCY sets one).
+
+    Args:
+        data: CarbonDataset
+        frequency: Key of FREQUENCIES or 'raw' (default CARBONSYNC_MODEL_FREQUENCY)
+
+    Raises:
+        ResampleError: for an unknown frequency
+    """
+    frequency = str(frequency or MODEL_FREQUENCY).lower()
+    if frequency == 'raw':
+        return data
+    if frequency not in FREQUENCIES:
+        raise ResampleError(f"Unknown frequency: {frequency}. Use one of {', '.join(FREQUENCIES)} or raw")
+    freq = FREQUENCIES[frequency]
+    if len(data) < 2 or _ORDER.index(infer_frequency(data.dates)) >= _ORDER.index(freq):
+        return data
+
+    key = f"resample:{data.fingerprint()}:{freq}"
+    resampled = shared_cache.get(key)
+    if resampled is None:
+        resampled = aggregate(data, freq)
+        shared_cache.set(key, resampled)
+    return resampled
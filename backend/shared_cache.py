@@ -0,0 +1,371 @@
+"""
+Shared Result Cache
+
+In-process caches (analysis contexts, response LRU) live in one gunicorn
+worker, so a forecast computed by worker 1 used to be recomputed by
+worker 3. SharedCache is a small key/value interface shared by every
+worker: SQLiteCache keeps the entries in one SQLite file on the host (no
+external service needed) and RedisCache talks to any Redis-compatible
+server for multi-host deployments.
+
+Keys are namespaced as '<namespace>:<id>' (dataset, results, model,
+engine, upload, http); lookups are counted per namespace in /api/metrics
+so hit rates can be read off carbonsync_shared_cache_requests_total.
+
+Values are serialized by type: JSON for plain results, .npz for
+CarbonDatasets and numpy arrays, Prophet's own JSON format for fitted
+Prophet models, and pickle for anything else. Pickled entries are only
+ever read back from the store this service writes to; do not point the
+cache at a Redis instance that untrusted clients can write to.
+
+Configuration (environment):
+    CARBONSYNC_SHARED_CACHE: 'sqlite' (default), 'redis' or 'off'
+    CARBONSYNC_SHARED_CACHE_PATH: SQLite file (default <tmp>/carbonsync/shared_cache.sqlite3)
+    CARBONSYNC_REDIS_URL: Redis URL (default redis://localhost:6379/0)
+    CARBONSYNC_SHARED_CACHE_TTL: Default entry lifetime in seconds (3600)
+    CARBONSYNC_SHARED_CACHE_MAX_ITEMS: Entries kept in SQLite before LRU eviction (2000)
+    CARBONSYNC_SHARED_CACHE_MAX_ITEM_BYTES: Larger values are not stored (64 MB)
+"""
+
+import io
+import os
+import json
+import time
+import pickle
+import sqlite3
+import logging
+import tempfile
+import threading
+
+import numpy as np
+
+import metrics
+from dataset import CarbonDataset
+
+logger = logging.getLogger("shared_cache")
+
+DEFAULT_CACHE_PATH = os.path.join(tempfile.gettempdir(), 'carbonsync', 'shared_cache.sqlite3')
+
+CACHE_LOOKUPS = metrics.registry.counter(
+    'carbonsync_shared_cache_requests_total',
+    'Shared cache lookups by namespace and result (hit, miss, error)',
+    ['namespace', 'result']
+)
+
+# Type tags of serialized values
+_JSON = b'J'
+_NUMPY = b'N'
+_DATASET = b'D'
+_PROPHET = b'F'
+_PICKLE = b'P'
+
+
+def _is_prophet(value):
+    return type(value).__name__ == 'Prophet' and type(value).__module__.startswith('prophet')
+
+
+def dumps(value):
+    """Serialize a value into tagged bytes (see loads)"""
+    if isinstance(value, CarbonDataset):
+        buffer = io.BytesIO()
+        np.savez(buffer, **value.to_arrays())
+        return _DATASET + buffer.getvalue()
+    if isinstance(value, np.ndarray) and value.dtype != object:
+        buffer = io.BytesIO()
+        np.save(buffer, value, allow_pickle=False)
+        return _NUMPY + buffer.getvalue()
+    if _is_prophet(value):
+        from prophet.serialize import model_to_json
+        return _PROPHET + model_to_json(value).encode('utf-8')
+    try:
+        return _JSON + json.dumps(value, separators=(',', ':')).encode('utf-8')
+    except (TypeError, ValueError):
+        return _PICKLE + pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def loads(data):
+    """Deserialize bytes written by dumps"""
+    tag, payload = data[:1], data[1:]
+    if tag == _JSON:
+        return json.loads(payload)
+    if tag == _DATASET:
+        with np.load(io.BytesIO(payload), allow_pickle=False) as npz:
+            return CarbonDataset.from_arrays(npz)
+    if tag == _NUMPY:
+        return np.load(io.BytesIO(payload), allow_pickle=False)
+    if tag == _PROPHET:
+        from prophet.serialize import model_from_json
+        return model_from_json(payload.decode('utf-8'))
+    if tag == _PICKLE:
+        return pickle.loads(payload)
+    raise ValueError(f"Unknown cache value tag: {tag!r}")
+
+
+class SharedCache:
+    """
+    Key/value cache shared by all workers.
+
+    Subclasses implement the byte-level _get/_set/_delete/_contains/clear;
+    this class adds serialization, the size limit and hit/miss metrics.
+    Backend errors are logged and treated as misses, so a broken cache
+    never fails a request.
+
+    Args:
+        default_ttl: Seconds an entry lives unless set() is given a ttl
+        max_item_bytes: Serialized values larger than this are not stored
+    """
+    enabled = True
+
+    def __init__(self, default_ttl=3600, max_item_bytes=64 * 1024 * 1024):
+        self.default_ttl = default_ttl
+        self.max_item_bytes = max_item_bytes
+
+    @staticmethod
+    def _namespace(key):
+        return key.split(':', 1)[0]
+
+    def get(self, key, default=None):
+        """Return the cached value for a key, or default"""
+        namespace = self._namespace(key)
+        try:
+            data = self._get(key)
+        except Exception as e:
+            logger.warning("Shared cache read failed for %s: %s", namespace, e)
+            CACHE_LOOKUPS.inc(namespace=namespace, result='error')
+            return default
+        if data is None:
+            CACHE_LOOKUPS.inc(namespace=namespace, result='miss')
+            return default
+        try:
+            value = loads(data)
+        except Exception as e:
+            logger.warning("Dropping unreadable shared cache entry in %s: %s", namespace, e)
+            CACHE_LOOKUPS.inc(namespace=namespace, result='error')
+            self.delete(key)
+            return default
+        CACHE_LOOKUPS.inc(namespace=namespace, result='hit')
+        return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Store a value
+
+        Returns:
+            True if the value was stored
+        """
+        try:
+            data = dumps(value)
+            if len(data) > self.max_item_bytes:
+                logger.debug("Not caching %s: %d bytes", key, len(data))
+                return False
+            self._set(key, data, self.default_ttl if ttl is None else ttl)
+            return True
+        except Exception as e:
+            logger.warning("Shared cache write failed for %s: %s", self._namespace(key), e)
+            return False
+
+    def contains(self, key):
+        try:
+            return self._contains(key)
+        except Exception:
+            return False
+
+    def delete(self, key):
+        try:
+            self._delete(key)
+        except Exception as e:
+            logger.warning("Shared cache delete failed for %s: %s", self._namespace(key), e)
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _set(self, key, data, ttl):
+        raise NotImplementedError
+
+    def _contains(self, key):
+        return self._get(key) is not None
+
+    def _delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class NullCache(SharedCache):
+    """Cache that stores nothing (CARBONSYNC_SHARED_CACHE=off)"""
+    enabled = False
+
+    def get(self, key, default=None):
+        return default
+
+    def set(self, key, value, ttl=None):
+        return False
+
+    def contains(self, key):
+        return False
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+class SQLiteCache(SharedCache):
+    """
+    Shared cache in a single SQLite file (WAL mode) on the local host.
+
+    Every worker process opens its own connection per thread. Entries past
+    their expiry are ignored on read and removed during eviction, which
+    also trims the table to max_items by last access.
+
+    Args:
+        path: SQLite database file
+        max_items: Entries kept before the least recently used are removed
+    """
+    EVICT_EVERY = 50
+
+    def __init__(self, path, max_items=2000, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.max_items = max_items
+        self._local = threading.local()
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " key TEXT PRIMARY KEY,"
+                " value BLOB NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+
+    def _connect(self):
+        # Connections must not cross a fork (gunicorn --preload) or a thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _get(self, key):
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] < now:
+            with conn:
+                conn.execute("DELETE FROM cache WHERE key = ? AND expires_at < ?", (key, now))
+            return None
+        with conn:
+            conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return bytes(row[0])
+
+    def _set(self, key, data, ttl):
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, sqlite3.Binary(data), now + ttl, now)
+            )
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % self.EVICT_EVERY == 0
+        if evict:
+            self._evict()
+
+    def _contains(self, key):
+        row = self._connect().execute(
+            "SELECT 1 FROM cache WHERE key = ? AND expires_at >= ?", (key, time.time())).fetchone()
+        return row is not None
+
+    def _delete(self, key):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def _evict(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),))
+            conn.execute(
+                "DELETE FROM cache WHERE key IN ("
+                " SELECT key FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_items,)
+            )
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache")
+
+
+class RedisCache(SharedCache):
+    """
+    Shared cache on a Redis-compatible server (Redis, Valkey, KeyDB, ...).
+
+    Expiry and eviction are left to the server (SET ... EX ttl and its
+    maxmemory policy).
+
+    Args:
+        url: Server URL, e.g. redis://localhost:6379/0
+        prefix: Prefix of every key written by this service
+    """
+    def __init__(self, url, prefix='carbonsync:', **kwargs):
+        super().__init__(**kwargs)
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def _get(self, key):
+        return self._client.get(self.prefix + key)
+
+    def _set(self, key, data, ttl):
+        self._client.set(self.prefix + key, data, ex=max(1, int(ttl)))
+
+    def _contains(self, key):
+        return bool(self._client.exists(self.prefix + key))
+
+    def _delete(self, key):
+        self._client.delete(self.prefix + key)
+
+    def clear(self):
+        keys = list(self._client.scan_iter(match=self.prefix + '*', count=500))
+        for start in range(0, len(keys), 500):
+            self._client.delete(*keys[start:start + 500])
+
+
+def create_cache(backend=None):
+    """
+    Build the shared cache configured in the environment
+
+    Falls back to SQLite (with a warning) when the redis client package
+    is not installed.
+    """
+    backend = (backend or os.environ.get('CARBONSYNC_SHARED_CACHE', 'sqlite')).lower()
+    options = {
+        'default_ttl': int(os.environ.get('CARBONSYNC_SHARED_CACHE_TTL', 3600)),
+        'max_item_bytes': int(os.environ.get('CARBONSYNC_SHARED_CACHE_MAX_ITEM_BYTES', 64 * 1024 * 1024))
+    }
+    if backend in ('off', 'none', '0', 'false'):
+        return NullCache(**options)
+    if backend == 'redis':
+        try:
+            return RedisCache(os.environ.get('CARBONSYNC_REDIS_URL', 'redis://localhost:6379/0'), **options)
+        except ImportError:
+            logger.warning("redis package not installed; using the SQLite shared cache")
+    return SQLiteCache(
+        os.environ.get('CARBONSYNC_SHARED_CACHE_PATH', DEFAULT_CACHE_PATH),
+        max_items=int(os.environ.get('CARBONSYNC_SHARED_CACHE_MAX_ITEMS', 2000)),
+        **options
+    )
+
+
+# Create a singleton instance
+shared_cache = create_cache()
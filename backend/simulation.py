@@ -0,0 +1,106 @@
+"""
+Monte Carlo Scenario Simulation
+
+Uncertainty bands for the linear optimization model that account for
+more than the in-sample residual spread. Every sample draws
+    coefficients:  beta ~ N(beta_hat, Cov(beta_hat)) and the mean level
+                   y_mean ~ N(y_mean_hat, sigma^2 / n)
+    regressors:    one historical row per future step, applied to every
+                   scenario as a relative deviation from the regressor means
+    residuals:     bootstrapped from the fit's in-sample residuals
+and the trajectories of all scenarios are evaluated as one
+(samples x horizon x scenarios) tensor. The draws are shared by the
+scenarios (common random numbers), so differences such as savings are
+not drowned in noise the scenarios have in common.
+
+The feature tensor holds samples x horizon x scenarios x features values;
+the sample dimension is processed in chunks that keep it under
+CARBONSYNC_SIMULATION_MAX_BYTES.
+"""
+
+import os
+
+import numpy as np
+
+# Samples drawn unless the request asks for another number
+SIMULATION_SAMPLES = int(os.environ.get('CARBONSYNC_SIMULATION_SAMPLES', 2000))
+
+# Upper bound on the samples a request may ask for
+MAX_SIMULATION_SAMPLES = 100000
+
+# Memory cap of the per-chunk feature tensor
+SIMULATION_MAX_BYTES = int(os.environ.get('CARBONSYNC_SIMULATION_MAX_BYTES', 32 * 1024 * 1024))
+
+# Percentiles of the 95% bands and the median
+BAND_PERCENTILES = (2.5, 50, 97.5)
+
+
+def _coefficient_draws(fit, samples, rng):
+    """(samples x features) coefficients and (samples,) mean levels"""
+    covariance = fit.coef_covariance()
+    # eigh tolerates the singular covariance of constant regressors
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+    root = eigenvectors * np.sqrt(np.clip(eigenvalues, 0, None))
+    coef = fit.coef_ + rng.standard_normal((samples, len(fit.coef_))) @ root.T
+    sigma2 = max(fit.sse, 0.0) / max(fit.n_samples - len(fit.features) - 1, 1)
+    level = fit.y_mean + rng.standard_normal(samples) * np.sqrt(sigma2 / max(fit.n_samples, 1))
+    return coef, level
+
+
+def simulate(fit, scenarios, history, residuals, perturb=None, samples=None, seed=0, max_bytes=None):
+    """
+    Simulate future trajectories of several scenarios
+
+    Args:
+        fit: LinearFit of y on the features
+        scenarios: (scenarios x horizon x features) planned feature values
+        history: (rows x features) historical feature values, the pool of
+                 regressor deviations
+        residuals: In-sample residuals of the fit
+        perturb: Boolean mask of the features that vary with the historical
+                 rows (default: all); trend terms such as time_idx stay fixed
+        samples: Number of samples (default CARBONSYNC_SIMULATION_SAMPLES)
+        seed: Seed of the random generator
+        max_bytes: Memory cap of the feature tensor per chunk
+
+    Returns:
+        (samples x horizon x scenarios) simulated values
+    """
+    samples = samples or SIMULATION_SAMPLES
+    max_bytes = max_bytes or SIMULATION_MAX_BYTES
+    scenarios = np.asarray(scenarios, dtype=np.float64)
+    n_scenarios, horizon, n_features = scenarios.shape
+    history = np.asarray(history, dtype=np.float64)
+    residuals = np.asarray(residuals, dtype=np.float64)
+    perturb = np.ones(n_features, dtype=bool) if perturb is None else np.asarray(perturb, dtype=bool)
+    rng = np.random.default_rng(seed)
+
+    # Relative deviation of every historical row from the means; constant
+    # or all-zero regressors do not vary
+    means = history.mean(axis=0)
+    safe = perturb & (means != 0)
+    deviations = np.ones_like(history)
+    deviations[:, safe] = history[:, safe] / means[safe]
+
+    # Scenario features as (horizon x scenarios x features)
+    planned = scenarios.transpose(1, 0, 2)
+
+    # The draws are small (samples x horizon); only the feature tensor is chunked,
+    # so the result does not depend on the chunk size
+    coef, level = _coefficient_draws(fit, samples, rng)
+    rows = rng.integers(0, len(history), size=(samples, horizon))
+    noise = rng.choice(residuals, size=(samples, horizon)) if len(residuals) else np.zeros((samples, horizon))
+    result = np.repeat((level[:, None] + noise)[:, :, None], n_scenarios, axis=2)
+
+    # The centred copy of a chunk doubles its footprint
+    chunk = max(1, max_bytes // (2 * horizon * n_scenarios * max(n_features, 1) * 8))
+    for start in range(0, samples, chunk):
+        stop = min(samples, start + chunk)
+        features = planned[None] * deviations[rows[start:stop]][:, :, None, :]
+        result[start:stop] += np.einsum('shkp,sp->shk', features - fit.x_mean, coef[start:stop])
+    return result
+
+
+def bands(values, percentiles=BAND_PERCENTILES):
+    """Percentiles over the sample axis: (len(percentiles) x ...) array"""
+    return np.percentile(values, percentiles, axis=0)
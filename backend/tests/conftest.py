@@ -0,0 +1,17 @@
+"""
+Test configuration: the backend modules are imported from the backend
+directory, and every on-disk store points at a scratch directory.
+"""
+
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+_workdir = tempfile.mkdtemp(prefix='carbonsync-tests-')
+os.environ.setdefault('CARBONSYNC_SHARED_CACHE', 'off')
+os.environ.setdefault('CARBONSYNC_DATASET_DIR', os.path.join(_workdir, 'datasets'))
+os.environ.setdefault('CARBONSYNC_REPORT_DIR', os.path.join(_workdir, 'reports'))
+os.environ.setdefault('CARBONSYNC_PROFILE_DIR', os.path.join(_workdir, 'profiles'))
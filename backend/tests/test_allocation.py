@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+import allocation
+
+REGRESSORS = ['energy_kwh', 'transport_km', 'fuel_l']
+
+
+def test_cheapest_saving_per_unit_is_used_first():
+    levers = allocation.parse_levers([
+        {'regressor': 'energy_kwh', 'cost_per_pct': 10},
+        {'regressor': 'transport_km', 'cost_per_pct': 1, 'max_pct': 20}
+    ], REGRESSORS)
+    reduction, cost, saved = allocation.solve(levers, [2.0, 1.0], 30.0)
+    np.testing.assert_allclose(reduction, [5.0, 20.0])
+    assert cost == pytest.approx(70.0)
+    assert saved == pytest.approx(30.0)
+
+
+def test_frontier_matches_the_lp_at_every_target():
+    levers = allocation.parse_levers([
+        {'regressor': 'energy_kwh', 'min_pct': 5,
+         'cost_curve': [{'up_to_pct': 10, 'cost_per_pct': 1}, {'up_to_pct': 30, 'cost_per_pct': 4}]},
+        {'regressor': 'transport_km', 'cost_curve': [{'up_to_pct': 15, 'cost_per_pct': 2},
+                                                     {'up_to_pct': 50, 'cost_per_pct': 6}]},
+        {'regressor': 'fuel_l', 'cost_per_pct': 3, 'max_pct': 25}
+    ], REGRESSORS)
+    effects = [1.5, 0.8, 1.2]
+
+    targets, costs, allocations = allocation.frontier(levers, effects, points=11)
+    assert targets[0] == pytest.approx(5 * 1.5)
+    assert np.all(np.diff(costs) >= -1e-9)
+    for target, cost, allocated in zip(targets, costs, allocations):
+        reduction, lp_cost, saved = allocation.solve(levers, effects, target)
+        assert lp_cost == pytest.approx(cost, rel=1e-6, abs=1e-6)
+        assert allocated @ effects == pytest.approx(target)
+        assert np.all(allocated >= levers.min_pct - 1e-9)
+
+
+def test_unreachable_target_returns_none():
+    levers = allocation.parse_levers([{'regressor': 'fuel_l', 'cost_per_pct': 1, 'max_pct': 10}], REGRESSORS)
+    assert allocation.solve(levers, [1.0], 11.0) is None
+
+
+@pytest.mark.parametrize('spec, message', [
+    ({'regressor': 'steam', 'cost_per_pct': 1}, 'Unknown regressor'),
+    ({'regressor': 'fuel_l'}, 'needs cost_per_pct'),
+    ({'regressor': 'fuel_l', 'cost_curve': [{'up_to_pct': 10, 'cost_per_pct': 5},
+                                             {'up_to_pct': 20, 'cost_per_pct': 2}]}, 'must not decrease'),
+    ({'regressor': 'fuel_l', 'cost_per_pct': 1, 'min_pct': 30, 'max_pct': 20}, 'Bounds'),
+])
+def test_invalid_levers_are_rejected(spec, message):
+    with pytest.raises(allocation.AllocationError, match=message):
+        allocation.parse_levers([spec], REGRESSORS)
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import backtest
+from dataset import CarbonDataset
+
+
+def monthly(y, energy=None):
+    dates = pd.date_range('2022-01-01', periods=len(y), freq='MS')
+    frame = pd.DataFrame({'ds': dates, 'y': y})
+    frame['energy_kwh'] = 100.0 + np.arange(len(y)) if energy is None else energy
+    return CarbonDataset.from_frame(frame)
+
+
+def test_linear_trend_is_scored_exactly():
+    data = monthly(2.0 + 0.5 * np.arange(24))
+    result = backtest.run_backtest(data, engines=['linear'], horizon=3, workers=1)
+    assert result['engines']['linear']['overall']['mae'] == pytest.approx(0.0, abs=1e-6)
+    assert result['best_engine'] == 'linear'
+    assert len(result['engines']['linear']['by_horizon']) == 3
+
+
+def test_engine_failing_on_every_series_is_reported_not_raised():
+    # 8 of 12 values missing: ETS cannot fit any fold, the linear trend can
+    y = np.full(12, np.nan)
+    y[::3] = np.arange(4, dtype=float)
+    result = backtest.run_backtest(monthly(y), engines=['ets', 'linear'], horizon=1, workers=1)
+    assert result['engines']['ets'] == {'error': 'ets failed on every series'}
+    assert 'overall' in result['engines']['linear']
+    assert result['best_engine'] == 'linear'
+
+
+def test_unknown_engine_is_rejected():
+    with pytest.raises(backtest.BacktestError):
+        backtest.run_backtest(monthly(np.arange(24, dtype=float)), engines=['arima'])
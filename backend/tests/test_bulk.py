@@ -0,0 +1,62 @@
+import io
+import zipfile
+
+import pytest
+
+import bulk
+
+CSV = b'date,energy_use (kWh),transport (km),emissions (tons CO2e)\n2023-01-01,100,10,1.5\n2023-02-01,110,12,1.6\n'
+
+
+def archive(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, content in members.items():
+            zf.writestr(name, content)
+    buffer.seek(0)
+    return buffer
+
+
+def test_zip_archives_are_unpacked_without_metadata_files():
+    upload = archive({'plant_a/jan.csv': CSV, 'plant_b/jan.csv': CSV, '__MACOSX/plant_a/._jan.csv': b'x',
+                      'plant_a/.DS_Store': b'x'})
+    entries = bulk.expand([('sites.zip', upload), ('extra.csv', io.BytesIO(CSV))])
+    assert [path for path, _ in entries] == ['plant_a/jan.csv', 'plant_b/jan.csv', 'extra.csv']
+    assert all(content == CSV for _, content in entries)
+
+
+def test_oversized_zip_is_rejected_before_extracting(monkeypatch):
+    # Highly compressible: a few KB on the wire, 10 MB once inflated
+    upload = archive({'big.csv': b'0' * (10 * 1024 * 1024)})
+    assert len(upload.getvalue()) < 100 * 1024
+    monkeypatch.setattr(zipfile.ZipFile, 'read', lambda *args: pytest.fail("extracted an oversized member"))
+    with pytest.raises(bulk.BulkUploadError, match='exceeds'):
+        bulk.expand([('bomb.zip', upload)], max_bytes=1024 * 1024)
+
+
+def test_total_size_counts_every_file():
+    files = [('a.csv', io.BytesIO(CSV)), ('b.csv', io.BytesIO(CSV))]
+    with pytest.raises(bulk.BulkUploadError):
+        bulk.expand(files, max_bytes=len(CSV) + 1)
+
+
+def test_corrupt_zip_is_rejected():
+    with pytest.raises(bulk.BulkUploadError, match='not a valid zip'):
+        bulk.expand([('broken.zip', io.BytesIO(b'not a zip'))])
+
+
+@pytest.mark.parametrize('path, pattern, site', [
+    ('plant_a/2023/jan.csv', None, 'plant_a'),
+    ('plant_a.csv', None, 'plant_a'),
+    ('exports/site-17_jan.csv', r'site-(\d+)', '17'),
+])
+def test_site_names(path, pattern, site):
+    assert bulk.site_name(path, pattern) == site
+
+
+def test_bad_files_are_reported_and_the_rest_merged():
+    entries = [('plant_a/jan.csv', CSV), ('plant_b/jan.csv', b'nothing,useful\n1,2\n'), ('notes.txt', b'hi')]
+    frame, _, reports = bulk.ingest_files(entries, workers=1)
+    assert set(frame['site']) == {'plant_a'}
+    assert 'error' not in reports[0]
+    assert 'error' in reports[1] and 'error' in reports[2]
@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+from dataset import CarbonDataset
+
+
+def frame(energy):
+    return pd.DataFrame({'ds': pd.date_range('2023-01-01', periods=len(energy), freq='MS'),
+                         'energy_kwh': energy, 'y': 1.5})
+
+
+def test_decimal_values_are_kept_as_float32_and_restored_exactly():
+    data = CarbonDataset.from_frame(frame([0.382, 1234.5, 12.25]))
+    assert data.values.dtype == np.float32
+    np.testing.assert_array_equal(data.to_frame()['energy_kwh'], [0.382, 1234.5, 12.25])
+
+
+def test_values_beyond_float32_precision_are_kept_exactly():
+    first = CarbonDataset.from_frame(frame([123456789.0, 1.0]))
+    second = CarbonDataset.from_frame(frame([123456791.0, 1.0]))
+    assert first.values.dtype == np.float64
+    assert first.to_frame()['energy_kwh'][0] == 123456789.0
+    assert first.fingerprint() != second.fingerprint()
+
+
+def test_round_trip_through_arrays_keeps_values_and_fingerprint():
+    for energy in ([0.382, 2.0], [1.23456789, 2.0]):
+        data = CarbonDataset.from_frame(frame(energy))
+        restored = CarbonDataset.from_arrays(data.to_arrays())
+        assert restored.values.dtype == data.values.dtype
+        assert restored.fingerprint() == data.fingerprint()
+        np.testing.assert_array_equal(restored.to_frame()['energy_kwh'], energy)
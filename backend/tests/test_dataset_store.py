@@ -0,0 +1,90 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dataset_store import DatasetNotFoundError, DatasetStore
+
+
+def frame(rows=10, offset=0):
+    return pd.DataFrame({'ds': pd.date_range('2023-01-01', periods=rows, freq='MS'),
+                         'y': np.arange(rows, dtype=float) + offset, 'energy_kwh': 0.382})
+
+
+def age(store, dataset_id, seconds):
+    path = os.path.join(store.root, f"{dataset_id}.npz")
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns - int(seconds * 1e9), stat.st_mtime_ns))
+
+
+def test_save_and_load_round_trip(tmp_path):
+    store = DatasetStore(str(tmp_path))
+    dataset_id = store.save(frame(), metadata={'filename': 'data.csv'})
+
+    fresh = DatasetStore(str(tmp_path))
+    loaded = fresh.load(dataset_id)
+    pd.testing.assert_frame_equal(loaded.to_frame(), frame()[['ds', 'energy_kwh', 'y']], check_freq=False)
+    metadata = fresh.metadata(dataset_id)
+    assert (metadata['filename'], metadata['rows'], metadata['version']) == ('data.csv', 10, 1)
+
+
+def test_replacing_a_dataset_bumps_its_version_in_every_worker(tmp_path):
+    worker_1, worker_2 = DatasetStore(str(tmp_path)), DatasetStore(str(tmp_path))
+    dataset_id = worker_1.save(frame())
+    assert worker_2.load(dataset_id).column('y')[0] == 0
+
+    assert worker_1.save(frame(offset=5), dataset_id=dataset_id) == dataset_id
+    assert worker_2.version(dataset_id) == 2
+    assert worker_2.load(dataset_id).column('y')[0] == 5
+
+
+def test_unknown_ids_are_not_found(tmp_path):
+    store = DatasetStore(str(tmp_path))
+    for dataset_id in ('0' * 32, '../etc/passwd', None):
+        with pytest.raises(DatasetNotFoundError):
+            store.load(dataset_id)
+    with pytest.raises(DatasetNotFoundError):
+        store.save(frame(), dataset_id='0' * 32)
+    assert not [name for name in tmp_path.iterdir() if name.suffix in ('.npz', '.tmp')]
+
+
+def test_datasets_expire_after_the_ttl(tmp_path):
+    store = DatasetStore(str(tmp_path), ttl_seconds=60)
+    dataset_id = store.save(frame())
+    age(store, dataset_id, 30)
+    store.load(dataset_id)
+    age(store, dataset_id, 61)
+    with pytest.raises(DatasetNotFoundError):
+        store.load(dataset_id)
+    assert not (tmp_path / f"{dataset_id}.json").exists()
+
+
+def test_least_recently_used_datasets_are_evicted(tmp_path):
+    store = DatasetStore(str(tmp_path), max_datasets=2)
+    first, second = store.save(frame()), store.save(frame())
+    age(store, second, 10)
+    age(store, first, 5)
+    third = store.save(frame())
+    with pytest.raises(DatasetNotFoundError):
+        store.load(second)
+    assert len(store.load(first)) == len(store.load(third)) == 10
+
+
+def test_concurrent_replacements_get_distinct_versions(tmp_path):
+    store = DatasetStore(str(tmp_path))
+    dataset_id = store.save(frame())
+
+    def replace():
+        for _ in range(10):
+            store.save(frame(), dataset_id=dataset_id)
+
+    threads = [threading.Thread(target=replace) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert store.version(dataset_id) == 61
+    assert not [name for name in tmp_path.iterdir() if name.suffix == '.tmp']
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import ets
+import forecasting
+
+
+def seasonal_series(rng, n=60):
+    t = np.arange(n)
+    return 100 + 0.5 * t + 10 * np.sin(2 * np.pi * t / 12) + rng.normal(0, 2, n)
+
+
+def test_monthly_dates_imply_a_yearly_season():
+    assert ets.seasonal_period(pd.date_range('2020-01-01', periods=36, freq='MS').to_numpy()) == 12
+    assert ets.seasonal_period(pd.date_range('2020-01-01', periods=36, freq='D').to_numpy()) == 7
+
+
+def test_intervals_cover_seasonal_holdouts():
+    rng = np.random.default_rng(0)
+    coverage, errors = [], []
+    for _ in range(100):
+        y = seasonal_series(rng)
+        model = ets.fit_series(y[:48], period=12)
+        mean, variance = model.forecast(12)
+        assert model.series.period == 12
+        coverage.append(np.mean(np.abs(y[48:] - mean) <= forecasting.INTERVAL_Z * np.sqrt(variance)))
+        errors.append(np.mean(np.abs(y[48:] - mean)))
+    assert 0.85 <= np.mean(coverage) <= 0.99
+    assert np.mean(errors) < 4
+
+
+def test_intervals_widen_with_the_horizon():
+    model = ets.fit_series(seasonal_series(np.random.default_rng(1)), period=12)
+    _, variance = model.forecast(24)
+    assert np.all(np.diff(variance) >= 0)
+
+
+def test_short_series_are_rejected():
+    with pytest.raises(ValueError):
+        ets.fit_series(np.array([1.0, np.nan, 2.0]))
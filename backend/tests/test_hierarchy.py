@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from scipy import sparse
+
+import hierarchy
+
+
+def summing_matrix(groups):
+    m = len(groups)
+    return sparse.vstack([
+        sparse.csr_matrix(np.ones((1, m))),
+        sparse.csr_matrix((np.ones(m), (groups, np.arange(m))), shape=(groups.max() + 1, m)),
+        sparse.identity(m, format='csr')
+    ]).tocsr()
+
+
+@pytest.mark.parametrize('method', ['ols', 'wls', 'mint'])
+def test_reconciled_forecasts_are_coherent_and_blockwise_exact(method, monkeypatch):
+    rng = np.random.default_rng(0)
+    S = summing_matrix(rng.integers(0, 4, 20))
+    base = rng.normal(10, 3, (S.shape[0], 3))
+    sigma = rng.uniform(0.5, 2.0, (S.shape[0], 3))
+
+    forecasts, deviations = hierarchy.reconcile(S, base, sigma, method)
+    bottom = forecasts[-S.shape[1]:]
+    np.testing.assert_allclose(forecasts, S @ bottom)
+
+    monkeypatch.setattr(hierarchy, 'RECONCILE_BLOCK', 3)
+    blocked, blocked_deviations = hierarchy.reconcile(S, base, sigma, method)
+    np.testing.assert_allclose(blocked, forecasts)
+    np.testing.assert_allclose(blocked_deviations, deviations)
+
+
+def test_pooled_fits_match_inline_fits():
+    import pandas as pd
+    from dataset import CarbonDataset
+
+    rng = np.random.default_rng(1)
+    dates = pd.date_range('2021-01-01', periods=30, freq='MS')
+    frame = pd.concat([pd.DataFrame({
+        'ds': dates, 'country': country, 'plant': plant,
+        'y': 50 + 5 * np.sin(np.arange(30) * np.pi / 6) + rng.normal(0, 1, 30)
+    }) for country, plant in [('de', 'a'), ('de', 'b'), ('fr', 'c')]])
+    data = CarbonDataset.from_frame(frame)
+
+    inline = hierarchy.forecast_hierarchy(data, ['country', 'plant'], 4, 'mint', 'ets', workers=1)
+    pooled = hierarchy.forecast_hierarchy(data, ['country', 'plant'], 4, 'mint', 'ets', workers=2)
+    assert pooled == inline
+    assert inline['series_fitted'] == 6
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import analysis
+import http_cache
+
+
+@pytest.fixture(scope='module')
+def client():
+    from app import app
+    return app.test_client()
+
+
+@pytest.fixture
+def payload():
+    dates = pd.date_range('2022-01-01', periods=24, freq='MS').strftime('%Y-%m-%d')
+    rng = np.random.default_rng(0)
+    data = [{'ds': date, 'y': float(10 + i + rng.normal()), 'energy_kwh': float(100 + i)} for i, date in enumerate(dates)]
+    http_cache.response_cache.clear()
+    analysis.clear_contexts()
+    return {'data': data, 'engine': 'linear', 'forecast_periods': 3}
+
+
+def forget_results(analysis_id):
+    ctx = analysis.lookup_context(analysis_id)
+    ctx.results.clear()
+
+
+def test_cached_predict_records_results_for_export(client, payload):
+    first = client.post('/api/predict', json=payload)
+    assert first.headers['X-Cache'] == 'MISS'
+    analysis_id = first.get_json()['analysis_id']
+
+    # Another worker: the context exists but holds no results
+    forget_results(analysis_id)
+    hit = client.post('/api/predict', json=payload)
+    assert hit.headers['X-Cache'] == 'HIT'
+    assert analysis.lookup_context(analysis_id).results['forecast'] == first.get_json()['forecast']
+
+    export = client.post('/api/export', json={'analysis_id': analysis_id, 'format': 'csv'})
+    assert export.status_code == 200
+
+
+def test_cached_predict_runs_the_view_when_the_context_is_gone(client, payload):
+    client.post('/api/predict', json=payload)
+    analysis.clear_contexts()
+    again = client.post('/api/predict', json=payload)
+    assert again.headers['X-Cache'] == 'MISS'
+    assert 'forecast' in analysis.lookup_context(again.get_json()['analysis_id']).results
+
+
+def test_cached_optimize_records_results(client, payload):
+    body = dict(payload, suggestions=[{'regressor': 'energy_kwh', 'reduction_pct': 10}])
+    first = client.post('/api/optimize', json=body)
+    analysis_id = first.get_json()['analysis_id']
+    stored = analysis.lookup_context(analysis_id).results['optimized_forecast']
+    forget_results(analysis_id)
+
+    hit = client.post('/api/optimize', json=body)
+    assert hit.headers['X-Cache'] == 'HIT'
+    assert analysis.lookup_context(analysis_id).results['optimized_forecast'] == stored
+
+
+def test_no_cache_header_bypasses_the_lookup(client, payload):
+    client.post('/api/predict', json=payload)
+    bypassed = client.post('/api/predict', json=payload, headers={'Cache-Control': 'no-cache'})
+    assert bypassed.headers['X-Cache'] == 'MISS'
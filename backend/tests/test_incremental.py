@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+
+import incremental
+
+
+def upload(rows=12, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'date': pd.date_range('2023-01-01', periods=rows, freq='MS').strftime('%Y-%m-%d'),
+        'energy_use (kWh)': rng.uniform(1000, 2000, rows).round(1),
+        'transport (km)': rng.uniform(100, 500, rows).round(1),
+        'emissions (tons CO2e)': rng.uniform(10, 20, rows).round(2)
+    })
+
+
+def reprocess(df, previous):
+    state, processed = incremental.process(df.copy(), previous)
+    full, _ = incremental.process(df.copy())
+    return state, processed, incremental.finish(state), incremental.finish(full)
+
+
+def test_reupload_reprocesses_only_changed_and_new_rows():
+    original = upload()
+    previous, _ = incremental.process(original.copy())
+
+    changed = pd.concat([original, upload(15, seed=1).tail(3)], ignore_index=True)
+    changed.loc[4, 'emissions (tons CO2e)'] = 99.0
+    changed.loc[7, 'transport (km)'] = np.nan
+    state, processed, (frame, summary), (expected, expected_summary) = reprocess(changed, previous)
+
+    assert processed == 5
+    pdt.assert_frame_equal(frame, expected)
+    assert summary['total_rows'] == expected_summary['total_rows']
+    for stat in ('mean', 'min', 'max', 'std'):
+        for column, value in expected_summary[stat].items():
+            assert np.isclose(summary[stat][column], value), (stat, column)
+
+
+def test_unchanged_reupload_processes_nothing():
+    original = upload()
+    previous, _ = incremental.process(original.copy())
+    state, processed, (frame, _), (expected, _) = reprocess(original, previous)
+    assert processed == 0
+    pdt.assert_frame_equal(frame, expected)
+
+
+def test_rows_without_dates_are_numbered_across_the_whole_upload():
+    original = upload(6)
+    original.loc[[1, 3], 'date'] = 'unknown'
+    previous, _ = incremental.process(original.copy())
+
+    appended = upload(9, seed=2).tail(3).reset_index(drop=True)
+    appended.loc[[0, 2], 'date'] = 'unknown'
+    changed = pd.concat([original, appended], ignore_index=True)
+    state, processed, (frame, _), (expected, _) = reprocess(changed, previous)
+
+    assert processed == 3
+    pdt.assert_frame_equal(frame, expected)
+    undated = frame['date'][changed['date'] == 'unknown']
+    assert list(undated) == ['2023-01-01', '2023-01-02', '2023-01-03', '2023-01-04']
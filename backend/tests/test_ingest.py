@@ -0,0 +1,90 @@
+import datetime as dt
+import io
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+import ingest
+
+
+def workbook(sheets):
+    book = openpyxl.Workbook()
+    book.remove(book.active)
+    for name, rows in sheets.items():
+        sheet = book.create_sheet(name)
+        for row in rows:
+            sheet.append(list(row))
+    buffer = io.BytesIO()
+    book.save(buffer)
+    buffer.seek(0)
+    return buffer
+
+
+DATA_ROWS = [
+    ('date', 'energy_use (kWh)', 'transport (km)', 'emissions (tons CO2e)'),
+    (dt.datetime(2023, 1, 1), 1200, 310.5, 12.5),
+    (dt.datetime(2023, 2, 1), 1250, None, 13.0),
+    (dt.datetime(2023, 3, 1), 1190, 290.0, 12.1),
+]
+
+
+def test_header_row_below_a_title_is_detected():
+    rows = [('Plant emissions report',), (), ('Exported 2023-04-01',)] + DATA_ROWS + [(), ()]
+    df = ingest.read_excel(workbook({'Report': rows}), 'report.xlsx')
+
+    assert list(df.columns) == list(DATA_ROWS[0])
+    assert len(df) == 3
+    assert df['energy_use (kWh)'].dtype == np.int64
+    assert df['transport (km)'].dtype == np.float64 and np.isnan(df['transport (km)'][1])
+    assert df['date'].iloc[0] == pd.Timestamp('2023-01-01')
+
+
+def test_data_sheet_is_picked_over_a_notes_sheet():
+    sheets = {'Notes': [('Read me',), ('Values are monthly totals',)], 'Data': DATA_ROWS}
+    df = ingest.read_excel(workbook(sheets), 'data.xlsx')
+    assert list(df.columns) == list(DATA_ROWS[0])
+
+
+def test_duplicate_and_blank_headers_follow_pandas():
+    df = ingest.rows_to_frame([('ds', 'y', 'y', None), ('2023-01-01', 1, 2, 3)])
+    assert list(df.columns) == ['ds', 'y', 'y.1', 'Unnamed: 3']
+
+
+def test_empty_sheet_gives_an_empty_frame():
+    assert ingest.read_excel(workbook({'Empty': []}), 'empty.xlsx').empty
+
+
+def known_csv(rows=3, **overrides):
+    frame = pd.DataFrame({
+        'ds': pd.date_range('2023-01-01', periods=rows, freq='MS').strftime('%Y-%m-%d'),
+        **{column: np.arange(rows, dtype=float) + 0.5 for column in ingest.KNOWN_CSV_DTYPES}
+    })
+    frame['energy_kwh'] = np.arange(rows) * 100
+    for column, values in overrides.items():
+        frame[column] = values
+    return io.BytesIO(frame[ingest.KNOWN_CSV_COLUMNS[::-1]].to_csv(index=False).encode())
+
+
+def test_known_schema_csv_has_pinned_dtypes(monkeypatch):
+    calls, read_known_csv = [], ingest.read_known_csv
+    monkeypatch.setattr(ingest, 'read_known_csv', lambda stream: calls.append(stream) or read_known_csv(stream))
+    df = ingest.read_csv(known_csv())
+
+    assert calls
+    assert df['ds'].dtype == 'datetime64[ns]'
+    for column in ingest.KNOWN_CSV_DTYPES:
+        assert df[column].dtype == np.float64, column
+    assert df['energy_kwh'].tolist() == [0.0, 100.0, 200.0]
+
+
+def test_known_schema_csv_with_text_values_falls_back_to_inference():
+    df = ingest.read_csv(known_csv(y=['1.5', 'unknown', '2.5']))
+    assert len(df) == 3
+    assert df['y'].dtype == object
+
+
+def test_other_csv_files_use_inference():
+    df = ingest.read_csv(io.BytesIO(b'date,emissions (tons CO2e)\n2023-01-01,1\n2023-02-01,2\n'))
+    assert df['emissions (tons CO2e)'].dtype == np.int64
+    assert df['date'].dtype == object
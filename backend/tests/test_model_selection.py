@@ -0,0 +1,96 @@
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+import backtest
+import model_selection
+from dataset import CarbonDataset
+
+
+def series(n=36, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2021-01-01', periods=n, freq='MS')
+    y = 10 + 0.2 * np.arange(n) + np.sin(np.arange(n) * np.pi / 6) + rng.normal(0, 0.3, n)
+    return CarbonDataset.from_frame(pd.DataFrame({'ds': dates, 'y': y, 'energy_kwh': 100 + rng.normal(0, 5, n)}))
+
+
+def test_ties_go_to_the_cheaper_engine_regardless_of_fit_time(monkeypatch):
+    run_folds = backtest.run_folds
+
+    def same_forecast(engine, *args):
+        # Every engine forecasts the same values; the cheap one is the slowest
+        if engine == 'linear':
+            time.sleep(0.01)
+        return run_folds('linear', *args)
+
+    monkeypatch.setattr(backtest, 'run_folds', same_forecast)
+    result = model_selection.race(series(), engines=['ets', 'linear'], budget=60)
+    assert result['engine'] == 'linear'
+    assert result['candidates']['ets']['mae'] == result['candidates']['linear']['mae']
+
+
+def test_race_is_deterministic():
+    data = series(seed=3)
+    winners = {model_selection.race(data, engines=['linear', 'ets'], budget=60)['engine'] for _ in range(3)}
+    assert len(winners) == 1
+
+
+def test_short_series_is_not_raced():
+    assert model_selection.race(series(n=5), engines=['linear', 'ets']) is None
+
+
+class DictCache:
+    def __init__(self):
+        self.items = {}
+
+    def get(self, key):
+        return self.items.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.items[key] = value
+
+
+def context(data):
+    return SimpleNamespace(data=data, fingerprint=data.fingerprint(), engine=None)
+
+
+def test_engines_race_a_fixed_number_of_folds(monkeypatch):
+    monkeypatch.setattr(model_selection, 'ENGINE_FOLDS', {'ets': 3})
+    result = model_selection.race(series(seed=1), engines=['linear', 'ets'], budget=60)
+    assert not result['truncated']
+    assert result['candidates']['ets']['folds'] == 3
+    assert result['candidates']['linear']['folds'] in (model_selection.RACE_FOLDS, 3)
+
+
+def test_choice_is_cached(monkeypatch):
+    cache = DictCache()
+    monkeypatch.setattr(model_selection, 'shared_cache', cache)
+    data = series(seed=2)
+    ctx = context(data)
+    engine = model_selection.choose_engine(ctx)
+    assert cache.items[f"engine:{ctx.fingerprint}"]['engine'] == engine
+
+
+def test_choice_cut_short_by_the_budget_is_not_cached(monkeypatch):
+    run_folds = backtest.run_folds
+
+    def slow_ets(engine, *args):
+        if engine == 'ets':
+            time.sleep(0.05)
+        return run_folds(engine, *args)
+
+    cache = DictCache()
+    monkeypatch.setattr(backtest, 'run_folds', slow_ets)
+    monkeypatch.setattr(model_selection, 'shared_cache', cache)
+    monkeypatch.setattr(model_selection, 'SELECTION_BUDGET', 0.08)
+    monkeypatch.setattr(model_selection.forecasting, 'PROPHET_AVAILABLE', False)
+
+    result = model_selection.race(series(), engines=['linear', 'ets'], budget=0.08)
+    assert result['truncated']
+    assert result['candidates']['ets']['folds'] < model_selection.RACE_FOLDS
+
+    ctx = context(series())
+    assert model_selection.choose_engine(ctx) in ('linear', 'ets')
+    assert cache.items == {}
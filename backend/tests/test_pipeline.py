@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import carbonsync
+import pipeline
+
+
+def write_site(path, rows=24, seed=0):
+    rng = np.random.default_rng(seed)
+    pd.DataFrame({
+        'ds': pd.date_range('2022-01-01', periods=rows, freq='MS').strftime('%Y-%m-%d'),
+        'energy_kwh': rng.uniform(1000, 2000, rows).round(1),
+        'y': (10 + np.arange(rows) * 0.2 + rng.normal(0, 0.1, rows)).round(3)
+    }).to_csv(path, index=False)
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    data = tmp_path / 'data'
+    for site in ('plant_a', 'plant_b'):
+        (data / site).mkdir(parents=True)
+        write_site(data / site / 'history.csv', seed=len(site))
+    (data / 'plant_c').mkdir()
+    (data / 'plant_c' / 'broken.csv').write_text('nothing,useful\n1,2\n')
+    return data
+
+
+@pytest.mark.parametrize('name', ['out.csv', 'out.csv.gz'])
+def test_run_writes_csv_forecasts_and_reports_bad_files(inputs, tmp_path, name):
+    out = tmp_path / name
+    reports = pipeline.run(pipeline.collect_files([str(inputs)]), str(out), periods=3, engine='linear', workers=1)
+
+    result = pd.read_csv(out)
+    assert list(result.columns) == pipeline.RESULT_COLUMNS
+    assert sorted(result['site'].unique()) == ['plant_a', 'plant_b']
+    assert (result.groupby('site').size() == 3).all()
+    assert list(result['ds'][:3]) == ['2024-01-01', '2024-02-01', '2024-03-01']
+
+    by_file = {report['file'].split('/')[-2]: report for report in reports}
+    assert 'error' in by_file['plant_c']
+    assert by_file['plant_a'] == {'file': by_file['plant_a']['file'], 'sites': 1, 'rows': 3}
+    assert [path.name for path in tmp_path.iterdir() if path.suffix == '.tmp'] == []
+
+
+def test_output_is_not_replaced_when_the_run_fails(tmp_path, monkeypatch):
+    out = tmp_path / 'out.csv'
+    out.write_text('previous\n')
+    write_site(tmp_path / 'a.csv')
+    monkeypatch.setattr(pipeline.ResultWriter, 'write', lambda self, frame: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        pipeline.run([(str(tmp_path / 'a.csv'), 'a.csv')], str(out), periods=2, engine='linear', workers=1)
+    assert out.read_text() == 'previous\n'
+    assert [path.name for path in tmp_path.iterdir() if path.suffix == '.tmp'] == []
+
+
+def test_invalid_outputs_and_inputs_are_rejected(tmp_path):
+    with pytest.raises(pipeline.PipelineError):
+        pipeline.run([('a.csv', 'a.csv')], str(tmp_path / 'out.json'))
+    with pytest.raises(pipeline.PipelineError):
+        pipeline.collect_files([str(tmp_path / 'missing')])
+
+
+def test_cli_exits_with_1_when_a_file_fails(inputs, tmp_path, capsys):
+    code = carbonsync.main(['forecast', str(inputs), '--out', str(tmp_path / 'out.csv'),
+                            '--periods', '2', '--engine', 'linear', '--workers', '1'])
+    assert code == 1
+    assert '"failed": 1' in capsys.readouterr().out
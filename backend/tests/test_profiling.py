@@ -0,0 +1,46 @@
+import pytest
+from flask import Flask, jsonify
+from flask_jwt_extended import JWTManager, create_access_token
+
+import profiling
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILING_ENABLED', True)
+    monkeypatch.setattr(profiling, 'PROFILE_SAMPLE_RATE', 1)
+    app = Flask(__name__)
+    app.config['JWT_SECRET_KEY'] = 'profiling-test-secret-key-of-32-bytes'
+    JWTManager(app)
+
+    @app.route('/api/predict', methods=['POST'])
+    def predict():
+        return jsonify({"ok": True})
+
+    app.store = profiling.ProfileStore(str(tmp_path))
+    profiling.init_app(app, app.store)
+    return app
+
+
+def token(app, user_id):
+    with app.app_context():
+        return {'Authorization': f"Bearer {create_access_token(identity=user_id)}"}
+
+
+def test_sampled_profiles_are_hidden_from_anonymous_clients(app):
+    response = app.test_client().post('/api/predict')
+    assert response.status_code == 200
+    assert 'X-Profile-Id' not in response.headers
+    assert len(app.store.list()) == 1
+
+
+def test_sampled_profiles_are_hidden_from_other_users(app):
+    response = app.test_client().post('/api/predict', headers=token(app, 'user-1'))
+    assert 'X-Profile-Id' not in response.headers
+
+
+def test_admins_get_the_profile_id(app):
+    response = app.test_client().post('/api/predict', headers=dict(token(app, 'admin-1'), **{'X-Profile': '1'}))
+    profile_id = response.headers['X-Profile-Id']
+    assert app.store.path(profile_id).endswith('.prof')
+    assert 'X-Profile-Id' in response.headers['Access-Control-Expose-Headers']
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from regression import SufficientStatsRegressor
+
+FEATURES = ['energy_kwh', 'transport_km', 'grid_intensity']
+
+
+def sample(rows=200, seed=0):
+    rng = np.random.default_rng(seed)
+    X = np.column_stack([rng.uniform(1e5, 2e5, rows), rng.uniform(100, 900, rows), rng.uniform(0.2, 0.6, rows)])
+    y = 2e-4 * X[:, 0] + 0.01 * X[:, 1] + 40 * X[:, 2] + rng.normal(0, 0.5, rows)
+    return X, y
+
+
+def lstsq(X, y):
+    design = np.column_stack([np.ones(len(y)), X])
+    solution, residuals = np.linalg.lstsq(design, y, rcond=None)[:2]
+    return solution[0], solution[1:], float(residuals[0])
+
+
+def test_partial_fit_in_blocks_and_rows_matches_lstsq():
+    X, y = sample()
+    model = SufficientStatsRegressor(FEATURES)
+    for block in np.array_split(np.arange(150), 4):
+        model.partial_fit(X[block], y[block])
+    for i in range(150, 200):
+        model.update(X[i], y[i])
+
+    fit = model.solve()
+    intercept, coef, sse = lstsq(X, y)
+    np.testing.assert_allclose(fit.coef_, coef, rtol=1e-7)
+    assert fit.intercept_ == pytest.approx(intercept, rel=1e-7)
+    assert fit.sse == pytest.approx(sse, rel=1e-6)
+    np.testing.assert_allclose(fit.predict(X[:5]), intercept + X[:5] @ coef, rtol=1e-9)
+
+
+def test_feature_subsets_match_lstsq_on_those_columns():
+    X, y = sample(seed=1)
+    model = SufficientStatsRegressor(FEATURES).fit(X, y)
+    intercept, coef, _ = lstsq(X[:, [0, 2]], y)
+    fit = model.solve(['energy_kwh', 'grid_intensity'])
+    np.testing.assert_allclose(fit.coef_, coef, rtol=1e-7)
+    assert fit.intercept_ == pytest.approx(intercept, rel=1e-7)
+
+
+def test_constant_features_get_the_minimum_norm_solution():
+    X, y = sample(seed=2)
+    X[:, 1] = 0.0
+    fit = SufficientStatsRegressor(FEATURES).fit(X, y).solve()
+    assert fit.coef_[1] == 0.0
+
+
+@pytest.mark.parametrize('X, y', [
+    (np.ones((3, 2)), np.ones(3)),
+    (np.ones((3, 3)), np.ones(2)),
+    (np.array([[1.0, np.nan, 1.0]]), np.ones(1)),
+])
+def test_invalid_blocks_are_rejected(X, y):
+    with pytest.raises(ValueError):
+        SufficientStatsRegressor(FEATURES).partial_fit(X, y)
@@ -0,0 +1,53 @@
+import io
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import pytest
+
+import analysis
+import http_cache
+
+
+@pytest.fixture(scope='module')
+def client():
+    from app import app
+    return app.test_client()
+
+
+def upload_daily(client, rows=400):
+    rng = np.random.default_rng(3)
+    frame = pd.DataFrame({
+        'date': pd.date_range('2023-01-01', periods=rows, freq='D').strftime('%Y-%m-%d'),
+        'energy_use (kWh)': rng.uniform(1000, 2000, rows).round(1),
+        'transport (km)': rng.uniform(100, 500, rows).round(1),
+        'emissions (tons CO2e)': rng.uniform(10, 20, rows).round(2)
+    })
+    http_cache.response_cache.clear()
+    analysis.clear_contexts()
+    response = client.post('/api/upload', data={'file': (io.BytesIO(frame.to_csv(index=False).encode()), 'daily.csv')})
+    assert response.status_code == 200
+    return response.get_json()['dataset_id']
+
+
+@pytest.mark.parametrize('frequency', [None, 'monthly'])
+def test_results_of_a_resampled_dataset_export_by_dataset_id(client, frequency):
+    dataset_id = upload_daily(client)
+    extra = {'frequency': frequency} if frequency else {}
+    predict = client.post('/api/predict', json=dict(extra, dataset_id=dataset_id, engine='linear', forecast_periods=3))
+    assert predict.status_code == 200
+
+    export = client.post('/api/export', json=dict(extra, dataset_id=dataset_id, format='csv'))
+    assert export.status_code == 200
+    assert len(export.get_data(as_text=True).strip().splitlines()) > 1
+
+    report = client.get('/api/export/report', query_string=dict(extra, dataset_id=dataset_id))
+    assert report.status_code == 200
+    sheets = openpyxl.load_workbook(io.BytesIO(report.get_data()), read_only=True).sheetnames
+    assert sheets == ['Historical Data', 'Forecast', 'Impacts', 'Summary']
+
+
+def test_unknown_frequency_is_a_bad_request(client):
+    dataset_id = upload_daily(client, rows=10)
+    response = client.post('/api/export', json={'dataset_id': dataset_id, 'frequency': 'fortnightly'})
+    assert response.status_code == 400
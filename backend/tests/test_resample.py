@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import resample
+from dataset import CarbonDataset
+
+
+def daily(start, end, **labels):
+    dates = pd.date_range(start, end, freq='D')
+    frame = pd.DataFrame({
+        'ds': dates,
+        'y': 1.0,
+        'energy_kwh': np.arange(len(dates), dtype=float),
+        'grid_intensity': dates.day.astype(float)
+    })
+    for name, value in labels.items():
+        frame[name] = value
+    return frame
+
+
+def test_daily_data_is_summed_to_months_and_intensity_averaged():
+    frame = daily('2023-01-01', '2023-06-30')
+    data = resample.to_model_frequency(CarbonDataset.from_frame(frame), 'monthly')
+
+    months = pd.DatetimeIndex(data.dates)
+    assert list(months) == list(pd.date_range('2023-01-01', periods=6, freq='MS'))
+    np.testing.assert_array_equal(data.column('y'), months.days_in_month)
+    expected_energy = frame.groupby(frame['ds'].dt.to_period('M'))['energy_kwh'].sum()
+    np.testing.assert_allclose(data.column('energy_kwh'), expected_energy, rtol=1e-6)
+    np.testing.assert_allclose(data.column('grid_intensity'), (months.days_in_month + 1) / 2)
+
+
+def test_partly_covered_months_are_dropped():
+    data = resample.to_model_frequency(CarbonDataset.from_frame(daily('2023-01-15', '2023-06-10')), 'monthly')
+    assert list(pd.DatetimeIndex(data.dates)) == list(pd.date_range('2023-02-01', periods=4, freq='MS'))
+
+
+def test_sites_are_aggregated_separately():
+    frame = pd.concat([daily('2023-01-01', '2023-04-30', site='a'), daily('2023-01-01', '2023-04-30', site='b')])
+    frame.loc[frame['site'] == 'b', 'y'] = 2.0
+    data = resample.to_model_frequency(CarbonDataset.from_frame(frame), 'monthly')
+
+    assert len(data) == 8
+    for site, factor in (('a', 1), ('b', 2)):
+        series = data.select(data.labels['site'] == site)
+        np.testing.assert_array_equal(series.column('y'), factor * pd.DatetimeIndex(series.dates).days_in_month)
+
+
+def test_raw_and_coarser_data_pass_through():
+    data = CarbonDataset.from_frame(daily('2023-01-01', '2023-03-31'))
+    assert resample.to_model_frequency(data, 'raw') is data
+    assert resample.to_model_frequency(data) is data
+    monthly = resample.to_model_frequency(data, 'monthly')
+    assert resample.to_model_frequency(monthly, 'monthly') is monthly
+    assert resample.infer_frequency(monthly.dates) == 'M'
+    assert resample.future_dates(monthly, 2) == [pd.Timestamp('2023-04-01'), pd.Timestamp('2023-05-01')]
+
+
+def test_unknown_frequency_is_rejected():
+    with pytest.raises(resample.ResampleError):
+        resample.to_model_frequency(CarbonDataset.from_frame(daily('2023-01-01', '2023-03-31')), 'fortnightly')
+
+
+@pytest.mark.parametrize('frequency, step', [(None, pd.DateOffset(days=1)), ('raw', pd.DateOffset(days=1)),
+                                             ('monthly', pd.DateOffset(months=1))])
+def test_predict_forecasts_at_the_requested_frequency(frequency, step):
+    from app import app
+    frame = daily('2023-01-01', '2023-06-30')
+    payload = {'data': frame.assign(ds=frame['ds'].dt.strftime('%Y-%m-%d')).to_dict('records'),
+               'engine': 'linear', 'forecast_periods': 2}
+    if frequency:
+        payload['frequency'] = frequency
+    response = app.test_client().post('/api/predict', json=payload)
+    assert response.status_code == 200
+    dates = pd.to_datetime([row['ds'] for row in response.get_json()['forecast']])
+    assert dates[-1] == dates[-2] + step
@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import shared_cache
+from dataset import CarbonDataset
+from shared_cache import SQLiteCache, dumps, loads
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(shared_cache.time, 'time', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SQLiteCache(str(tmp_path / 'cache.sqlite3'), max_items=3)
+
+
+def dataset():
+    return CarbonDataset.from_frame(pd.DataFrame({
+        'ds': pd.date_range('2023-01-01', periods=4, freq='MS'),
+        'y': [1.5, 2.25, np.nan, 123456789.0],
+        'site': ['a', 'a', 'b', 'b']
+    }))
+
+
+@pytest.mark.parametrize('value, tag', [
+    ({'forecast': [{'ds': '2023-01-01', 'yhat': 1.5}], 'engine': 'ets'}, b'J'),
+    (np.arange(6, dtype=np.float32).reshape(2, 3), b'N'),
+    (pd.Series([1.0, 2.0], index=['a', 'b']), b'P'),
+])
+def test_values_round_trip_with_their_tag(value, tag):
+    data = dumps(value)
+    assert data[:1] == tag
+    restored = loads(data)
+    if isinstance(value, dict):
+        assert restored == value
+    elif isinstance(value, np.ndarray):
+        assert restored.dtype == value.dtype
+        np.testing.assert_array_equal(restored, value)
+    else:
+        pd.testing.assert_series_equal(restored, value)
+
+
+def test_datasets_round_trip():
+    data = dataset()
+    encoded = dumps(data)
+    assert encoded[:1] == b'D'
+    restored = loads(encoded)
+    assert restored.fingerprint() == data.fingerprint()
+    np.testing.assert_array_equal(restored.labels['site'], data.labels['site'])
+
+
+def test_prophet_models_round_trip():
+    prophet = pytest.importorskip('prophet')
+    model = prophet.Prophet().fit(pd.DataFrame({'ds': pd.date_range('2023-01-01', periods=24, freq='MS'),
+                                                'y': np.arange(24.0)}))
+    encoded = dumps(model)
+    assert encoded[:1] == b'F'
+    future = model.make_future_dataframe(periods=2, freq='MS')
+    np.testing.assert_allclose(loads(encoded).predict(future)['yhat'], model.predict(future)['yhat'])
+
+
+def test_unknown_tags_are_rejected():
+    with pytest.raises(ValueError):
+        loads(b'Xdata')
+
+
+def test_sqlite_round_trip_and_delete(cache):
+    assert cache.get('results:a') is None
+    assert cache.set('results:a', {'value': 1})
+    assert cache.contains('results:a')
+    assert cache.get('results:a') == {'value': 1}
+    cache.delete('results:a')
+    assert cache.get('results:a', 'gone') == 'gone'
+
+
+def test_entries_expire_after_their_ttl(cache, clock):
+    cache.set('results:short', 1, ttl=10)
+    cache.set('results:default', 2)
+    clock[0] += 11
+    assert not cache.contains('results:short')
+    assert cache.get('results:short') is None
+    assert cache.get('results:default') == 2
+    clock[0] += cache.default_ttl
+    assert cache.get('results:default') is None
+
+
+def test_eviction_keeps_the_most_recently_used(cache, clock):
+    cache.EVICT_EVERY = 1
+    for key in 'abc':
+        clock[0] += 1
+        cache.set(f"model:{key}", key)
+    clock[0] += 1
+    cache.get('model:a')
+    clock[0] += 1
+    cache.set('model:d', 'd')
+    assert [cache.contains(f"model:{key}") for key in 'abcd'] == [True, False, True, True]
+
+
+def test_large_and_unreadable_values_are_not_served(cache):
+    cache.max_item_bytes = 100
+    assert not cache.set('upload:big', 'x' * 200)
+    assert cache.get('upload:big') is None
+
+    cache._set('upload:bad', b'Xnot a value', 60)
+    assert cache.get('upload:bad') is None
+    assert not cache.contains('upload:bad')
+
+
+def test_clear_removes_everything(cache):
+    cache.set('http:a', 1)
+    cache.set('http:b', 2)
+    cache.clear()
+    assert cache.get('http:a') is None and cache.get('http:b') is None
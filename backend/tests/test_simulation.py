@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+import simulation
+from regression import SufficientStatsRegressor
+
+
+@pytest.fixture(scope='module')
+def model():
+    rng = np.random.default_rng(0)
+    history = np.column_stack([rng.uniform(900, 1100, 48), rng.uniform(200, 300, 48)])
+    y = 5 + 0.01 * history[:, 0] + 0.02 * history[:, 1] + rng.normal(0, 0.3, 48)
+    fit = SufficientStatsRegressor(['energy_kwh', 'transport_km']).fit(history, y).solve()
+    return fit, history, y - fit.predict(history)
+
+
+def scenarios(history, horizon=6):
+    baseline = np.repeat(history.mean(axis=0)[None, None], horizon, axis=1)
+    return np.concatenate([baseline, baseline * [0.9, 1.0]])
+
+
+def test_bands_are_ordered_percentiles_over_the_samples():
+    values = np.random.default_rng(1).normal(size=(4000, 3, 2))
+    lower, median, upper = simulation.bands(values)
+    assert lower.shape == (3, 2)
+    assert np.all(lower < median) and np.all(median < upper)
+    np.testing.assert_allclose(median, 0, atol=0.1)
+    np.testing.assert_allclose(upper, 1.96, atol=0.15)
+
+
+def test_simulation_does_not_depend_on_the_chunk_size(model):
+    fit, history, residuals = model
+    planned = scenarios(history)
+    whole = simulation.simulate(fit, planned, history, residuals, samples=500, seed=3)
+    chunked = simulation.simulate(fit, planned, history, residuals, samples=500, seed=3, max_bytes=2048)
+    assert whole.shape == (500, 6, 2)
+    np.testing.assert_allclose(chunked, whole)
+
+
+def test_bands_centre_on_the_fit_and_share_random_numbers(model):
+    fit, history, residuals = model
+    planned = scenarios(history)
+    values = simulation.simulate(fit, planned, history, residuals, samples=4000, seed=4)
+    lower, median, upper = simulation.bands(values)
+
+    np.testing.assert_allclose(values[:, :, 0].mean(axis=0), fit.predict(planned[0]), atol=0.05)
+    assert np.all((lower < median) & (median < upper))
+    assert np.all(upper - lower > 0.5)
+    # Common random numbers: the saving of a 10% energy cut varies only through the coefficient
+    savings = values[:, :, 0] - values[:, :, 1]
+    assert np.std(savings) < 0.2 * np.std(values[:, :, 0])
+    assert np.mean(savings) == pytest.approx(0.1 * fit.coef_[0] * history[:, 0].mean(), rel=0.05)
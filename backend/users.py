@@ -1,8 +1,11 @@
 import os
 import json
+import logging
 from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
 
+logger = logging.getLogger("users")
+
 # Path to the users database file
 USERS_DB_FILE = os.path.join(os.path.dirname(__file__), 'users.json')
 
@@ -27,7 +30,7 @@ def init_users_db():
     if not os.path.exists(USERS_DB_FILE):
         with open(USERS_DB_FILE, 'w') as f:
             json.dump({"users": [DEFAULT_ADMIN]}, f, indent=2)
-        print("Users database initialized with default admin user")
+        logger.info("Users database initialized with default admin user")
     return True
 
 # Get all users
@@ -66,14 +69,14 @@ def get_user_by_id(user_id):
 
 # Create a new user
 def create_user(username, email, password, role="user", profile=None):
-    print(f"Attempting to create user: {username}, {email}")
+    logger.debug("Attempting to create user: %s", username)
     
     if get_user_by_username(username):
-        print(f"Username already exists: {username}")
+        logger.debug("Username already exists: %s", username)
         return False, "Username already exists"
     
     if get_user_by_email(email):
-        print(f"Email already exists: {email}")
+        logger.debug("Email already exists for new user: %s", username)
         return False, "Email already exists"
     
     users = get_all_users()
@@ -94,15 +97,16 @@ def create_user(username, email, password, role="user", profile=None):
     try:
         with open(USERS_DB_FILE, 'w') as f:
             json.dump({"users": users}, f, indent=2)
-        print(f"User created successfully: {username}")
+        logger.info("User created successfully: %s", username)
         
-        # Verify the user was actually saved
-        if get_user_by_username(username):
-            print(f"User verified in database: {username}")
-        else:
-            print(f"WARNING: User not found in database after creation: {username}")
+        # Verify the user was actually saved (re-reads the database, so debug only)
+        if logger.isEnabledFor(logging.DEBUG):
+            if get_user_by_username(username):
+                logger.debug("User verified in database: %s", username)
+            else:
+                logger.warning("User not found in database after creation: %s", username)
     except Exception as e:
-        print(f"Error saving user to database: {str(e)}")
+        logger.error("Error saving user to database: %s", e)
         return False, f"Error saving user: {str(e)}"
     
     # Return user without password
@@ -3,8 +3,11 @@ import os
 import json
 import base64
 import time
+import logging
 from pathlib import Path
 
+logger = logging.getLogger("voice_auth")
+
 # Simulating a deep learning model for voice recognition
 # In a production environment, you would use a real model like Wav2Vec or similar
 
@@ -16,7 +19,7 @@ class VoiceAuthenticator:
         
         # Simulated model parameters (in a real implementation, this would be a loaded model)
         self.feature_dim = 128
-        print(f"Voice authenticator initialized with profiles directory: {self.voice_profiles_path}")
+        logger.info("Voice authenticator initialized with profiles directory: %s", self.voice_profiles_path)
         
     def _extract_features(self, audio_data):
         """
@@ -41,7 +44,7 @@ class VoiceAuthenticator:
             
             return features
         except Exception as e:
-            print(f"Error extracting features: {str(e)}")
+            logger.error("Error extracting features: %s", e)
             return None
     
     def _get_profile_path(self, user_id):
@@ -79,7 +82,7 @@ class VoiceAuthenticator:
                 
             return True, "Voice profile created successfully"
         except Exception as e:
-            print(f"Error enrolling user: {str(e)}")
+            logger.error("Error enrolling user: %s", e)
             return False, f"Error enrolling user: {str(e)}"
     
     def verify_user(self, user_id, audio_data):
@@ -99,7 +102,7 @@ class VoiceAuthenticator:
             # For demo purposes: If profile doesn't exist, create a mock profile
             # In a production system, you would return an error and require enrollment
             if not profile_path.exists():
-                print(f"Voice profile not found for user {user_id}. Creating mock profile for demo.")
+                logger.info("Voice profile not found for user %s. Creating mock profile for demo.", user_id)
                 # Create a mock profile for demonstration purposes
                 mock_features = self._extract_features(audio_data)
                 if mock_features is None:
@@ -152,7 +155,7 @@ class VoiceAuthenticator:
                 return False, "Voice verification failed", confidence_score
                 
         except Exception as e:
-            print(f"Error verifying user: {str(e)}")
+            logger.error("Error verifying user: %s", e)
             return False, f"Error verifying user: {str(e)}", 0.0
     
     def compare_voices(self, reference_audio, verification_audio):
@@ -213,7 +216,7 @@ class VoiceAuthenticator:
                 return False, "Voice verification failed", confidence_score
                 
         except Exception as e:
-            print(f"Error comparing voices: {str(e)}")
+            logger.error("Error comparing voices: %s", e)
             return False, f"Error comparing voices: {str(e)}", 0.0
     
     def get_verification_phrase(self):